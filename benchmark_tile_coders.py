@@ -0,0 +1,33 @@
+import timeit
+import argparse
+import numpy as np
+from src.function_approximation.tile_coder import TileCoder, LookupTileCoder
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='A script to time encoding observations with TileCoder and LookupTileCoder.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--space', type=float, nargs='+', default=[-1.2, .6, -.07, .07], help='The low and high of each dimension (the default is MountainCar\'s observation space).')
+    parser.add_argument('--num_tiles_per_dim', type=int, nargs='+', default=[5, 5], help='The number of tiles per dimension to use in the tile coders.')
+    parser.add_argument('--num_tilings', type=int, default=8, help='The number of tilings to use in the tile coders.')
+    parser.add_argument('--bias_unit', type=int, choices=[0, 1], default=1, help='Whether or not to include a bias unit in the tile coders.')
+    parser.add_argument('--num_observations', type=int, default=10000, help='The number of random observations to encode.')
+    parser.add_argument('--repeats', type=int, default=5, help='The number of times to repeat each timing (the fastest is reported).')
+    parser.add_argument('--random_seed', type=int, default=1944801619, help='The random seed to use')
+    args = parser.parse_args()
+
+    np.random.seed(args.random_seed)
+    space = np.array(args.space).reshape(-1, 2)
+    observations = np.random.random_sample((args.num_observations, len(space))) * (space[:, 1] - space[:, 0]) + space[:, 0]
+    tile_coders = {
+        'TileCoder': TileCoder(space, args.num_tiles_per_dim, args.num_tilings, args.bias_unit),
+        'LookupTileCoder': LookupTileCoder(space, args.num_tiles_per_dim, args.num_tilings, args.bias_unit)
+    }
+
+    # Both tile coders should give the same indices, so only their speed differs:
+    np.testing.assert_array_equal(tile_coders['LookupTileCoder'].encode_batch(observations), tile_coders['TileCoder'].encode_batch(observations))
+
+    for name, tc in tile_coders.items():
+        encode_time = min(timeit.repeat(lambda: [tc.encode(obs) for obs in observations], number=1, repeat=args.repeats)) / args.num_observations
+        batch_time = min(timeit.repeat(lambda: tc.encode_batch(observations), number=1, repeat=args.repeats)) / args.num_observations
+        print('{}: encode {:.2f}us per observation, encode_batch {:.3f}us per observation'.format(name, encode_time * 1e6, batch_time * 1e6))
@@ -30,6 +30,8 @@ if __name__ == '__main__':
     parser.add_argument('--alpha_v', type=float, nargs='+', default=[1/2**i for i in range(11)], help='Step sizes for the critic\'s auxiliary weights.')
     parser.add_argument('--lambda_c', type=float, nargs='+', default=[(1 - 1/2**i) for i in range(6)], help='Trace decay rates for the critic.')
     parser.add_argument('--eta', type=float, nargs='+', default=[1.], help='OffPAC/ACE tradeoff parameter.')
+    parser.add_argument('--adaptive_step_sizes', type=int, choices=[0, 1], default=0, help='Whether or not the learners adapt a step size for each weight with Autostep, in which case the step sizes are only initial values and a much coarser grid (e.g. --alpha_a .1 --alpha_w .1 --alpha_v .01) usually suffices.')
+    parser.add_argument('--meta_step_size', type=float, default=.01, help='The meta step size for Autostep (only used with --adaptive_step_sizes 1).')
     parser.add_argument('--num_tiles_per_dim', type=int, nargs='+', default=[5, 5], help='The number of tiles per dimension to use in the tile coder.')
     parser.add_argument('--num_tilings', type=int, default=8, help='The number of tilings to use in the tile coder.')
     parser.add_argument('--bias_unit', type=int, choices=[0, 1], default=1, help='Whether or not to include a bias unit in the tile coder.')
@@ -87,6 +89,8 @@ python ../../{args.script_name} \\
 --num_tiles_per_dim {' '.join(str(i) for i in args.num_tiles_per_dim)} \\
 --num_tilings {args.num_tilings} \\
 --bias_unit {args.bias_unit} \\
+--adaptive_step_sizes {args.adaptive_step_sizes} \\
+--meta_step_size {args.meta_step_size} \\
 -p {parameters_string}
 '''
         # Write the script to file:
@@ -5,16 +5,19 @@ import random
 import argparse
 import numpy as np
 from src import utils
+from src import experience_cache
 from tqdm import tqdm
 from pathlib import Path
 from joblib import Parallel, delayed
-from src.algorithms.ace import BinaryACE
-from src.algorithms.tdc import BinaryTDC
+from src.algorithms.ace import BinaryACE, BatchBinaryACE, AutostepBinaryACE
+from src.algorithms.ace_step import ACEStep, GenericACEStep, BatchACEStep
+from src.algorithms.tdc import BinaryTDC, BatchBinaryTDC, AutostepBinaryTDC
 from src.function_approximation.tile_coder import TileCoder
+from src.replay_pipeline import ReplayPipeline, TileIndexStage
 from evaluate_policies import evaluate_policy
 
 
-def run_ace(experience_memmap, policies_memmap, performance_memmap, run_num, config_num, parameters, random_seed):
+def run_ace(experience_memmap, policies_memmap, performance_memmap, run_num, config_num, parameters, random_seed, tile_indices_memmap=None):
     alpha_a, alpha_w, alpha_v, lambda_c, eta = parameters
 
     # If this run and configuration has already been done (i.e., previous run timed out), exit early:
@@ -32,60 +35,115 @@ def run_ace(experience_memmap, policies_memmap, performance_memmap, run_num, con
     env.seed(random_seed)
     rng = env.np_random
 
-    actor = BinaryACE(env.action_space.n, tc.total_num_tiles, alpha_a / tc.num_active_features)
-    critic = BinaryTDC(tc.total_num_tiles, alpha_w / tc.num_active_features, alpha_v / tc.num_active_features, lambda_c)
+    if args.adaptive_step_sizes:
+        # The step sizes are adapted by Autostep, starting from the given ones:
+        actor = AutostepBinaryACE(env.action_space.n, tc.total_num_tiles, alpha_a / tc.num_active_features, args.meta_step_size, dtype=args.precision, feature_major=args.feature_major)
+        critic = AutostepBinaryTDC(tc.total_num_tiles, alpha_w / tc.num_active_features, alpha_v / tc.num_active_features, lambda_c, args.meta_step_size, dtype=args.precision)
+        ace = GenericACEStep(actor, critic, eta)
+    else:
+        actor = BinaryACE(env.action_space.n, tc.total_num_tiles, alpha_a / tc.num_active_features, args.precision, args.feature_major)
+        critic = BinaryTDC(tc.total_num_tiles, alpha_w / tc.num_active_features, alpha_v / tc.num_active_features, lambda_c, args.precision)
+        ace = ACEStep(actor, critic, eta)  # Does the actor, critic and emphasis updates for each transition.
     i = eval(args.interest_function)  # Create the interest function to use.
     mu = eval(args.behaviour_policy, {'np': np, 'env': env})  # Create the behaviour policy and give it access to numpy.
 
     policies = np.zeros(num_policies, dtype=policy_dtype)
     performance = np.zeros((num_policies, args.num_evaluation_runs), dtype=float)
 
+    def learn(indices_t, a_t, r_tp1, indices_tp1, gamma_tp1, i_t, i_tp1, mu_t):
+        # Update the critic and the actor:
+        ace.step(indices_t[0], a_t, r_tp1, indices_tp1[0], gamma_tp1, i_t, mu_t)
+
+    def checkpoint(t):
+        # Save and evaluate the learned policy:
+        performance[t // args.checkpoint_interval] = [evaluate_policy(actor, tc, env, rng, args.max_timesteps) for _ in range(args.num_evaluation_runs)]
+        policies[t // args.checkpoint_interval] = (t, np.copy(actor.theta))
+
     np.seterr(divide='raise', over='raise', invalid='raise')
     try:
-        transitions = experience_memmap[run_num]
-        gamma_t = 0.
-        f_t = 0.
-        rho_tm1 = 1.
-        indices_t = tc.encode(transitions[0][0])
-        for t, transition in enumerate(transitions):
-            # Save and evaluate the learned policy if it's a checkpoint timestep:
-            if t % args.checkpoint_interval == 0:
-                performance[t // args.checkpoint_interval] = [evaluate_policy(actor, tc, env, rng, args.max_timesteps) for _ in range(args.num_evaluation_runs)]
-                policies[t // args.checkpoint_interval] = (t, np.copy(actor.theta))
-
-            # Unpack the stored transition.
-            s_t, a_t, r_tp1, s_tp1, a_tp1, terminal = transition
-            gamma_tp1 = args.gamma if not terminal else 0  # Transition-dependent discounting.
-            indices_tp1 = tc.encode(s_tp1)
-            i_t = i(s_t, gamma_t)
-            # Compute importance sampling ratio for the policy:
-            pi_t = actor.pi(indices_t)
-            mu_t = mu(s_t)
-            rho_t = pi_t[a_t] / mu_t[a_t]
-            # Update the critic:
-            delta_t = r_tp1 + gamma_tp1 * critic.estimate(indices_tp1) - critic.estimate(indices_t)
-            critic.learn(delta_t, indices_t, gamma_t, indices_tp1, gamma_tp1, rho_t)
-            # Update the actor:
-            f_t = rho_tm1 * gamma_t * f_t + i_t
-            m_t = (1 - eta) * i_t + eta * f_t
-            actor.learn(indices_t, a_t, delta_t, m_t, rho_t)
-
-            gamma_t = gamma_tp1
-            indices_t = indices_tp1
-            rho_tm1 = rho_t
-        # Save and evaluate the policy after the final timestep:
-        policies[-1] = (t+1, np.copy(actor.theta))
-        performance[-1] = [evaluate_policy(actor, tc, env, rng, args.max_timesteps) for _ in range(args.num_evaluation_runs)]
+        tile_indices = [None if tile_indices_memmap is None else tile_indices_memmap[run_num]]
+        pipeline = ReplayPipeline(TileIndexStage([tc], tile_indices), learn, checkpoint, args.checkpoint_interval, args.gamma, i, mu)
+        pipeline.run(experience_memmap[run_num])
 
         # Save the learned policies and their performance to the memmap:
         performance_memmap[config_num]['results'][run_num] = performance
         policies_memmap[config_num]['policies'][run_num] = policies
     except (FloatingPointError, ValueError) as e:
-        # Save NaN to indicate the weights overflowed and exit early:
-        performance_memmap[config_num]['results'][run_num] = np.full_like(performance, np.NaN)
-        policies_memmap[config_num]['policies'][run_num] = np.full_like(policies, np.NaN)
+        # Save NaN to indicate the weights overflowed and exit early (casting NaN to the integer timesteps is invalid):
+        with np.errstate(invalid='ignore'):
+            performance_memmap[config_num]['results'][run_num] = np.full_like(performance, np.nan)
+            policies_memmap[config_num]['policies'][run_num] = np.full_like(policies, np.nan)
+        return
+
+
+def run_ace_batch(experience_memmap, policies_memmap, performance_memmap, run_nums, config_nums, parameters, random_seeds, tile_indices_memmap=None):
+    # Same as run_ace, but learns every configuration in config_nums on every run in run_nums in lockstep, stepping through the runs together:
+    num_configs = len(config_nums)
+    num_rows = len(run_nums) * num_configs  # One row of weights for each (run, configuration) pair, ordered by run.
+    alpha_a, alpha_w, alpha_v, lambda_c, eta = np.tile(np.array(parameters, dtype=float), (len(run_nums), 1)).T
+
+    # If every run has already been done for every configuration (i.e., previous run timed out), exit early:
+    if all(np.count_nonzero(policies_memmap[config_num]['policies'][run_num]) != 0 for run_num in run_nums for config_num in config_nums):
         return
 
+    # If this is the first run with a set of parameters, save the parameters:
+    if 0 in run_nums:
+        for config_num, config_parameters in zip(config_nums, parameters):
+            policies_memmap[config_num]['parameters'] = (*config_parameters, args.gamma, args.num_tiles_per_dim, args.num_tilings, args.bias_unit)
+            performance_memmap[config_num]['parameters'] = (*config_parameters, args.gamma, args.num_tiles_per_dim, args.num_tilings, args.bias_unit)
+
+    # Create an environment for each row to evaluate its learned policy in, seeded like run_ace would:
+    import gym_puddle
+    envs = [gym.make(args.environment).unwrapped for _ in range(num_rows)]
+    for row, env in enumerate(envs):
+        env.seed(random_seeds[row // num_configs])
+
+    actor = BatchBinaryACE(envs[0].action_space.n, tc.total_num_tiles, alpha_a / tc.num_active_features, args.precision, args.feature_major)
+    critic = BatchBinaryTDC(tc.total_num_tiles, alpha_w / tc.num_active_features, alpha_v / tc.num_active_features, lambda_c, args.precision)
+    ace = BatchACEStep(actor, critic, eta, len(run_nums))  # Does the actor, critic and emphasis updates of every row for each timestep.
+    i = eval(args.interest_function)  # Create the interest function to use.
+    mu = eval(args.behaviour_policy, {'np': np, 'env': envs[0]})  # Create the behaviour policy and give it access to numpy.
+
+    policies = np.zeros((num_rows, num_policies), dtype=policy_dtype)
+    performance = np.zeros((num_rows, num_policies, args.num_evaluation_runs), dtype=float)
+
+    # Rows that diverged, i.e. where run_ace's np.seterr(...='raise') would have raised. An overflow, divide by zero or
+    # invalid operation always leaves an inf or NaN in a row's intermediate values or weights, so a row diverges as soon
+    # as any of them isn't finite (intermediate values are checked every timestep, weights before each evaluation):
+    diverged = np.zeros(num_rows, dtype=bool)
+    def check_divergence(*values):
+        for weights in (actor.theta, critic.w, critic.v, critic.z):
+            diverged[:] |= ~np.isfinite(weights.reshape(num_rows, -1)).all(axis=1)
+        check_intermediates(*values)
+    def check_intermediates(*values):
+        for value in values:
+            diverged[:] |= ~np.isfinite(value.reshape(num_rows, -1)).all(axis=1)
+
+    def learn(indices_t, a_t, r_tp1, indices_tp1, gamma_tp1, i_t, i_tp1, mu_t):
+        # Update the critics and the actors of every row:
+        ace.step(indices_t[0], a_t, r_tp1, indices_tp1[0], gamma_tp1, i_t, mu_t)
+        check_intermediates(ace.pi_t, ace.rho_t, ace.delta_t, ace.f_t, ace.m_t)
+
+    def checkpoint(t):
+        # Save and evaluate the learned policies of the rows that haven't diverged:
+        check_divergence(ace.f_t)
+        for row in np.flatnonzero(~diverged):
+            performance[row, t // args.checkpoint_interval] = [evaluate_policy(actor.actor(row), tc, envs[row], envs[row].np_random, args.max_timesteps) for _ in range(args.num_evaluation_runs)]
+            policies[row, t // args.checkpoint_interval] = (t, np.copy(actor.theta[row]))
+
+    # Let diverging rows overflow to inf/NaN instead of raising, so the others can continue:
+    with np.errstate(divide='ignore', over='ignore', invalid='ignore'):
+        # Replay the runs together, reading the pre-encoded states from the tile index cache if there is one:
+        tile_indices = [None if tile_indices_memmap is None else tile_indices_memmap[list(run_nums)]]
+        pipeline = ReplayPipeline(TileIndexStage([tc], tile_indices), learn, checkpoint, args.checkpoint_interval, args.gamma, i, mu)
+        pipeline.run(experience_memmap[list(run_nums)])
+
+        # Save the learned policies and their performance to the memmap (NaN indicates the weights overflowed):
+        for row in range(num_rows):
+            run_num, config_num = run_nums[row // num_configs], config_nums[row % num_configs]
+            performance_memmap[config_num]['results'][run_num] = np.full_like(performance[row], np.nan) if diverged[row] else performance[row]
+            policies_memmap[config_num]['policies'][run_num] = np.full_like(policies[row], np.nan) if diverged[row] else policies[row]
+
 
 if __name__ == '__main__':
 
@@ -109,7 +167,16 @@ if __name__ == '__main__':
     parser.add_argument('--num_tiles_per_dim', type=int, nargs='+', default=[5, 5], help='The number of tiles per dimension to use in the tile coder.')
     parser.add_argument('--num_tilings', type=int, default=8, help='The number of tilings to use in the tile coder.')
     parser.add_argument('--bias_unit', type=int, choices=[0, 1], default=1, help='Whether or not to include a bias unit in the tile coder.')
+    parser.add_argument('--tile_index_cache', type=int, choices=[0, 1], default=1, help='Whether or not to read tile indices from a cache stored next to the experience file (built on first use).')
+    parser.add_argument('--precision', type=str, choices=['float64', 'float32'], default='float64', help='The floating point type of the learned weights and the saved policies (float32 halves memory bandwidth and file sizes).')
+    parser.add_argument('--feature_major', type=int, choices=[0, 1], default=0, help='Whether or not to store the action-indexed weights feature-major, so the weights of each active feature are contiguous (saved policies keep the (num_actions, num_features) orientation).')
+    parser.add_argument('--config_batch_size', type=int, default=1, help='The number of configurations to learn in lockstep from each replay of a run (1 runs each configuration separately).')
+    parser.add_argument('--adaptive_step_sizes', type=int, choices=[0, 1], default=0, help='Whether or not to adapt a step size for each weight with Autostep, starting from the given step sizes (far fewer step sizes need to be swept). Can\'t be combined with batching.')
+    parser.add_argument('--meta_step_size', type=float, default=.01, help='The meta step size for Autostep (only used with --adaptive_step_sizes 1).')
+    parser.add_argument('--run_batch_size', type=int, default=1, help='The number of runs to step through in lockstep for each batch of configurations (1 runs each run separately).')
     args = parser.parse_args()
+    if args.adaptive_step_sizes and (args.config_batch_size > 1 or args.run_batch_size > 1):
+        parser.error('--adaptive_step_sizes can\'t be combined with --config_batch_size or --run_batch_size.')
 
     # Generate the random seed for each run without replacement to prevent the birthday paradox:
     random.seed(args.random_seed)
@@ -126,6 +193,7 @@ if __name__ == '__main__':
     # Create the tile coder to be used for all parameter settings:
     dummy_env = gym.make(args.environment).unwrapped  # Make a dummy env to get shape info.
     tc = TileCoder(np.array([dummy_env.observation_space.low, dummy_env.observation_space.high]).T, args.num_tiles_per_dim, args.num_tilings, args.bias_unit)
+    tile_indices_memmap = experience_cache.open_tile_index_cache(args.experience_file, tc, args.num_cpus) if args.tile_index_cache else None
 
     # Create the memmapped array of learned policies that will be populated in parallel:
     parameters_dtype = np.dtype([
@@ -141,7 +209,7 @@ if __name__ == '__main__':
     ])
     policy_dtype = np.dtype([
             ('timesteps', int),
-            ('weights', float, (dummy_env.action_space.n, tc.total_num_tiles))
+            ('weights', args.precision, (dummy_env.action_space.n, tc.total_num_tiles))
     ])
     num_policies = num_timesteps // args.checkpoint_interval + 1
     configuration_dtype = np.dtype([
@@ -157,7 +225,7 @@ if __name__ == '__main__':
     # Create the memmapped array of performance results for the learned policies:
     performance_dtype = np.dtype([
         ('parameters', parameters_dtype),
-        ('results', float, (num_runs, num_policies, args.num_evaluation_runs))
+        ('results', args.precision, (num_runs, num_policies, args.num_evaluation_runs))
     ])
     performance_memmap_path = str(output_dir / 'performance.npy')
     if os.path.isfile(performance_memmap_path):
@@ -165,10 +233,21 @@ if __name__ == '__main__':
     else:
         performance_memmap = np.lib.format.open_memmap(performance_memmap_path, shape=(len(args.parameters),), dtype=performance_dtype, mode='w+')
 
-    # Run ACE for each configuration in parallel:
-    with utils.tqdm_joblib(tqdm(total=num_runs * len(args.parameters))) as progress_bar:
-        Parallel(n_jobs=args.num_cpus, verbose=0)(
-            delayed(run_ace)(experience_memmap, policies_memmap, performance_memmap, run_num, config_num, parameters, random_seed)
-            for config_num, parameters in enumerate(args.parameters)
-            for run_num, random_seed in enumerate(random_seeds)
-        )
+    if args.config_batch_size > 1 or args.run_batch_size > 1:
+        # Run ACE for each batch of configurations and runs in parallel:
+        config_batches = [range(start, min(start + args.config_batch_size, len(args.parameters))) for start in range(0, len(args.parameters), args.config_batch_size)]
+        run_batches = [range(start, min(start + args.run_batch_size, len(random_seeds))) for start in range(0, len(random_seeds), args.run_batch_size)]
+        with utils.tqdm_joblib(tqdm(total=len(run_batches) * len(config_batches))) as progress_bar:
+            Parallel(n_jobs=args.num_cpus, verbose=0)(
+                delayed(run_ace_batch)(experience_memmap, policies_memmap, performance_memmap, run_nums, config_nums, [args.parameters[config_num] for config_num in config_nums], [random_seeds[run_num] for run_num in run_nums], tile_indices_memmap)
+                for config_nums in config_batches
+                for run_nums in run_batches
+            )
+    else:
+        # Run ACE for each configuration in parallel:
+        with utils.tqdm_joblib(tqdm(total=num_runs * len(args.parameters))) as progress_bar:
+            Parallel(n_jobs=args.num_cpus, verbose=0)(
+                delayed(run_ace)(experience_memmap, policies_memmap, performance_memmap, run_num, config_num, parameters, random_seed, tile_indices_memmap)
+                for config_num, parameters in enumerate(args.parameters)
+                for run_num, random_seed in enumerate(random_seeds)
+            )
@@ -6,13 +6,16 @@ import itertools
 import numpy as np
 from pathlib import Path
 from src import utils
+from src import experience_cache
 from src.algorithms.ace import BinaryACE
-from src.algorithms.tdc import BinaryGQ
+from src.algorithms.ace_step import AllActionsACEStep
+from src.algorithms.tdc import BinaryGQ, LazyBinaryGQ
 from src.function_approximation.tile_coder import TileCoder
+from src.replay_pipeline import ReplayPipeline, TileIndexStage, pad_weights
 from joblib import Parallel, delayed
 
 
-def run_ace(policies_memmap, experience_memmap, run_num, config_num, parameters):
+def run_ace(policies_memmap, experience_memmap, run_num, config_num, parameters, tile_indices_memmaps=None):
     # Check if this run and configuration has already been done:
     if np.count_nonzero(policies_memmap[run_num, config_num]) != 0:
         return
@@ -20,47 +23,30 @@ def run_ace(policies_memmap, experience_memmap, run_num, config_num, parameters)
     gamma, alpha_a, alpha_c, alpha_c2, lambda_c, eta, num_tiles, num_tilings, bias_unit = parameters
 
     tc = TileCoder(np.array([env.observation_space.low, env.observation_space.high]).T, num_tiles, num_tilings, bias_unit)
-    actor = BinaryACE(env.action_space.n, tc.total_num_tiles, alpha_a / tc.num_active_features)
-    critic = BinaryGQ(env.action_space.n, tc.total_num_tiles, alpha_c / tc.num_active_features, alpha_c2 / tc.num_active_features, lambda_c)
+    actor = BinaryACE(env.action_space.n, tc.total_num_tiles, alpha_a / tc.num_active_features, args.precision, args.feature_major)
+    if args.lazy_traces:
+        critic = LazyBinaryGQ(env.action_space.n, tc.total_num_tiles, alpha_c / tc.num_active_features, alpha_c2 / tc.num_active_features, lambda_c, args.precision)
+    else:
+        critic = BinaryGQ(env.action_space.n, tc.total_num_tiles, alpha_c / tc.num_active_features, alpha_c2 / tc.num_active_features, lambda_c, args.precision, args.feature_major)
+    ace = AllActionsACEStep(actor, critic, eta)  # Does the actor, critic and emphasis updates for each transition.
     i = eval(args.interest_function)  # Create the interest function to use.
     mu = eval(args.behaviour_policy, {'np': np, 'env': env})  # Create the behaviour policy and give it access to numpy and the env.
-    transitions = experience_memmap[run_num]
     policies = np.zeros(num_policies, dtype=policy_dtype)
-    gamma_t = 0.
-    indices_t = tc.encode(transitions[0][0])
-    f_t = 0.
-    rho_tm1 = 1.
-    for t, transition in enumerate(transitions):
-        if t % args.checkpoint_interval == 0:  # Save the learned policy if it's a checkpoint timestep:
-            padded_weights = np.zeros_like(policies[t // args.checkpoint_interval][1])
-            padded_weights[0:actor.theta.shape[0], 0:actor.theta.shape[1]] = np.copy(actor.theta)
-            policies[t // args.checkpoint_interval] = (t, padded_weights)
-
-        # Unpack the stored transition.
-        s_t, a_t, r_tp1, s_tp1, _, terminal = transition
-        gamma_tp1 = gamma if not terminal else 0  # Transition-dependent discounting.
-        indices_tp1 = tc.encode(s_tp1)
-        i_t = i(s_t, gamma_t)
-        # Compute importance sampling ratio for the policy:
-        pi_t = actor.pi(indices_t)
-        mu_t = mu(s_t)
-        rho_t = pi_t[a_t] / mu_t[a_t]
-        # Update critic:
-        critic.learn(indices_t, a_t, rho_t, gamma_t, r_tp1, indices_tp1, actor.pi(indices_tp1), gamma_tp1)
-        # Update actor:
-        q_t = critic.estimate(indices_t)
-        f_t = rho_tm1 * gamma_t * f_t + i_t
-        m_t = (1 - eta) * i_t + eta * f_t
-        actor.all_actions_learn(indices_t, q_t, m_t)
-
-        gamma_t = gamma_tp1
-        indices_t = indices_tp1
-        rho_tm1 = rho_t
-
-    # Save the policy after the final timestep:
-    padded_weights = np.zeros_like(policies[-1][1])
-    padded_weights[0:actor.theta.shape[0], 0:actor.theta.shape[1]] = np.copy(actor.theta)
-    policies[-1] = (t+1, padded_weights)
+
+    def learn(indices_t, a_t, r_tp1, indices_tp1, gamma_tp1, i_t, i_tp1, mu_t):
+        # Update critic and actor:
+        ace.step(indices_t[0], a_t, r_tp1, indices_tp1[0], gamma_tp1, i_t, mu_t)
+
+    def checkpoint(t):
+        # Save the learned policy:
+        policies[t // args.checkpoint_interval] = (t, pad_weights(actor.theta, policy_dtype['weights'].shape, args.precision))
+
+    if tile_indices_memmaps is None:
+        tile_indices_memmaps = {}
+    tile_indices_memmap = tile_indices_memmaps.get(experience_cache.tile_coder_digest(tc))
+    tile_indices = [None if tile_indices_memmap is None else tile_indices_memmap[run_num]]
+    pipeline = ReplayPipeline(TileIndexStage([tc], tile_indices), learn, checkpoint, args.checkpoint_interval, gamma, i, mu)
+    pipeline.run(experience_memmap[run_num])
 
     policies_memmap[run_num, config_num] = (gamma, alpha_a, alpha_c, alpha_c, lambda_c, eta, num_tiles, num_tilings, tc.total_num_tiles, bias_unit, policies)  # Store the learned policies in the memmap.
 
@@ -87,6 +73,10 @@ if __name__ == '__main__':
     parser.add_argument('--num_tiles', type=int, nargs='+', action='append', default=[[5, 5]], help='The number of tiles per dimension to use in the tile coder.')
     parser.add_argument('--num_tilings', type=int, nargs='+', default=[8], help='The number of tilings to use in the tile coder.')
     parser.add_argument('--bias_unit', type=int, nargs='+', default=[1], help='Whether or not to include a bias unit in the tile coder.')
+    parser.add_argument('--precision', type=str, choices=['float64', 'float32'], default='float64', help='The floating point type of the learned weights and the saved policies (float32 halves memory bandwidth and file sizes).')
+    parser.add_argument('--feature_major', type=int, choices=[0, 1], default=0, help='Whether or not to store the action-indexed weights feature-major, so the weights of each active feature are contiguous (saved policies keep the (num_actions, num_features) orientation).')
+    parser.add_argument('--lazy_traces', type=int, choices=[0, 1], default=0, help='Whether or not to use the critic with lazily scaled traces, whose per-step cost depends on the number of active features instead of the number of features (faster for large tile spaces).')
+    parser.add_argument('--tile_index_cache', type=int, choices=[0, 1], default=1, help='Whether or not to read tile indices from caches stored next to the experience file (built on first use).')
     args = parser.parse_args()
 
     # Save the command line arguments in a format interpretable by argparse:
@@ -104,7 +94,7 @@ if __name__ == '__main__':
     policy_dtype = np.dtype(
         [
             ('timesteps', int),
-            ('weights', float, (env.action_space.n, max_num_features))
+            ('weights', args.precision, (env.action_space.n, max_num_features))
         ]
     )
     configuration_dtype = np.dtype(
@@ -136,9 +126,20 @@ if __name__ == '__main__':
     else:
         policies_memmap = np.lib.format.open_memmap(policies_memmap_path, shape=(num_runs, num_configurations), dtype=configuration_dtype, mode='w+')
 
+    # Open (building if necessary) the tile index cache for each distinct tile coder used by the configurations:
+    tile_indices_memmaps = {}
+    if args.tile_index_cache:
+        experience_digest = experience_cache.file_digest(experiment_path / 'experience.npy')
+        for configuration in configurations:
+            num_tiles, num_tilings, bias_unit = configuration[6:]
+            tc = TileCoder(np.array([env.observation_space.low, env.observation_space.high]).T, num_tiles, num_tilings, bias_unit)
+            digest = experience_cache.tile_coder_digest(tc)
+            if digest not in tile_indices_memmaps:
+                tile_indices_memmaps[digest] = experience_cache.open_tile_index_cache(experiment_path / 'experience.npy', tc, args.num_cpus, experience_digest)
+
     # Run ACE for each configuration in parallel:
     Parallel(n_jobs=args.num_cpus, verbose=args.verbosity)(
-        delayed(run_ace)(policies_memmap, experience_memmap, run_num, config_num, parameters)
+        delayed(run_ace)(policies_memmap, experience_memmap, run_num, config_num, parameters, tile_indices_memmaps)
         for config_num, parameters in enumerate(configurations)
         for run_num in range(num_runs)
     )
@@ -6,14 +6,17 @@ import itertools
 import numpy as np
 from pathlib import Path
 from src import utils
+from src import experience_cache
 from src.algorithms.fhat import BinaryFHat
 from src.algorithms.ace import BinaryACE
+from src.algorithms.ace_step import LowVarACEStep
 from src.algorithms.low_var_etd import BinaryLowVarETD
 from src.function_approximation.tile_coder import TileCoder
+from src.replay_pipeline import ReplayPipeline, TileIndexStage, pad_weights
 from joblib import Parallel, delayed
 
 
-def run_low_var_ace(policies_memmap, experience_memmap, run_num, config_num, parameters):
+def run_low_var_ace(policies_memmap, experience_memmap, run_num, config_num, parameters, tile_indices_memmaps=None):
     # Check if this run and configuration has already been done:
     if np.count_nonzero(policies_memmap[run_num, config_num]) != 0:
         return
@@ -23,58 +26,31 @@ def run_low_var_ace(policies_memmap, experience_memmap, run_num, config_num, par
     tc_a = TileCoder(np.array([env.observation_space.low, env.observation_space.high]).T, num_tiles_a, num_tilings_a, bias_unit)
     tc_c = TileCoder(np.array([env.observation_space.low, env.observation_space.high]).T, num_tiles_c, num_tilings_c, bias_unit)
 
-    fhat = BinaryFHat(tc_c.total_num_tiles, alpha_c2 / tc_c.num_active_features)
-    actor = BinaryACE(env.action_space.n, tc_a.total_num_tiles)
-    critic = BinaryLowVarETD(tc_c.total_num_tiles, alpha_c / tc_c.num_active_features, lambda_c)
+    fhat = BinaryFHat(tc_c.total_num_tiles, alpha_c2 / tc_c.num_active_features, args.precision)
+    actor = BinaryACE(env.action_space.n, tc_a.total_num_tiles, alpha_a / tc_a.num_active_features, args.precision, args.feature_major)
+    critic = BinaryLowVarETD(tc_c.total_num_tiles, alpha_c / tc_c.num_active_features, lambda_c, dtype=args.precision)
+    ace = LowVarACEStep(actor, critic, fhat, eta)  # Does the actor, critic and fhat updates for each transition.
 
     i = eval(args.interest_function)  # Create the interest function to use.
     mu = eval(args.behaviour_policy, {'np': np, 'env': env})  # Create the behaviour policy and give it access to numpy.
 
-    transitions = experience_memmap[run_num]
-
     policies = np.zeros(num_policies, dtype=policy_dtype)
-    gamma_t = 0.
-    indices_t_a = tc_a.encode(transitions[0][0])
-    indices_t_c = tc_c.encode(transitions[0][0])
-    for t, transition in enumerate(transitions):
-        if t % args.checkpoint_interval == 0:  # Save the learned policy if it's a checkpoint timestep:
-            padded_weights = np.zeros_like(policies[t // args.checkpoint_interval][1])
-            padded_weights[0:actor.theta.shape[0], 0:actor.theta.shape[1]] = np.copy(actor.theta)
-            policies[t // args.checkpoint_interval] = (t, padded_weights)
-
-        # Unpack the stored transition.
-        s_t, a_t, r_tp1, s_tp1, a_tp1, terminal = transition
-        gamma_tp1 = gamma if not terminal else 0  # Transition-dependent discounting.
-        indices_tp1_a = tc_a.encode(s_tp1)
-        indices_tp1_c = tc_c.encode(s_tp1)
-        i_t = i(s_t, gamma_t)
-        i_tp1 = i(s_tp1, gamma_tp1)
-        # Compute importance sampling ratio for the policy:
-        pi_t = actor.pi(indices_t_a)
-        mu_t = mu(s_t)
-        rho_t = pi_t[a_t] / mu_t[a_t]
-        # Compute TD error:
-        v_t = critic.estimate(indices_t_c)
-        v_tp1 = critic.estimate(indices_tp1_c)
-        delta_t = r_tp1 + gamma_tp1 * v_tp1 - v_t
-
-        f_t = fhat.estimate(indices_t_c)
-        m_t = (1 - eta) * i_t + eta * f_t
-        # Update actor:
-        actor.learn(indices_t_a, a_t, delta_t, m_t, rho_t)
-        # Update critic:
-        critic.learn(delta_t, indices_t_c, gamma_t, i_t, indices_tp1_c, gamma_tp1, rho_t, f_t)
-        # Update fhat: 
-        fhat.learn(indices_tp1_c, gamma_tp1, indices_t_c, rho_t, i_tp1)
-
-        gamma_t = gamma_tp1
-        indices_t_a = indices_tp1_a
-        indices_t_c = indices_tp1_c
-
-    # Save the policy after the final timestep:
-    padded_weights = np.zeros_like(policies[-1][1])
-    padded_weights[0:actor.theta.shape[0], 0:actor.theta.shape[1]] = np.copy(actor.theta)
-    policies[-1] = (t+1, padded_weights)
+
+    def learn(indices_t, a_t, r_tp1, indices_tp1, gamma_tp1, i_t, i_tp1, mu_t):
+        # Update actor, critic and fhat:
+        ace.step(indices_t[0], indices_t[1], a_t, r_tp1, indices_tp1[1], gamma_tp1, i_t, i_tp1, mu_t)
+
+    def checkpoint(t):
+        # Save the learned policy:
+        policies[t // args.checkpoint_interval] = (t, pad_weights(actor.theta, policy_dtype['weights'].shape, args.precision))
+
+    if tile_indices_memmaps is None:
+        tile_indices_memmaps = {}
+    # Read the states' indices for both the actor and the critic from the tile index caches, or encode them in one pass:
+    tile_indices = [tile_indices_memmaps.get(experience_cache.tile_coder_digest(tc)) for tc in (tc_a, tc_c)]
+    tile_indices = [None if tile_indices_memmap is None else tile_indices_memmap[run_num] for tile_indices_memmap in tile_indices]
+    pipeline = ReplayPipeline(TileIndexStage([tc_a, tc_c], tile_indices), learn, checkpoint, args.checkpoint_interval, gamma, i, mu, next_interest=True)
+    pipeline.run(experience_memmap[run_num])
 
     policies_memmap[run_num, config_num] = (gamma, alpha_a, alpha_c, alpha_c2, lambda_c, eta, num_tiles_a, num_tilings_a, num_tiles_c, num_tilings_c, tc_a.total_num_tiles, tc_c.total_num_tiles, bias_unit, policies)  # Store the learned policies in the memmap.
 
@@ -103,6 +79,9 @@ if __name__ == '__main__':
     parser.add_argument('--num_tiles_c', type=int, nargs='+', action='append', default=[[5, 5]], help='The number of tiles per dimension to use in the critic\'s tile coder.')
     parser.add_argument('--num_tilings_c', type=int, nargs='+', default=[8], help='The number of tilings to use in the critic\'s tile coder.')
     parser.add_argument('--bias_unit', type=int, nargs='+', default=[1], help='Whether or not to include a bias unit in the tile coder.')
+    parser.add_argument('--precision', type=str, choices=['float64', 'float32'], default='float64', help='The floating point type of the learned weights and the saved policies (float32 halves memory bandwidth and file sizes).')
+    parser.add_argument('--feature_major', type=int, choices=[0, 1], default=0, help='Whether or not to store the action-indexed weights feature-major, so the weights of each active feature are contiguous (saved policies keep the (num_actions, num_features) orientation).')
+    parser.add_argument('--tile_index_cache', type=int, choices=[0, 1], default=1, help='Whether or not to read tile indices from caches stored next to the experience file (built on first use).')
     args = parser.parse_args()
 
     # Save the command line arguments in a format interpretable by argparse:
@@ -121,7 +100,7 @@ if __name__ == '__main__':
     policy_dtype = np.dtype(
         [
             ('timesteps', int),
-            ('weights', float, (env.action_space.n, max_num_features_a))
+            ('weights', args.precision, (env.action_space.n, max_num_features_a))
         ]
     )
     configuration_dtype = np.dtype(
@@ -156,9 +135,21 @@ if __name__ == '__main__':
     else:
         policies_memmap = np.lib.format.open_memmap(policies_memmap_path, shape=(num_runs, num_configurations), dtype=configuration_dtype, mode='w+')
 
+    # Open (building if necessary) the tile index cache for each distinct tile coder used by the configurations:
+    tile_indices_memmaps = {}
+    if args.tile_index_cache:
+        experience_digest = experience_cache.file_digest(experiment_path / 'experience.npy')
+        for configuration in configurations:
+            num_tiles_a, num_tilings_a, num_tiles_c, num_tilings_c, bias_unit = configuration[6:]
+            for num_tiles, num_tilings in [(num_tiles_a, num_tilings_a), (num_tiles_c, num_tilings_c)]:
+                tc = TileCoder(np.array([env.observation_space.low, env.observation_space.high]).T, num_tiles, num_tilings, bias_unit)
+                digest = experience_cache.tile_coder_digest(tc)
+                if digest not in tile_indices_memmaps:
+                    tile_indices_memmaps[digest] = experience_cache.open_tile_index_cache(experiment_path / 'experience.npy', tc, args.num_cpus, experience_digest)
+
     # Run ACE for each configuration in parallel:
     Parallel(n_jobs=args.num_cpus, verbose=args.verbosity)(
-        delayed(run_low_var_ace)(policies_memmap, experience_memmap, run_num, config_num, parameters)
+        delayed(run_low_var_ace)(policies_memmap, experience_memmap, run_num, config_num, parameters, tile_indices_memmaps)
         for config_num, parameters in enumerate(configurations)
         for run_num in range(num_runs)
     )
@@ -1,43 +1,78 @@
 import numpy as np
+from src.algorithms.autostep import Autostep
+from src.algorithms.sparse_features import is_sparse, sparse_parts
+from src.policy_types.discrete_policy import DiscretePolicy
 
 
 class LinearACE:
+    """
+    Features can be dense arrays, scipy.sparse rows or (indices, values) pairs; pi and learn only touch the columns
+    of the nonzero entries of sparse features.
+    """
 
     def __init__(self, num_actions, num_features, alpha):
         self.num_actions = num_actions
         self.num_features = num_features
         self.alpha = alpha
         self.theta = np.zeros((num_actions, num_features))
-        self.psi_s_a = np.zeros((num_actions, num_features))
-        self.psi_s_b = np.zeros((num_actions, num_features))
+        self.psi = np.zeros((num_actions, num_features))  # Buffer for the dense score function.
 
     def pi(self, features):
-        preferences = self.theta.dot(features)
+        if is_sparse(features):
+            indices, values = sparse_parts(features)
+            preferences = self.theta[:, indices].dot(values)
+        else:
+            preferences = self.theta.dot(features)
         # Converts potential overflows of the largest probability into underflows of the lowest probability:
         preferences = preferences - preferences.max()
         exp_preferences = np.exp(preferences)
         return exp_preferences / np.sum(exp_preferences)
 
-    def grad_log_pi(self, features, a_t):
-        self.psi_s_a.fill(0.)
-        self.psi_s_a[a_t] = features
-        pi = np.expand_dims(self.pi(features), axis=1)  # Add dimension to enable broadcasting.
-        self.psi_s_b.fill(0.)
-        self.psi_s_b[:] = features
-        return self.psi_s_a - pi * self.psi_s_b
+    def grad_log_pi(self, features, a_t, out=None):
+        # Grad log pi is the outer product of (onehot(a_t) - pi) and the features, written as -pi outer features plus the features in row a_t:
+        pi = self.pi(features)
+        out = np.multiply(-pi[:, np.newaxis], features, out=out)
+        out[a_t] += features
+        return out
+
+    def pi_batch(self, X):
+        """
+        The action probabilities for each row of a (B, num_features) block of features (dense or scipy.sparse).
+        """
+        return DiscretePolicy(self.theta).pi_batch(X)
+
+    def grad_log_pi_batch(self, X, A, out=None):
+        """
+        The (B, num_actions, num_features) score functions of a (B, num_features) block of dense features and B actions.
+        """
+        return DiscretePolicy(self.theta).grad_log_pi_batch(X, A, out=out)
+
+    def accumulate_grad_log_pi(self, X, A, weights, out):
+        """
+        Adds the weighted sum of the score functions of a (B, num_features) block of features (dense or scipy.sparse)
+        and B actions into out, without forming the individual score functions.
+        """
+        return DiscretePolicy(self.theta).accumulate_grad_log_pi(X, A, weights, out)
 
     def learn(self, features, a_t, delta_t, m_t, rho_t):
-        self.theta += self.alpha * rho_t * m_t * delta_t * self.grad_log_pi(features, a_t)
+        if is_sparse(features):
+            # Grad log pi is the outer product of (1 - pi[a] if a == a_t else 0 - pi[a]) and the features, so only update the nonzero columns:
+            indices, values = sparse_parts(features)
+            grad_log_pi = -self.pi((indices, values))
+            grad_log_pi[a_t] += 1
+            self.theta[:, indices] += self.alpha * rho_t * m_t * delta_t * np.outer(grad_log_pi, values)
+        else:
+            self.theta += self.alpha * rho_t * m_t * delta_t * self.grad_log_pi(features, a_t, out=self.psi)
 
 
 class BinaryACE:
 
-    def __init__(self, num_actions, num_features, alpha):
+    def __init__(self, num_actions, num_features, alpha, dtype=np.float64, feature_major=False):
         self.num_actions = num_actions
         self.num_features = num_features
         self.alpha = alpha
-        self.theta = np.zeros((num_actions, num_features))
-        self.grad_log_pi = np.zeros((num_actions, num_features))
+        # Feature-major weights are the transpose of a (num_features, num_actions) array, so the columns for the active features are contiguous:
+        self.theta = np.zeros((num_features, num_actions), dtype=dtype).T if feature_major else np.zeros((num_actions, num_features), dtype=dtype)
 
     def pi(self, indices):
         preferences = self.theta[:, indices].sum(axis=1)
@@ -45,18 +80,100 @@ class BinaryACE:
         exp_preferences = np.exp(preferences)
         return exp_preferences / np.sum(exp_preferences)
 
-    def learn(self, indices_t, a_t, delta_t, m_t, rho_t):
-    #     M_t = (1 - eta) * i_t + eta * f_t
-        pi = self.pi(indices_t)
-        for a in range(self.theta.shape[0]):
-            self.theta[a, indices_t] += self.alpha * rho_t * m_t * delta_t * (1 - pi[a] if a == a_t else 0 - pi[a])
-
-    def all_actions_learn(self, indices_t, q_t, m_t):
-        pi = self.pi(indices_t)
-        # For each action,
-        for a in range(self.num_actions):
-            # Compute grad log pi:
-            for b in range(self.num_actions):
-                self.grad_log_pi[b, indices_t] += (1 - pi[b] if b == a else 0 - pi[b])
-            self.theta += self.alpha * m_t * q_t[a] * pi[a] * self.grad_log_pi  # Update policy weights.
-            self.grad_log_pi.fill(0.)  # Clear grad log pi for next iteration.
+    def learn(self, indices_t, a_t, delta_t, m_t, rho_t, pi_t=None):
+        # pi_t can be passed in if it's already been computed (e.g. for rho_t) with the current weights:
+        pi = self.pi(indices_t) if pi_t is None else pi_t
+        # Grad log pi is (1 - pi[a] if a == a_t else 0 - pi[a]) in the active columns and 0 elsewhere, so only update those:
+        grad_log_pi = -pi
+        grad_log_pi[a_t] += 1
+        self.theta[:, indices_t] += (self.alpha * rho_t * m_t * delta_t * grad_log_pi)[:, np.newaxis]
+
+    def all_actions_learn(self, indices_t, q_t, m_t, pi_t=None):
+        pi = self.pi(indices_t) if pi_t is None else pi_t
+        # The sum over actions of q_t[a] * pi[a] * grad log pi(a) is pi * (q_t - pi.q_t) in the active columns and 0 elsewhere:
+        self.theta[:, indices_t] += (self.alpha * m_t * pi * (q_t - pi.dot(q_t)))[:, np.newaxis]
+
+
+class AutostepBinaryACE(BinaryACE):
+    """
+    BinaryACE with a step size for each weight adapted by Autostep, starting from alpha.
+    The Autostep error is rho_t * m_t * delta_t and the features are grad log pi, so only the step sizes in the
+    active columns change. For all_actions_learn the error is m_t and the features are pi * (q_t - pi.q_t).
+    """
+
+    def __init__(self, num_actions, num_features, alpha, mu=.01, tau=10000., dtype=np.float64, feature_major=False):
+        super().__init__(num_actions, num_features, alpha, dtype, feature_major)
+        self.autostep = Autostep((num_actions, num_features), alpha, mu, tau, dtype)
+
+    def learn(self, indices_t, a_t, delta_t, m_t, rho_t, pi_t=None):
+        pi = self.pi(indices_t) if pi_t is None else pi_t
+        grad_log_pi = -pi
+        grad_log_pi[a_t] += 1
+        error = rho_t * m_t * delta_t
+        alpha = self.autostep.update(indices_t, error, grad_log_pi[:, np.newaxis])
+        self.theta[:, indices_t] += alpha * error * grad_log_pi[:, np.newaxis]
+
+    def all_actions_learn(self, indices_t, q_t, m_t, pi_t=None):
+        pi = self.pi(indices_t) if pi_t is None else pi_t
+        phi = (pi * (q_t - pi.dot(q_t)))[:, np.newaxis]
+        alpha = self.autostep.update(indices_t, m_t, phi)
+        self.theta[:, indices_t] += alpha * m_t * phi
+
+
+class BatchBinaryACE:
+    """
+    BinaryACE for several configurations (or independent runs) learning in lockstep.
+    The weights have a leading row axis (theta has shape (num_configs, num_actions, num_features)),
+    and alpha is a vector with a step size for each row.
+    Indices can be shared by all rows (shape (num_active_features,)) or given for each row
+    (shape (num_configs, num_active_features)), in which case a_t can have an action for each row too.
+    """
+
+    def __init__(self, num_actions, num_features, alpha, dtype=np.float64, feature_major=False):
+        self.num_actions = num_actions
+        self.num_features = num_features
+        self.alpha = np.asarray(alpha, dtype=float)
+        self.num_configs = len(self.alpha)
+        if feature_major:
+            self.theta = np.zeros((self.num_configs, num_features, num_actions), dtype=dtype).transpose(0, 2, 1)
+        else:
+            self.theta = np.zeros((self.num_configs, num_actions, num_features), dtype=dtype)
+        self.rows = np.arange(self.num_configs)[:, np.newaxis]
+
+    def _gather(self, indices):
+        # The weights of the active features of every row, with shape (num_configs, num_actions, num_active_features):
+        if np.ndim(indices) == 1:
+            return self.theta[:, :, indices]
+        return self.theta.transpose(0, 2, 1)[self.rows, indices].transpose(0, 2, 1)
+
+    def _scatter_add(self, indices, values):
+        # Adds values (broadcast to shape (num_configs, num_actions, num_active_features)) to the weights of the active features:
+        if np.ndim(indices) == 1:
+            self.theta[:, :, indices] += values
+        else:
+            self.theta.transpose(0, 2, 1)[self.rows, indices] += values.transpose(0, 2, 1)
+
+    def actor(self, config_num):
+        # A BinaryACE that shares the weights of one configuration (e.g. to evaluate or save its policy):
+        actor = BinaryACE(self.num_actions, self.num_features, self.alpha[config_num], self.theta.dtype)
+        actor.theta = self.theta[config_num]
+        return actor
+
+    def pi(self, indices):
+        preferences = self._gather(indices).sum(axis=2)
+        preferences = preferences - preferences.max(axis=1, keepdims=True)  # Converts potential overflows of the largest probability into underflows of the lowest probability.
+        exp_preferences = np.exp(preferences)
+        return exp_preferences / np.sum(exp_preferences, axis=1, keepdims=True)
+
+    def learn(self, indices_t, a_t, delta_t, m_t, rho_t, pi_t=None):
+        # delta_t, m_t and rho_t have a value for each row, and pi_t (if given) a row of probabilities for each row:
+        pi = self.pi(indices_t) if pi_t is None else pi_t
+        grad_log_pi = -pi
+        grad_log_pi[self.rows[:, 0], a_t] += 1
+        self._scatter_add(indices_t, (self.alpha * rho_t * m_t * delta_t)[:, np.newaxis, np.newaxis] * grad_log_pi[:, :, np.newaxis])
+
+    def all_actions_learn(self, indices_t, q_t, m_t, pi_t=None):
+        # q_t and pi_t (if given) have shape (num_configs, num_actions) and m_t has a value for each row:
+        pi = self.pi(indices_t) if pi_t is None else pi_t
+        v_t = np.sum(pi * q_t, axis=1, keepdims=True)
+        self._scatter_add(indices_t, ((self.alpha * m_t)[:, np.newaxis] * pi * (q_t - v_t))[:, :, np.newaxis])
@@ -0,0 +1,227 @@
+import numpy as np
+
+
+class ACEStep:
+    """
+    Off-policy ACE with a BinaryACE actor and a BinaryTDC critic, fused into one step per transition.
+    Owns the emphasis state (gamma_t, f_t and rho_tm1), gathers the actor's active columns once for both the policy and
+    the update, and does the critic's dense updates through a preallocated buffer instead of temporaries.
+    The weights are the same, bit for bit, as calling actor.pi, critic.estimate, critic.learn and actor.learn in turn.
+    """
+
+    def __init__(self, actor, critic, eta):
+        self.actor = actor
+        self.critic = critic
+        self.eta = eta
+        self.gamma_t = 0.
+        self.f_t = 0.
+        self.rho_tm1 = 1.
+        self.scratch = np.empty(critic.z.shape)  # float64 like the temporaries it replaces (delta_t is float64), even for float32 weights.
+
+    def step(self, indices_t, a_t, r_tp1, indices_tp1, gamma_tp1, i_t, mu_t):
+        actor, critic = self.actor, self.critic
+
+        # Compute importance sampling ratio for the policy:
+        theta_t = actor.theta[:, indices_t]
+        preferences = theta_t.sum(axis=1)
+        preferences = preferences - preferences.max()
+        exp_preferences = np.exp(preferences)
+        pi_t = exp_preferences / np.sum(exp_preferences)
+        rho_t = pi_t[a_t] / mu_t[a_t]
+
+        # Update the critic:
+        delta_t = r_tp1 + gamma_tp1 * critic.w[indices_tp1].sum() - critic.w[indices_t].sum()
+        critic.z *= rho_t * self.gamma_t * critic.lambda_c
+        critic.z[indices_t] += rho_t
+        critic.w += np.multiply(critic.alpha_w * delta_t, critic.z, out=self.scratch)
+        critic.w[indices_tp1] -= critic.alpha_w * gamma_tp1 * (1 - critic.lambda_c) * critic.z.dot(critic.v)
+        v_dot_x = critic.v[indices_t].sum()
+        critic.v += np.multiply(critic.alpha_v * delta_t, critic.z, out=self.scratch)
+        critic.v[indices_t] -= critic.alpha_v * v_dot_x
+
+        # Update the actor:
+        self.f_t = self.rho_tm1 * self.gamma_t * self.f_t + i_t
+        m_t = (1 - self.eta) * i_t + self.eta * self.f_t
+        grad_log_pi = -pi_t
+        grad_log_pi[a_t] += 1
+        actor.theta[:, indices_t] = theta_t + (actor.alpha * rho_t * m_t * delta_t * grad_log_pi)[:, np.newaxis]
+
+        self.gamma_t = gamma_tp1
+        self.rho_tm1 = rho_t
+
+
+class GenericACEStep:
+    """
+    Off-policy ACE with any actor and critic that have BinaryACE's and BinaryTDC's interfaces (e.g. AutostepBinaryACE
+    and AutostepBinaryTDC), one step per transition. Calls actor.pi, critic.estimate, critic.learn and actor.learn in
+    turn, so it has ACEStep's interface and emphasis state without its fused updates (which assume fixed step sizes).
+    """
+
+    def __init__(self, actor, critic, eta):
+        self.actor = actor
+        self.critic = critic
+        self.eta = eta
+        self.gamma_t = 0.
+        self.f_t = 0.
+        self.rho_tm1 = 1.
+
+    def step(self, indices_t, a_t, r_tp1, indices_tp1, gamma_tp1, i_t, mu_t):
+        actor, critic = self.actor, self.critic
+
+        # Compute importance sampling ratio for the policy:
+        pi_t = actor.pi(indices_t)
+        rho_t = pi_t[a_t] / mu_t[a_t]
+
+        # Update the critic:
+        delta_t = r_tp1 + gamma_tp1 * critic.estimate(indices_tp1) - critic.estimate(indices_t)
+        critic.learn(delta_t, indices_t, self.gamma_t, indices_tp1, gamma_tp1, rho_t)
+
+        # Update the actor:
+        self.f_t = self.rho_tm1 * self.gamma_t * self.f_t + i_t
+        m_t = (1 - self.eta) * i_t + self.eta * self.f_t
+        actor.learn(indices_t, a_t, delta_t, m_t, rho_t, pi_t)
+
+        self.gamma_t = gamma_tp1
+        self.rho_tm1 = rho_t
+
+
+class BatchACEStep:
+    """
+    Off-policy ACE with a BatchBinaryACE actor and a BatchBinaryTDC critic whose rows are (run, configuration) pairs
+    ordered by run, one step per timestep of every run in lockstep (a learn stage for a ReplayPipeline replaying the
+    runs together). Has ACEStep's interface and emphasis state, except that each transition argument has a leading axis
+    with the values of each run, which are repeated for each of the run's configurations.
+    Keeps the last step's intermediate values (pi_t, rho_t, delta_t, f_t and m_t, with a value for each row) so they
+    can be checked, e.g. for rows that diverged.
+    """
+
+    def __init__(self, actor, critic, eta, num_runs):
+        self.actor = actor
+        self.critic = critic
+        self.eta = eta
+        self.num_runs = num_runs
+        self.num_configs = actor.num_configs // num_runs
+        self.gamma_t = np.zeros(num_runs)
+        self.f_t = np.zeros(actor.num_configs)
+        self.rho_tm1 = np.ones(actor.num_configs)
+        self.pi_t = self.rho_t = self.delta_t = self.m_t = None
+
+    def per_row(self, values):
+        # Repeats the values of each run for each of its configurations (a single run's values are shared by every row instead):
+        return values[0] if self.num_runs == 1 else np.repeat(values, self.num_configs, axis=0)
+
+    def step(self, indices_t, a_t, r_tp1, indices_tp1, gamma_tp1, i_t, mu_t):
+        actor, critic, per_row = self.actor, self.critic, self.per_row
+        gamma_t = per_row(self.gamma_t)
+        indices_t, indices_tp1 = per_row(indices_t), per_row(indices_tp1)
+        mu_t = per_row(mu_t[np.arange(self.num_runs), a_t])  # The behaviour policy's probability of each run's action.
+        a_t, i_t = per_row(a_t), per_row(i_t)
+
+        # Compute importance sampling ratios for the policies:
+        self.pi_t = actor.pi(indices_t)
+        self.rho_t = self.pi_t[actor.rows[:, 0], a_t] / mu_t
+
+        # Update the critics:
+        self.delta_t = per_row(r_tp1) + per_row(gamma_tp1) * critic.estimate(indices_tp1) - critic.estimate(indices_t)
+        critic.learn(self.delta_t, indices_t, gamma_t, indices_tp1, per_row(gamma_tp1), self.rho_t)
+
+        # Update the actors:
+        self.f_t = self.rho_tm1 * gamma_t * self.f_t + i_t
+        self.m_t = (1 - self.eta) * i_t + self.eta * self.f_t
+        actor.learn(indices_t, a_t, self.delta_t, self.m_t, self.rho_t, self.pi_t)
+
+        self.gamma_t = gamma_tp1
+        self.rho_tm1 = self.rho_t
+
+
+class AllActionsACEStep:
+    """
+    Off-policy all-actions ACE with a BinaryACE actor and a GQ critic (BinaryGQ or LazyBinaryGQ), fused into one step per
+    transition. Owns the emphasis state (gamma_t, f_t and rho_tm1) and gathers the actor's active columns once for both
+    the policy and the update. The weights are the same, bit for bit, as calling actor.pi, critic.learn,
+    critic.estimate and actor.all_actions_learn in turn.
+    """
+
+    def __init__(self, actor, critic, eta):
+        self.actor = actor
+        self.critic = critic
+        self.eta = eta
+        self.gamma_t = 0.
+        self.f_t = 0.
+        self.rho_tm1 = 1.
+
+    def step(self, indices_t, a_t, r_tp1, indices_tp1, gamma_tp1, i_t, mu_t):
+        actor = self.actor
+
+        # Compute importance sampling ratio for the policy:
+        theta_t = actor.theta[:, indices_t]
+        preferences = theta_t.sum(axis=1)
+        preferences = preferences - preferences.max()
+        exp_preferences = np.exp(preferences)
+        pi_t = exp_preferences / np.sum(exp_preferences)
+        rho_t = pi_t[a_t] / mu_t[a_t]
+
+        # Update the critic:
+        self.critic.learn(indices_t, a_t, rho_t, self.gamma_t, r_tp1, indices_tp1, actor.pi(indices_tp1), gamma_tp1)
+
+        # Update the actor:
+        q_t = self.critic.estimate(indices_t)
+        self.f_t = self.rho_tm1 * self.gamma_t * self.f_t + i_t
+        m_t = (1 - self.eta) * i_t + self.eta * self.f_t
+        actor.theta[:, indices_t] = theta_t + (actor.alpha * m_t * pi_t * (q_t - pi_t.dot(q_t)))[:, np.newaxis]
+
+        self.gamma_t = gamma_tp1
+        self.rho_tm1 = rho_t
+
+
+class LowVarACEStep:
+    """
+    Off-policy ACE with a BinaryACE actor, a BinaryLowVarETD critic and a BinaryFHat estimate of the followon trace,
+    fused into one step per transition. The actor and the critic can use different tile coders.
+    Gathers the actor's active columns once for both the policy and the update, reuses fhat's estimate for the current
+    state in its update, and does the critic's dense update through a preallocated buffer instead of a temporary.
+    The weights are the same, bit for bit, as calling actor.pi, critic.estimate, fhat.estimate, actor.learn,
+    critic.learn and fhat.learn in turn.
+    """
+
+    def __init__(self, actor, critic, fhat, eta):
+        self.actor = actor
+        self.critic = critic
+        self.fhat = fhat
+        self.eta = eta
+        self.gamma_t = 0.
+        self.scratch = np.empty(critic.e.shape)  # float64 like the temporary it replaces (delta_t is float64), even for float32 weights.
+
+    def step(self, indices_t_a, indices_t_c, a_t, r_tp1, indices_tp1_c, gamma_tp1, i_t, i_tp1, mu_t):
+        actor, critic, fhat = self.actor, self.critic, self.fhat
+
+        # Compute importance sampling ratio for the policy:
+        theta_t = actor.theta[:, indices_t_a]
+        preferences = theta_t.sum(axis=1)
+        preferences = preferences - preferences.max()
+        exp_preferences = np.exp(preferences)
+        pi_t = exp_preferences / np.sum(exp_preferences)
+        rho_t = pi_t[a_t] / mu_t[a_t]
+
+        # Compute TD error:
+        delta_t = r_tp1 + gamma_tp1 * critic.v[indices_tp1_c].sum() - critic.v[indices_t_c].sum()
+
+        # Update the actor:
+        f_t = fhat.f[indices_t_c].sum()
+        m_t = (1 - self.eta) * i_t + self.eta * f_t
+        grad_log_pi = -pi_t
+        grad_log_pi[a_t] += 1
+        actor.theta[:, indices_t_a] = theta_t + (actor.alpha * rho_t * m_t * delta_t * grad_log_pi)[:, np.newaxis]
+
+        # Update the critic:
+        M = critic.lambda_c * i_t + (1. - critic.lambda_c) * f_t
+        critic.e *= rho_t * self.gamma_t * critic.lambda_c
+        critic.e[indices_t_c] += M * rho_t
+        critic.v += np.multiply(critic.alpha_v * delta_t, critic.e, out=self.scratch)
+
+        # Update fhat (f_t is still its estimate for the current state):
+        f_tp1 = fhat.f[indices_tp1_c]
+        fhat_delta = i_tp1 + gamma_tp1 * rho_t * f_t - f_tp1.sum()
+        fhat.f[indices_tp1_c] = f_tp1 + fhat.alpha * fhat_delta
+
+        self.gamma_t = gamma_tp1
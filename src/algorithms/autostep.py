@@ -0,0 +1,46 @@
+import numpy as np
+
+
+class Autostep:
+    """
+    Autostep (Mahmood, Sutton, Degris and Pilarski, 2012): a step size for each weight, adapted by IDBD-style
+    meta-gradient descent with the meta-gradient normalized by a running estimate of its magnitude (so the meta step
+    size mu rarely needs tuning), and with a stability guard that shrinks the step sizes whenever the effective step
+    size on the current example would exceed 1 (i.e. the update would overshoot).
+    The step sizes have the shape of the weights and only those of the active features (the last axis) are adapted,
+    so each update costs O(number of active features).
+    """
+
+    def __init__(self, shape, alpha, mu=.01, tau=10000., dtype=np.float64):
+        """
+        :param shape: The shape of the weights.
+        :param alpha: The initial step size.
+        :param mu: The meta step size.
+        :param tau: The time scale of the running estimate of the meta-gradient's magnitude.
+        """
+        self.mu = mu
+        self.tau = tau
+        self.alpha = np.full(shape, alpha, dtype=dtype)
+        self.h = np.zeros(shape, dtype=dtype)  # Trace of the recent updates to each weight.
+        self.v = np.zeros(shape, dtype=dtype)  # Running estimate of the magnitude of each meta-gradient.
+
+    def update(self, indices, delta, phi):
+        """
+        Adapts the step sizes of the active features for an update of delta * phi to their weights.
+        :param indices: The indices of the active features.
+        :param delta: The error (a scalar).
+        :param phi: The weights' features (or gradient) for the active features, broadcastable to the shape of
+        alpha[..., indices].
+        :return: The adapted step sizes of the active features.
+        """
+        alpha, h, v = self.alpha[..., indices], self.h[..., indices], self.v[..., indices]
+        phi = np.broadcast_to(phi, alpha.shape)
+        phi_squared = phi * phi
+        delta_phi_h = delta * phi * h
+        v = np.maximum(np.abs(delta_phi_h), v + alpha * phi_squared * (np.abs(delta_phi_h) - v) / self.tau)
+        alpha = alpha * np.exp(self.mu * np.divide(delta_phi_h, v, out=np.zeros_like(v), where=v != 0))
+        # Stability guard: scale the step sizes so the effective step size on this example is at most 1:
+        alpha /= max(np.sum(alpha * phi_squared), 1.)
+        h = h * (1 - alpha * phi_squared) + alpha * delta * phi
+        self.alpha[..., indices], self.h[..., indices], self.v[..., indices] = alpha, h, v
+        return alpha
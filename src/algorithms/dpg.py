@@ -31,6 +31,10 @@ class DPG:
             self.actor.learn(x_t, gamma_t, a_t, rho_t, grad_t, M=M)
         # self.critic.learn(delta_t, x_t, gamma_t, x_tp1, gamma_tp1, rho_t)
 
+    def learn_chunk(self, x_t, rho_t, grad_t, M=None, average=False):
+        # Learns from a chunk of transitions at once given the oracle critic's gradients (see DPGActor.learn_chunk):
+        self.actor.learn_chunk(x_t, rho_t, grad_t, M=M, average=average)
+
 class DPGActor:
 
     def __init__(self, num_features, alpha_u, lamda_a):
@@ -55,3 +59,26 @@ class DPGActor:
         self.policy.u += self.alpha_u * M * grad_t * self.policy.grad_pi(x_t)
 
         self.rho_tm1 = rho_t
+
+    def learn_chunk(self, x_t, rho_t, grad_t, M=None, average=False):
+        """
+        Applies the updates for a chunk of transitions at once, given their features x_t (shape (N, num_features)),
+        and their ratios rho_t, gradients grad_t and emphases M (shape (N,); M defaults to 1 like in learn).
+        The policy's gradient doesn't depend on its weights, so the updates can be computed together. By default
+        they're then applied in order, so the weights are the same, bit for bit, as calling learn for each transition.
+        If average is True, the mean of the updates is applied instead (a minibatch update).
+        """
+        x_t = np.asarray(x_t)
+        if len(x_t) == 0:
+            return
+        M = np.ones(len(x_t)) if M is None else np.asarray(M)
+        updates = (self.alpha_u * M * np.asarray(grad_t))[:, np.newaxis] * self.policy.grad_pi(x_t)
+        if average:
+            self.policy.u += updates.mean(axis=0)
+        else:
+            # Add the updates one after the other, like the per-step loop does:
+            updates[0] += self.policy.u
+            np.add.accumulate(updates, axis=0, out=updates)
+            self.policy.u[:] = updates[-1]
+
+        self.rho_tm1 = rho_t[-1]
@@ -1,7 +1,11 @@
 import numpy as np
+from src.algorithms.sparse_features import is_sparse, sparse_parts
 
 
 class LinearFHat:
+    """
+    Features can be dense arrays, scipy.sparse rows or (indices, values) pairs.
+    """
 
     def __init__(self, num_features, alpha):
         self.num_features = num_features
@@ -13,21 +17,28 @@ class LinearFHat:
     def learn(self, x_t, gamma_t, x_tm1, rho_tm1, i_t):
         target = i_t + gamma_t * rho_tm1 * self.estimate(x_tm1)
         delta_t = target - self.estimate(x_t)
-        self.f += self.alpha * delta_t * x_t
+        if is_sparse(x_t):
+            indices_t, values_t = sparse_parts(x_t)
+            self.f[indices_t] += self.alpha * delta_t * values_t
+        else:
+            self.f += self.alpha * delta_t * x_t
 
     def estimate(self, x):
+        if is_sparse(x):
+            indices, values = sparse_parts(x)
+            return self.f[indices].dot(values)
         return self.f.dot(x)
 
 
 
 class BinaryFHat:
 
-    def __init__(self, num_features, alpha):
+    def __init__(self, num_features, alpha, dtype=np.float64):
         self.num_features = num_features
 
         self.alpha = alpha
 
-        self.f = np.zeros(self.num_features)
+        self.f = np.zeros(self.num_features, dtype=dtype)
 
     def learn(self, indices_t, gamma_t, indices_tm1, rho_tm1, i_t):
         target = i_t + gamma_t * rho_tm1 * self.f[indices_tm1].sum()
@@ -1,19 +1,27 @@
 import numpy as np
+from src.algorithms.lazy_traces import LazyTraces
 
 
 class BinaryGOP:
     """Doesn't work. For some reason increases value estimates for state-actions not taken?!"""
 
-    def __init__(self, num_actions, num_features, alpha_v, alpha_w, lamda):
+    def __init__(self, num_actions, num_features, alpha_v, alpha_w, lamda, feature_major=False):
         self.num_actions = num_actions
         self.num_features = num_features
         self.alpha_v = alpha_v
         self.alpha_w = alpha_w
         self.lamda = lamda
-        self.e = np.zeros((self.num_actions, self.num_features))
-        self.e_w = np.zeros((self.num_actions, self.num_features))
-        self.v = np.zeros((self.num_actions, self.num_features))
-        self.w = np.zeros((self.num_actions, self.num_features))
+        # Feature-major weights are transposes of (num_features, num_actions) arrays, so the columns for the active features are contiguous:
+        if feature_major:
+            self.e = np.zeros((self.num_features, self.num_actions)).T
+            self.e_w = np.zeros((self.num_features, self.num_actions)).T
+            self.v = np.zeros((self.num_features, self.num_actions)).T
+            self.w = np.zeros((self.num_features, self.num_actions)).T
+        else:
+            self.e = np.zeros((self.num_actions, self.num_features))
+            self.e_w = np.zeros((self.num_actions, self.num_features))
+            self.v = np.zeros((self.num_actions, self.num_features))
+            self.w = np.zeros((self.num_actions, self.num_features))
 
     def learn(self, indices_t, a_t, gamma_t, rho_t, r_tp1, indices_tp1, gamma_tp1, pi_tp1):
         v_tp1 = pi_tp1.dot(self.estimate(indices_tp1))
@@ -30,7 +38,7 @@ class BinaryGOP:
         self.e_w[a_t, indices_t] += self.alpha_w * (1 - gamma_t * self.lamda * rho_t * e_w_dot_phi)
 
         # Compute this inner product before updating w, to use when updating v:
-        w_T_e = np.ravel(self.w).dot(np.ravel(self.e))
+        w_T_e = self.w.ravel('K').dot(self.e.ravel('K'))  # Ravel in memory order to avoid copies.
 
         # Update w:
         w_dot_phi = self.w[a_t, indices_t].sum()
@@ -38,10 +46,71 @@ class BinaryGOP:
         self.w[a_t, indices_t] -= self.alpha_w * w_dot_phi
 
         # Update v:
-        for a in range(self.num_actions):
-            self.v[a, indices_tp1] -= self.alpha_v * w_T_e * gamma_tp1 * pi_tp1[a]
+        self.v[:, indices_tp1] -= (self.alpha_v * w_T_e * gamma_tp1 * pi_tp1)[:, np.newaxis]
         self.v[a_t, indices_t] += self.alpha_v * w_T_e
 
     def estimate(self, indices, action=None):
         """Return value estimates for the given observation and action, or for all possible actions if 'action' is None."""
-        return self.v[:, indices].sum(axis=1) if action is None else self.v[action, indices].sum()
\ No newline at end of file
+        return self.v[:, indices].sum(axis=1) if action is None else self.v[action, indices].sum()
+
+
+class LazyBinaryGOP:
+    """
+    BinaryGOP with lazily scaled traces (see LazyTraces) over the flattened (num_actions * num_features) weights, so
+    each step takes time proportional to num_actions times the number of active features instead of the number of
+    weights. w and the traces are computed on access; v only changes at active features, so it's stored densely.
+    """
+
+    def __init__(self, num_actions, num_features, alpha_v, alpha_w, lamda, dtype=np.float64):
+        self.num_actions = num_actions
+        self.num_features = num_features
+        self.alpha_v = alpha_v
+        self.alpha_w = alpha_w
+        self.lamda = lamda
+        self.action_offsets = np.arange(num_actions, dtype=np.intp)[:, np.newaxis] * num_features
+        # Two traces (e and e_w), w follows e_w, and e.w is needed:
+        self.traces = LazyTraces(num_actions * num_features, 2, [1], dots=[(0, 0)], dtype=dtype)
+        self.v = np.zeros((self.num_actions, self.num_features), dtype=dtype)
+
+    @property
+    def e(self):
+        return self.traces.dense_trace(0).reshape(self.num_actions, self.num_features)
+
+    @property
+    def e_w(self):
+        return self.traces.dense_trace(1).reshape(self.num_actions, self.num_features)
+
+    @property
+    def w(self):
+        return self.traces.dense_weights(0).reshape(self.num_actions, self.num_features)
+
+    def learn(self, indices_t, a_t, gamma_t, rho_t, r_tp1, indices_tp1, gamma_tp1, pi_tp1):
+        v_tp1 = pi_tp1.dot(self.estimate(indices_tp1))
+        q_t = self.estimate(indices_t, a_t)
+        delta_t = r_tp1 + gamma_tp1 * v_tp1 - q_t
+        flat_indices_t = self.action_offsets[a_t] + indices_t
+
+        # Update eligibility trace:
+        self.traces.decay(0, gamma_t * self.lamda * rho_t)
+        self.traces.add_to_trace(0, flat_indices_t, 1.)
+
+        # Update Dutch trace:
+        e_w_dot_phi = self.traces.trace(1, flat_indices_t).sum()
+        self.traces.decay(1, gamma_t * self.lamda * rho_t)
+        self.traces.add_to_trace(1, flat_indices_t, self.alpha_w * (1 - gamma_t * self.lamda * rho_t * e_w_dot_phi))
+
+        # Compute this inner product before updating w, to use when updating v:
+        w_T_e = self.traces.dot(0, 0)
+
+        # Update w:
+        w_dot_phi = self.traces.weights(0, flat_indices_t).sum()
+        self.traces.step(0, delta_t)
+        self.traces.add_to_weights(0, flat_indices_t, -self.alpha_w * w_dot_phi)
+
+        # Update v:
+        self.v[:, indices_tp1] -= (self.alpha_v * w_T_e * gamma_tp1 * pi_tp1)[:, np.newaxis]
+        self.v[a_t, indices_t] += self.alpha_v * w_T_e
+
+    def estimate(self, indices, action=None):
+        """Return value estimates for the given observation and action, or for all possible actions if 'action' is None."""
+        return self.v[:, indices].sum(axis=1) if action is None else self.v[action, indices].sum()
@@ -0,0 +1,164 @@
+import numpy as np
+
+
+class LazyTraces:
+    """
+    Eligibility traces that decay by a scalar every step, and weight vectors that move along them, updated in time
+    proportional to the number of active features instead of the total number of features.
+
+    Trace j is stored as scale[j] * z_hat[j], so decaying it only changes its scale. Each follower k (a weight vector
+    that's updated by multiples of trace follows[k]) is stored as w_hat[k] + coef[k] * z_hat[follows[k]], so adding a
+    multiple of its trace only changes its coefficient. The dot products needed for dot(trace_num, follower_num) of
+    each (trace_num, follower_num) pair in dots are maintained incrementally, so they're O(1).
+
+    z_hat is only nonzero on the features traces were incremented at since they were last zeroed (the active set), so
+    renormalizing a trace when its scale leaves [min_scale, max_scale] and folding it into its followers when it decays
+    to zero (e.g. at the end of an episode) only touch those features. Both fold the followers' coefficients into their
+    w_hats, so w_hat and coef * z_hat can't grow large and cancel, and recompute the maintained dot products exactly.
+    Renormalizing also prunes the features where every trace has decayed below tolerance from the active set (zeroing
+    those entries), so in continuing tasks or long episodes the active set only holds the recently active features.
+    Indices passed to the methods must not contain duplicates.
+    """
+
+    def __init__(self, num_features, num_traces, follows, dots=(), min_scale=1e-3, max_scale=1e3, tolerance=1e-12, dtype=np.float64):
+        self.num_features = num_features
+        self.follows = list(follows)
+        self.followers = [[k for k, j in enumerate(self.follows) if j == trace_num] for trace_num in range(num_traces)]
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.tolerance = tolerance
+
+        self.scale = [1.] * num_traces
+        self.coef = [0.] * len(self.follows)
+        self.z_hat = np.zeros((num_traces, num_features), dtype=dtype)
+        self.w_hat = np.zeros((len(self.follows), num_features), dtype=dtype)
+
+        # Dot products between z_hats (gram) and between z_hats and w_hats (cross) needed for the given pairs:
+        self.cross = {(trace_num, follower_num): 0. for trace_num, follower_num in dots}
+        self.gram = {tuple(sorted((trace_num, self.follows[follower_num]))): 0. for trace_num, follower_num in dots}
+
+        # The active set, as a mask and the first num_active entries of active_indices:
+        self.is_active = np.zeros(num_features, dtype=bool)
+        self.active_indices = np.zeros(num_features, dtype=np.intp)
+        self.num_active = 0
+        self.is_zero = [True] * num_traces
+
+    def _recompute_dot_products(self):
+        active = self.active_indices[:self.num_active]
+        for a, b in self.gram:
+            self.gram[a, b] = self.z_hat[a, active].dot(self.z_hat[b, active])
+        for trace_num, follower_num in self.cross:
+            self.cross[trace_num, follower_num] = self.z_hat[trace_num, active].dot(self.w_hat[follower_num, active])
+
+    def _renormalize(self, trace_num):
+        # Fold the followers' coefficients into their w_hats, then the scale into z_hat:
+        active = self.active_indices[:self.num_active]
+        for follower_num in self.followers[trace_num]:
+            self.w_hat[follower_num, active] += self.coef[follower_num] * self.z_hat[trace_num, active]
+            self.coef[follower_num] = 0.
+        self.z_hat[trace_num, active] *= self.scale[trace_num]
+        self.scale[trace_num] = 1.
+        self._prune()
+        self._recompute_dot_products()
+
+    def _prune(self):
+        # Remove the features where every trace is below tolerance from the active set, folding them into the w_hats:
+        active = self.active_indices[:self.num_active]
+        scaled = np.abs(self.z_hat[:, active]) * np.array(self.scale)[:, np.newaxis]
+        stale = np.all(scaled < self.tolerance, axis=0)
+        if stale.any():
+            stale_indices = active[stale]
+            for follower_num, trace_num in enumerate(self.follows):
+                self.w_hat[follower_num, stale_indices] += self.coef[follower_num] * self.z_hat[trace_num, stale_indices]
+            self.z_hat[:, stale_indices] = 0.
+            self.is_active[stale_indices] = False
+            kept_indices = active[~stale]
+            self.num_active = len(kept_indices)
+            self.active_indices[:self.num_active] = kept_indices
+
+    def _zero(self, trace_num):
+        # Fold the trace into its followers' w_hats, and clear it (and the active set if every trace is zero):
+        active = self.active_indices[:self.num_active]
+        for follower_num in self.followers[trace_num]:
+            self.w_hat[follower_num, active] += self.coef[follower_num] * self.z_hat[trace_num, active]
+            self.coef[follower_num] = 0.
+        self.z_hat[trace_num, active] = 0.
+        self.scale[trace_num] = 1.
+        self.is_zero[trace_num] = True
+        if all(self.is_zero):
+            self.is_active[active] = False
+            self.num_active = 0
+        self._recompute_dot_products()
+
+    def decay(self, trace_num, c):
+        # trace *= c:
+        if c == 0:
+            if not self.is_zero[trace_num]:
+                self._zero(trace_num)
+        else:
+            self.scale[trace_num] *= c
+            if not self.min_scale <= abs(self.scale[trace_num]) <= self.max_scale:
+                self._renormalize(trace_num)
+
+    def add_to_trace(self, trace_num, indices, values):
+        # trace[indices] += values (the followers' weights don't change):
+        new_indices = indices[~self.is_active[indices]]
+        if len(new_indices):
+            self.is_active[new_indices] = True
+            self.active_indices[self.num_active:self.num_active + len(new_indices)] = new_indices
+            self.num_active += len(new_indices)
+        self.is_zero[trace_num] = False
+
+        z_hat = self.z_hat[trace_num]
+        increments = np.multiply(values, 1. / self.scale[trace_num], out=np.empty(len(indices)))
+        z_hat_old = z_hat[indices]
+        # Update the dot products for the change in z_hat and the compensating changes in the followers' w_hats:
+        for a, b in self.gram:
+            if a == trace_num and b == trace_num:
+                self.gram[a, b] += 2 * z_hat_old.dot(increments) + increments.dot(increments)
+            elif a == trace_num or b == trace_num:
+                self.gram[a, b] += self.z_hat[b if a == trace_num else a][indices].dot(increments)
+        for a, follower_num in self.cross:
+            followed = self.follows[follower_num] == trace_num
+            if a == trace_num:
+                w_old = self.w_hat[follower_num][indices]
+                self.cross[a, follower_num] += increments.dot(w_old)
+                if followed:
+                    # z_hat_new . w_hat_new - z_hat_old . w_hat_new, with w_hat_new = w_old - coef * increments:
+                    self.cross[a, follower_num] -= self.coef[follower_num] * (z_hat_old + increments).dot(increments)
+            elif followed:
+                self.cross[a, follower_num] -= self.coef[follower_num] * self.z_hat[a][indices].dot(increments)
+        z_hat[indices] = z_hat_old + increments
+        for follower_num in self.followers[trace_num]:
+            w_hat = self.w_hat[follower_num]
+            w_hat[indices] -= self.coef[follower_num] * increments
+
+    def step(self, follower_num, a):
+        # weights += a * trace:
+        self.coef[follower_num] += a * self.scale[self.follows[follower_num]]
+
+    def add_to_weights(self, follower_num, indices, values):
+        # weights[indices] += values:
+        w_hat = self.w_hat[follower_num]
+        w_hat[indices] += values
+        for trace_num, k in self.cross:
+            if k == follower_num:
+                z_hat = self.z_hat[trace_num][indices]
+                self.cross[trace_num, k] += z_hat.dot(values) if np.ndim(values) else z_hat.sum() * values
+
+    def trace(self, trace_num, indices):
+        return self.scale[trace_num] * self.z_hat[trace_num][indices]
+
+    def weights(self, follower_num, indices):
+        return self.w_hat[follower_num][indices] + self.coef[follower_num] * self.z_hat[self.follows[follower_num]][indices]
+
+    def dot(self, trace_num, follower_num):
+        # trace . weights (for a pair given in dots):
+        gram = self.gram[tuple(sorted((trace_num, self.follows[follower_num])))]
+        return self.scale[trace_num] * (self.cross[trace_num, follower_num] + self.coef[follower_num] * gram)
+
+    def dense_trace(self, trace_num):
+        return self.scale[trace_num] * self.z_hat[trace_num]
+
+    def dense_weights(self, follower_num):
+        return self.w_hat[follower_num] + self.coef[follower_num] * self.z_hat[self.follows[follower_num]]
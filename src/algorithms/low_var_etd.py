@@ -1,8 +1,15 @@
 import numpy as np
+from src.algorithms.lazy_traces import LazyTraces
+from src.algorithms.sparse_features import is_sparse, sparse_parts
+from src.algorithms.sparse_trace import SparseTrace
 
 
 # TODO: The linear one's probably based on an old implementation
 class LinearLowVarETD:
+    """
+    Features can be dense arrays, scipy.sparse rows or (indices, values) pairs; sparse features only touch the
+    trace entries of their nonzero entries (apart from the dense trace decay and weight update).
+    """
 
     def __init__(self, num_features, alpha, lambda_c):
         self.num_features = num_features
@@ -15,28 +22,36 @@ class LinearLowVarETD:
 
     def learn(self, delta_t, x_t, gamma_t, i_t, x_tp1, gamma_tp1, rho_t, F_t):
         M = self.lambda_c * i_t + (1. - self.lambda_c) * F_t
-        self.e = rho_t * (gamma_t * self.lambda_c * self.e + M * x_t)
+        if is_sparse(x_t):
+            indices_t, values_t = sparse_parts(x_t)
+            self.e *= rho_t * gamma_t * self.lambda_c
+            self.e[indices_t] += rho_t * M * values_t
+        else:
+            self.e = rho_t * (gamma_t * self.lambda_c * self.e + M * x_t)
         self.v += self.alpha * delta_t * self.e
 
     def estimate(self, x):
+        if is_sparse(x):
+            indices, values = sparse_parts(x)
+            return self.v[indices].dot(values)
         return self.v.dot(x)
 
 
 class BinaryLowVarETD:
 
-    def __init__(self, num_features, alpha_c, lambda_c, q_value_mode=False, num_action=None):
+    def __init__(self, num_features, alpha_c, lambda_c, q_value_mode=False, num_action=None, dtype=np.float64):
         self.alpha_v = alpha_c
         self.lambda_c = lambda_c
-        self.e = np.zeros(num_features)
-        self.v = np.zeros(num_features)
+        self.e = np.zeros(num_features, dtype=dtype)
+        self.v = np.zeros(num_features, dtype=dtype)
 
         self.q_value_mode = q_value_mode
         if self.q_value_mode:
             self.num_action = num_action
             self.num_features = num_features
             temp_dim = self.num_features*self.num_action
-            self.e_q = np.zeros(temp_dim)
-            self.v_q = np.zeros(temp_dim)
+            self.e_q = np.zeros(temp_dim, dtype=dtype)
+            self.v_q = np.zeros(temp_dim, dtype=dtype)
 
     def learn(self, delta_t, indices_t, gamma_t, i_t, indices_tp1, gamma_tp1, rho_t, F_t, r_tp1=None, rho_tp1=None, a_t=None, a_tp1=None):
         if self.q_value_mode:
@@ -58,3 +73,56 @@ class BinaryLowVarETD:
             return self.v_q[indices_new].sum()
         else:
             return self.v[indices].sum()
+
+
+class TruncatedBinaryLowVarETD(BinaryLowVarETD):
+    """
+    BinaryLowVarETD with a truncated sparse trace (see SparseTrace), so each step takes time proportional to the number
+    of entries in the trace instead of the number of features, and the trace's memory is bounded by max_entries.
+    """
+
+    def __init__(self, num_features, alpha_c, lambda_c, threshold=1e-8, max_entries=None, dtype=np.float64):
+        super().__init__(num_features, alpha_c, lambda_c, dtype=dtype)
+        self.e = SparseTrace(threshold, max_entries, dtype)
+
+    @property
+    def truncation_error(self):
+        return self.e.truncation_error
+
+    def learn(self, delta_t, indices_t, gamma_t, i_t, indices_tp1, gamma_tp1, rho_t, F_t):
+        M = self.lambda_c * i_t + (1. - self.lambda_c) * F_t
+
+        self.e.scale(rho_t * gamma_t * self.lambda_c)
+        self.e.add(indices_t, M * rho_t)
+        self.e.add_to(self.v, self.alpha_v * delta_t)
+
+
+class LazyBinaryLowVarETD:
+    """
+    BinaryLowVarETD with a lazily scaled trace (see LazyTraces), so each step takes time proportional to the number of
+    active features instead of the number of features. The weights and trace are computed on access.
+    """
+
+    def __init__(self, num_features, alpha_c, lambda_c, dtype=np.float64):
+        self.alpha_v = alpha_c
+        self.lambda_c = lambda_c
+        # One trace (e), followed by v:
+        self.traces = LazyTraces(num_features, 1, [0], dtype=dtype)
+
+    @property
+    def v(self):
+        return self.traces.dense_weights(0)
+
+    @property
+    def e(self):
+        return self.traces.dense_trace(0)
+
+    def learn(self, delta_t, indices_t, gamma_t, i_t, indices_tp1, gamma_tp1, rho_t, F_t):
+        M = self.lambda_c * i_t + (1. - self.lambda_c) * F_t
+
+        self.traces.decay(0, rho_t * gamma_t * self.lambda_c)
+        self.traces.add_to_trace(0, indices_t, M * rho_t)
+        self.traces.step(0, self.alpha_v * delta_t)
+
+    def estimate(self, indices):
+        return self.traces.weights(0, indices).sum()
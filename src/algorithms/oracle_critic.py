@@ -1,34 +1,77 @@
+import hashlib
 import numpy as np
 from blackhc import mdp
 import scipy
+from collections import OrderedDict
 
 class OracleCritic:
     ''' Returns the true state values for simple MDPs.
-    Assuming start state is index 0 and there's only one terminal state at the end.'''
+    Assuming start state is index 0 and there's only one terminal state at the end.
+    estimate and true_Mt also take a stack of policies of shape (K, |S|, |A|) and then return one row per policy.'''
 
-    def __init__(self, env, tc, policy):
+    def __init__(self, env, tc, policy, cache_size=256, singular_tolerance=.01):
         p, r, gamma = self._extract_info(env)
         self.tc = tc
         self.policy = policy
         self.num_states = p.shape[0]
         # Assuming MDP with states from 0 to |S|-1
         self.features = [tc.features(s) for s in range(self.num_states)]
+        self.feature_matrix = np.array(self.features)
 
         self.p = p
         self.p_r = np.sum(p*r, axis=2)
         self.p_gamma = p*gamma
 
+        # Inverses of I - P_pi_gamma, keyed by a digest of pi, so estimate and true_Mt share one solve per policy:
+        self.cache_size = cache_size
+        # cond(A) * eps bounds the relative error of a computed inverse of A, so A is treated as singular (and
+        # pseudoinverted) when that bound exceeds singular_tolerance, i.e. when the solve can't be trusted to ~1%:
+        self.singular_tolerance = singular_tolerance
+        self.inverses = OrderedDict()
+
+    def policy_matrix(self):
+        ''' The |S| x |A| matrix of the current policy's action probabilities. '''
+        if hasattr(self.policy, 'pi_batch'):
+            return self.policy.pi_batch(self.feature_matrix)
+        return np.array([self.policy.pi(x) for x in self.features])
+
+    def inverse(self, pi):
+        ''' (I - P_pi_gamma)^-1 for a policy or a stack of policies, solved for all the uncached policies at once. '''
+        pi = np.ascontiguousarray(pi, dtype=float)
+        policies = pi.reshape(-1, *pi.shape[-2:])
+        digests = [hashlib.sha1(policy.tobytes()).digest() for policy in policies]
+        missing = [k for k, digest in enumerate(digests) if digest not in self.inverses]
+        if missing:
+            a = np.eye(self.num_states) - np.einsum('ksa,sat->kst', policies[missing], self.p_gamma)
+            try:
+                inverses = np.linalg.solve(a, np.broadcast_to(np.eye(self.num_states), a.shape))
+                # The LU doesn't always detect singular matrices, so also check the 1-norm condition numbers:
+                condition_numbers = np.abs(a).sum(axis=1).max(axis=1) * np.abs(inverses).sum(axis=1).max(axis=1)
+                singular = condition_numbers * np.finfo(float).eps > self.singular_tolerance
+            except np.linalg.LinAlgError:
+                inverses, singular = np.empty_like(a), np.ones(len(a), dtype=bool)
+            if singular.any():
+                # I - P_pi_gamma is singular when a policy never terminates, so use the pseudoinverse like before:
+                inverses[singular] = np.linalg.pinv(a[singular])
+            for k, inverse in zip(missing, inverses):
+                self.inverses[digests[k]] = inverse
+        for digest in digests:
+            self.inverses.move_to_end(digest)
+        inverses = np.stack([self.inverses[digest] for digest in digests])
+        while len(self.inverses) > self.cache_size:
+            self.inverses.popitem(last=False)
+        return inverses.reshape(*pi.shape[:-2], self.num_states, self.num_states)
+
     def estimate(self, pi=None):
         ''' Gets the state instead of features '''
 
         # find pi from policy and tc
         if pi is None:
-            pi = np.array([self.policy.pi(x) for x in self.features])
+            pi = self.policy_matrix()
 
         # find v_pi
-        r_pi = np.sum(pi*self.p_r, axis=1)
-        p_pi_gamma = np.sum(pi[...,None]*self.p_gamma, axis=1)
-        v = np.linalg.pinv(np.eye(p_pi_gamma.shape[0]) - p_pi_gamma).dot(r_pi)
+        r_pi = np.sum(pi*self.p_r, axis=-1)
+        v = np.einsum('...st,...t->...s', self.inverse(pi), r_pi)
 
         # print('---')
         # print(pi)
@@ -39,7 +82,7 @@ class OracleCritic:
     def steady_distribution(self, pi=None):
         # find pi from policy and tc
         if pi is None:
-            pi = np.array([self.policy.pi(x) for x in self.features])
+            pi = self.policy_matrix()
 
         p_pi = np.sum(pi[...,None]*self.p, axis=1)
         vals, vecs, _ = scipy.linalg.eig(p_pi, left=True)
@@ -54,11 +97,10 @@ class OracleCritic:
 
          # find pi from policy and tc
         if pi is None:
-            pi = np.array([self.policy.pi(x) for x in self.features])
+            pi = self.policy_matrix()
 
         # find m
-        p_pi_gamma = np.sum(pi[...,None]*self.p_gamma, axis=1)
-        m = np.linalg.pinv(np.eye(p_pi_gamma.shape[0]) - p_pi_gamma).T.dot(d_mu)
+        m = np.einsum('...ts,...t->...s', self.inverse(pi), d_mu)
 
         # print('---')
         # print(d_mu)
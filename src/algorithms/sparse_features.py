@@ -0,0 +1,26 @@
+import numpy as np
+from scipy.sparse import issparse
+
+
+def is_sparse(x):
+    """
+    Whether a feature vector is given sparsely, i.e. as a scipy.sparse row or as an (indices, values) pair.
+    """
+    return issparse(x) or isinstance(x, tuple)
+
+
+def sparse_parts(x):
+    """
+    The indices and values of the nonzero entries of a feature vector given as a scipy.sparse row, an (indices, values)
+    pair (whose indices must not repeat) or a dense array.
+    """
+    if issparse(x):
+        x = x.tocsr()
+        x.sum_duplicates()
+        return x.indices, x.data
+    if isinstance(x, tuple):
+        indices, values = x
+        return np.asarray(indices), np.asarray(values, dtype=float)
+    x = np.ravel(x)
+    indices = np.flatnonzero(x)
+    return indices, x[indices]
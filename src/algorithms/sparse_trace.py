@@ -0,0 +1,79 @@
+import numpy as np
+
+
+class SparseTrace:
+    """
+    An eligibility trace stored as sorted arrays of the indices and values of its nonzero entries, so decaying it and
+    using it to update weights takes time proportional to its number of entries instead of the number of features.
+    Entries whose magnitude is at most threshold are dropped, and if there are more than max_entries entries,
+    the smallest are dropped. truncation_error accumulates the magnitudes of the dropped entries, i.e. the total amount
+    of trace the truncation has discarded (0 means the trace is exact).
+    Indices passed to add must not contain duplicates.
+    """
+
+    def __init__(self, threshold=1e-8, max_entries=None, dtype=np.float64):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.indices = np.zeros(0, dtype=np.intp)
+        self.values = np.zeros(0, dtype=dtype)
+        self.truncation_error = 0.
+
+    def __len__(self):
+        return len(self.indices)
+
+    def _find(self, indices):
+        # Where each index is (or would be inserted) in self.indices, and whether it's there:
+        positions = np.searchsorted(self.indices, indices)
+        found = positions < len(self.indices)
+        found[found] = self.indices[positions[found]] == indices[found]
+        return positions, found
+
+    def _truncate(self):
+        keep = np.abs(self.values) > self.threshold
+        if self.max_entries is not None and np.count_nonzero(keep) > self.max_entries:
+            # Keep only the max_entries largest entries:
+            keep[np.argpartition(np.abs(self.values), -self.max_entries)[:-self.max_entries]] = False
+        if not keep.all():
+            self.truncation_error += np.abs(self.values[~keep]).sum()
+            self.indices = self.indices[keep]
+            self.values = self.values[keep]
+
+    def scale(self, c):
+        # trace *= c:
+        if c == 0:
+            self.indices = self.indices[:0]
+            self.values = self.values[:0]
+        else:
+            self.values *= c
+            self._truncate()
+
+    def add(self, indices, values):
+        # trace[indices] += values:
+        values = np.broadcast_to(values, np.shape(indices))
+        positions, found = self._find(indices)
+        self.values[positions[found]] += values[found]
+        if not found.all():
+            new = np.flatnonzero(~found)
+            new = new[np.argsort(indices[new])]
+            self.indices = np.insert(self.indices, positions[new], indices[new])
+            self.values = np.insert(self.values, positions[new], values[new])
+        self._truncate()
+
+    def get(self, indices):
+        # trace[indices]:
+        positions, found = self._find(indices)
+        values = np.zeros(np.shape(indices), dtype=self.values.dtype)
+        values[found] = self.values[positions[found]]
+        return values
+
+    def dot(self, w):
+        return w[self.indices].dot(self.values)
+
+    def add_to(self, w, c):
+        # w += c * trace:
+        w[self.indices] += c * self.values
+
+    def dense(self, num_features):
+        trace = np.zeros(num_features, dtype=self.values.dtype)
+        trace[self.indices] = self.values
+        return trace
@@ -1,7 +1,15 @@
 import numpy as np
+from src.algorithms.autostep import Autostep
+from src.algorithms.sparse_features import is_sparse, sparse_parts
+from src.algorithms.lazy_traces import LazyTraces
+from src.algorithms.sparse_trace import SparseTrace
 
 
 class LinearTDC:
+    """
+    Features can be dense arrays, scipy.sparse rows or (indices, values) pairs; sparse features only touch the
+    weights of their nonzero entries (apart from the dense trace updates).
+    """
 
     def __init__(self, num_features, alpha_w, alpha_v, lambda_c):
         self.num_features = num_features
@@ -13,24 +21,39 @@ class LinearTDC:
         self.z = np.zeros(num_features)
 
     def learn(self, delta_t, x_t, gamma_t, x_tp1, gamma_tp1, rho_t):
+        if is_sparse(x_t) or is_sparse(x_tp1):
+            return self._sparse_learn(delta_t, sparse_parts(x_t), gamma_t, sparse_parts(x_tp1), gamma_tp1, rho_t)
         self.z = rho_t * (gamma_t * self.lambda_c * self.z + x_t)
         self.w += self.alpha_w * delta_t * self.z - self.alpha_w * gamma_tp1 * (1 - self.lambda_c) * self.z.dot(self.v) * x_tp1
         self.v += self.alpha_v * delta_t * self.z - self.alpha_v * self.v.dot(x_t) * x_t
 
+    def _sparse_learn(self, delta_t, x_t, gamma_t, x_tp1, gamma_tp1, rho_t):
+        (indices_t, values_t), (indices_tp1, values_tp1) = x_t, x_tp1
+        self.z *= rho_t * gamma_t * self.lambda_c
+        self.z[indices_t] += rho_t * values_t
+        self.w += self.alpha_w * delta_t * self.z
+        self.w[indices_tp1] -= self.alpha_w * gamma_tp1 * (1 - self.lambda_c) * self.z.dot(self.v) * values_tp1
+        v_dot_x = self.v[indices_t].dot(values_t)
+        self.v += self.alpha_v * delta_t * self.z
+        self.v[indices_t] -= self.alpha_v * v_dot_x * values_t
+
     def estimate(self, x_t):
+        if is_sparse(x_t):
+            indices, values = sparse_parts(x_t)
+            return self.w[indices].dot(values)
         return self.w.dot(x_t)
 
 
 class BinaryTDC:
 
-    def __init__(self, num_features, alpha_w, alpha_v, lambda_c):
+    def __init__(self, num_features, alpha_w, alpha_v, lambda_c, dtype=np.float64):
         self.num_features = num_features
         self.alpha_w = alpha_w
         self.alpha_v = alpha_v
         self.lambda_c = lambda_c
-        self.w = np.zeros(num_features)
-        self.v = np.zeros(num_features)
-        self.z = np.zeros(num_features)
+        self.w = np.zeros(num_features, dtype=dtype)
+        self.v = np.zeros(num_features, dtype=dtype)
+        self.z = np.zeros(num_features, dtype=dtype)
 
     def learn(self, delta_t, indices_t, gamma_t, indices_tp1, gamma_tp1, rho_t):
         self.z *= rho_t * gamma_t * self.lambda_c
@@ -45,26 +68,158 @@ class BinaryTDC:
         return self.w[indices].sum()
 
 
+class AutostepBinaryTDC(BinaryTDC):
+    """
+    BinaryTDC with a step size for each weight adapted by Autostep, starting from alpha_w and alpha_v.
+    Only the step sizes of the active features are adapted (so adaptation costs O(number of active features)), with
+    delta_t as the error and the active features' traces as the features for the main weights, and the auxiliary
+    weights' error (delta_t - v.x_t) for the auxiliary weights. The dense trace updates use the adapted step sizes.
+    """
+
+    def __init__(self, num_features, alpha_w, alpha_v, lambda_c, mu=.01, tau=10000., dtype=np.float64):
+        super().__init__(num_features, alpha_w, alpha_v, lambda_c, dtype)
+        self.autostep_w = Autostep(num_features, alpha_w, mu, tau, dtype)
+        self.autostep_v = Autostep(num_features, alpha_v, mu, tau, dtype)
+
+    def learn(self, delta_t, indices_t, gamma_t, indices_tp1, gamma_tp1, rho_t):
+        self.z *= rho_t * gamma_t * self.lambda_c
+        self.z[indices_t] += rho_t
+        v_dot_x = self.v[indices_t].sum()
+        self.autostep_w.update(indices_t, delta_t, self.z[indices_t])
+        alpha_v = self.autostep_v.update(indices_t, delta_t - v_dot_x, 1.)
+        self.w += self.autostep_w.alpha * delta_t * self.z
+        self.w[indices_tp1] -= self.autostep_w.alpha[indices_tp1] * gamma_tp1 * (1 - self.lambda_c) * self.z.dot(self.v)
+        self.v += self.autostep_v.alpha * delta_t * self.z
+        self.v[indices_t] -= alpha_v * v_dot_x
+
+
+class LazyBinaryTDC:
+    """
+    BinaryTDC with lazily scaled traces (see LazyTraces), so each step takes time proportional to the number of active
+    features instead of the number of features. The weights and trace are computed on access.
+    """
+
+    def __init__(self, num_features, alpha_w, alpha_v, lambda_c, dtype=np.float64):
+        self.num_features = num_features
+        self.alpha_w = alpha_w
+        self.alpha_v = alpha_v
+        self.lambda_c = lambda_c
+        # One trace (z), followed by w and v, and z.v is needed:
+        self.traces = LazyTraces(num_features, 1, [0, 0], dots=[(0, 1)], dtype=dtype)
+
+    @property
+    def w(self):
+        return self.traces.dense_weights(0)
+
+    @property
+    def v(self):
+        return self.traces.dense_weights(1)
+
+    @property
+    def z(self):
+        return self.traces.dense_trace(0)
+
+    def learn(self, delta_t, indices_t, gamma_t, indices_tp1, gamma_tp1, rho_t):
+        self.traces.decay(0, rho_t * gamma_t * self.lambda_c)
+        self.traces.add_to_trace(0, indices_t, rho_t)
+        self.traces.step(0, self.alpha_w * delta_t)
+        self.traces.add_to_weights(0, indices_tp1, -self.alpha_w * gamma_tp1 * (1 - self.lambda_c) * self.traces.dot(0, 1))
+        v_dot_x = self.traces.weights(1, indices_t).sum()
+        self.traces.step(1, self.alpha_v * delta_t)
+        self.traces.add_to_weights(1, indices_t, -self.alpha_v * v_dot_x)
+
+    def estimate(self, indices):
+        return self.traces.weights(0, indices).sum()
+
+
+class TruncatedBinaryTDC(BinaryTDC):
+    """
+    BinaryTDC with a truncated sparse trace (see SparseTrace), so each step takes time proportional to the number of
+    entries in the trace instead of the number of features, and the trace's memory is bounded by max_entries.
+    """
+
+    def __init__(self, num_features, alpha_w, alpha_v, lambda_c, threshold=1e-8, max_entries=None, dtype=np.float64):
+        super().__init__(num_features, alpha_w, alpha_v, lambda_c, dtype)
+        self.z = SparseTrace(threshold, max_entries, dtype)
+
+    @property
+    def truncation_error(self):
+        return self.z.truncation_error
+
+    def learn(self, delta_t, indices_t, gamma_t, indices_tp1, gamma_tp1, rho_t):
+        self.z.scale(rho_t * gamma_t * self.lambda_c)
+        self.z.add(indices_t, rho_t)
+        self.z.add_to(self.w, self.alpha_w * delta_t)
+        self.w[indices_tp1] -= self.alpha_w * gamma_tp1 * (1 - self.lambda_c) * self.z.dot(self.v)
+        v_dot_x = self.v[indices_t].sum()
+        self.z.add_to(self.v, self.alpha_v * delta_t)
+        self.v[indices_t] -= self.alpha_v * v_dot_x
+
+
+class BatchBinaryTDC:
+    """
+    BinaryTDC for several configurations (or independent runs) learning in lockstep.
+    The weights and traces have a leading row axis (shape (num_configs, num_features)),
+    and alpha_w, alpha_v and lambda_c broadcast to a vector with a value for each row.
+    Indices can be shared by all rows (shape (num_active_features,)) or given for each row
+    (shape (num_configs, num_active_features)), in which case gamma_t and gamma_tp1 can have a value for each row too.
+    Gathered weights are copied into C order before summing so each row is summed exactly like BinaryTDC sums.
+    """
+
+    def __init__(self, num_features, alpha_w, alpha_v, lambda_c, dtype=np.float64):
+        self.num_features = num_features
+        self.alpha_w, self.alpha_v, self.lambda_c = (np.array(parameter, dtype=float) for parameter in np.broadcast_arrays(alpha_w, alpha_v, lambda_c))
+        self.num_configs = len(self.alpha_w)
+        self.w = np.zeros((self.num_configs, num_features), dtype=dtype)
+        self.v = np.zeros((self.num_configs, num_features), dtype=dtype)
+        self.z = np.zeros((self.num_configs, num_features), dtype=dtype)
+        self.rows = np.arange(self.num_configs)[:, np.newaxis]
+
+    def _active(self, indices):
+        # Index of the active features of every row:
+        return (slice(None), indices) if np.ndim(indices) == 1 else (self.rows, indices)
+
+    def learn(self, delta_t, indices_t, gamma_t, indices_tp1, gamma_tp1, rho_t):
+        # delta_t and rho_t have a value for each row:
+        active_t, active_tp1 = self._active(indices_t), self._active(indices_tp1)
+        self.z *= (rho_t * gamma_t * self.lambda_c)[:, np.newaxis]
+        self.z[active_t] += rho_t[:, np.newaxis]
+        self.w += (self.alpha_w * delta_t)[:, np.newaxis] * self.z
+        z_dot_v = np.matmul(self.z[:, np.newaxis, :], self.v[:, :, np.newaxis])[:, 0, 0]  # Row-wise dot products.
+        self.w[active_tp1] -= (self.alpha_w * gamma_tp1 * (1 - self.lambda_c) * z_dot_v)[:, np.newaxis]
+        v_dot_x = np.ascontiguousarray(self.v[active_t]).sum(axis=1)
+        self.v += (self.alpha_v * delta_t)[:, np.newaxis] * self.z
+        self.v[active_t] -= (self.alpha_v * v_dot_x)[:, np.newaxis]
+
+    def estimate(self, indices):
+        return np.ascontiguousarray(self.w[self._active(indices)]).sum(axis=1)
+
+
 class BinaryGQ:
 
-    def __init__(self, num_actions, num_features, alpha_w, alpha_v, lambda_c):
+    def __init__(self, num_actions, num_features, alpha_w, alpha_v, lambda_c, dtype=np.float64, feature_major=False):
         self.num_actions = num_actions
         self.num_features = num_features
         self.alpha_w = alpha_w
         self.alpha_v = alpha_v
         self.lambda_c = lambda_c
-        self.w = np.zeros((num_actions, num_features))
-        self.v = np.zeros((num_actions, num_features))
-        self.z = np.zeros((num_actions, num_features))
+        # Feature-major weights are transposes of (num_features, num_actions) arrays, so the columns for the active features are contiguous:
+        if feature_major:
+            self.w = np.zeros((num_features, num_actions), dtype=dtype).T
+            self.v = np.zeros((num_features, num_actions), dtype=dtype).T
+            self.z = np.zeros((num_features, num_actions), dtype=dtype).T
+        else:
+            self.w = np.zeros((num_actions, num_features), dtype=dtype)
+            self.v = np.zeros((num_actions, num_features), dtype=dtype)
+            self.z = np.zeros((num_actions, num_features), dtype=dtype)
 
     def learn(self, indices_t, a_t, rho_t, gamma_t, r_tp1, indices_tp1, pi_tp1, gamma_tp1):
         delta_t = r_tp1 + gamma_tp1 * pi_tp1.dot(self.estimate(indices_tp1)) - self.estimate(indices_t, a_t)
         self.z *= rho_t * gamma_t * self.lambda_c
         self.z[a_t, indices_t] += rho_t
-        z_dot_v = np.ravel(self.z).dot(np.ravel(self.v))
+        z_dot_v = self.z.ravel('K').dot(self.v.ravel('K'))  # Ravel in memory order to avoid copies.
         self.w += self.alpha_w * delta_t * self.z
-        for a_tp1 in range(self.num_actions):
-            self.w[a_tp1, indices_tp1] -= pi_tp1[a_tp1] * self.alpha_w * gamma_tp1 * (1 - self.lambda_c) * z_dot_v
+        self.w[:, indices_tp1] -= (pi_tp1 * self.alpha_w * gamma_tp1 * (1 - self.lambda_c) * z_dot_v)[:, np.newaxis]
         v_dot_x = self.v[a_t, indices_t].sum()
         self.v += self.alpha_v * delta_t * self.z
         self.v[a_t, indices_t] -= self.alpha_v * v_dot_x
@@ -73,6 +228,82 @@ class BinaryGQ:
         return self.w[:, indices].sum(axis=1) if action is None else self.w[action, indices].sum()
 
 
+class TruncatedBinaryGQ(BinaryGQ):
+    """
+    BinaryGQ with a truncated sparse trace (see SparseTrace) over the flattened (num_actions * num_features) weights,
+    indexed by action * num_features + feature, so each step takes time proportional to the number of entries in the
+    trace instead of the number of weights, and the trace's memory is bounded by max_entries.
+    """
+
+    def __init__(self, num_actions, num_features, alpha_w, alpha_v, lambda_c, threshold=1e-8, max_entries=None, dtype=np.float64):
+        super().__init__(num_actions, num_features, alpha_w, alpha_v, lambda_c, dtype)
+        self.z = SparseTrace(threshold, max_entries, dtype)
+
+    @property
+    def truncation_error(self):
+        return self.z.truncation_error
+
+    def learn(self, indices_t, a_t, rho_t, gamma_t, r_tp1, indices_tp1, pi_tp1, gamma_tp1):
+        delta_t = r_tp1 + gamma_tp1 * pi_tp1.dot(self.estimate(indices_tp1)) - self.estimate(indices_t, a_t)
+        w, v = self.w.reshape(-1), self.v.reshape(-1)
+        self.z.scale(rho_t * gamma_t * self.lambda_c)
+        self.z.add(a_t * self.num_features + np.asarray(indices_t, dtype=np.intp), rho_t)
+        z_dot_v = self.z.dot(v)
+        self.z.add_to(w, self.alpha_w * delta_t)
+        self.w[:, indices_tp1] -= (pi_tp1 * self.alpha_w * gamma_tp1 * (1 - self.lambda_c) * z_dot_v)[:, np.newaxis]
+        v_dot_x = self.v[a_t, indices_t].sum()
+        self.z.add_to(v, self.alpha_v * delta_t)
+        self.v[a_t, indices_t] -= self.alpha_v * v_dot_x
+
+
+class LazyBinaryGQ:
+    """
+    BinaryGQ with lazily scaled traces (see LazyTraces) over the flattened (num_actions * num_features) weights, so each
+    step takes time proportional to num_actions times the number of active features instead of the number of weights.
+    The weights and trace are computed on access.
+    """
+
+    def __init__(self, num_actions, num_features, alpha_w, alpha_v, lambda_c, dtype=np.float64):
+        self.num_actions = num_actions
+        self.num_features = num_features
+        self.alpha_w = alpha_w
+        self.alpha_v = alpha_v
+        self.lambda_c = lambda_c
+        self.action_offsets = np.arange(num_actions, dtype=np.intp)[:, np.newaxis] * num_features
+        # One trace (z), followed by w and v, and z.v is needed:
+        self.traces = LazyTraces(num_actions * num_features, 1, [0, 0], dots=[(0, 1)], dtype=dtype)
+
+    @property
+    def w(self):
+        return self.traces.dense_weights(0).reshape(self.num_actions, self.num_features)
+
+    @property
+    def v(self):
+        return self.traces.dense_weights(1).reshape(self.num_actions, self.num_features)
+
+    @property
+    def z(self):
+        return self.traces.dense_trace(0).reshape(self.num_actions, self.num_features)
+
+    def learn(self, indices_t, a_t, rho_t, gamma_t, r_tp1, indices_tp1, pi_tp1, gamma_tp1):
+        delta_t = r_tp1 + gamma_tp1 * pi_tp1.dot(self.estimate(indices_tp1)) - self.estimate(indices_t, a_t)
+        flat_indices_t = self.action_offsets[a_t] + indices_t
+        self.traces.decay(0, rho_t * gamma_t * self.lambda_c)
+        self.traces.add_to_trace(0, flat_indices_t, rho_t)
+        z_dot_v = self.traces.dot(0, 1)
+        self.traces.step(0, self.alpha_w * delta_t)
+        corrections = -pi_tp1 * self.alpha_w * gamma_tp1 * (1 - self.lambda_c) * z_dot_v
+        self.traces.add_to_weights(0, (self.action_offsets + indices_tp1).ravel(), np.repeat(corrections, len(indices_tp1)))
+        v_dot_x = self.traces.weights(1, flat_indices_t).sum()
+        self.traces.step(1, self.alpha_v * delta_t)
+        self.traces.add_to_weights(1, flat_indices_t, -self.alpha_v * v_dot_x)
+
+    def estimate(self, indices, action=None):
+        if action is None:
+            return self.traces.weights(0, (self.action_offsets + indices).ravel()).reshape(self.num_actions, -1).sum(axis=1)
+        return self.traces.weights(0, self.action_offsets[action] + indices).sum()
+
+
 class BinaryTOGQ:
     # Currently isn't quite right. Might need to actually derive TOGQ instead of modifying TOGTD.
     def __init__(self, num_actions, num_features, alpha_w, alpha_v, lambda_c):
@@ -109,8 +340,7 @@ class BinaryTOGQ:
         v_dot_z = np.ravel(self.v).dot(np.ravel(self.z))
         self.w += delta_t * self.z_w + self.z_w * (q_t - q_old)
         self.w[a_t, indices_t] -= self.alpha_w * rho_t * (q_t - q_old)
-        for a_tp1 in range(self.num_actions):
-            self.w[a_tp1, indices_tp1] -= pi_tp1[a_tp1] * self.alpha_w * gamma_tp1 * (1 - self.lambda_c) * v_dot_z
+        self.w[:, indices_tp1] -= (pi_tp1 * self.alpha_w * gamma_tp1 * (1 - self.lambda_c) * v_dot_z)[:, np.newaxis]
 
         # Update auxiliary weights:
         v_dot_x = self.v[a_t, indices_t].sum()
@@ -119,3 +349,77 @@ class BinaryTOGQ:
 
     def estimate(self, indices, action=None):
         return self.w[:, indices].sum(axis=1) if action is None else self.w[action, indices].sum()
+
+
+class LazyBinaryTOGQ:
+    """
+    BinaryTOGQ with lazily scaled traces (see LazyTraces) over the flattened (num_actions * num_features) weights, so
+    each step takes time proportional to num_actions times the number of active features instead of the number of
+    weights. The weights and traces are computed on access.
+    """
+
+    def __init__(self, num_actions, num_features, alpha_w, alpha_v, lambda_c, dtype=np.float64):
+        self.num_actions = num_actions
+        self.num_features = num_features
+        self.alpha_w = alpha_w
+        self.alpha_v = alpha_v
+        self.lambda_c = lambda_c
+        self.action_offsets = np.arange(num_actions, dtype=np.intp)[:, np.newaxis] * num_features
+        # Three traces (z, z_w and z_v), w follows z_w and v follows z_v, and z.v is needed:
+        self.traces = LazyTraces(num_actions * num_features, 3, [1, 2], dots=[(0, 1)], dtype=dtype)
+
+    @property
+    def w(self):
+        return self.traces.dense_weights(0).reshape(self.num_actions, self.num_features)
+
+    @property
+    def v(self):
+        return self.traces.dense_weights(1).reshape(self.num_actions, self.num_features)
+
+    @property
+    def z(self):
+        return self.traces.dense_trace(0).reshape(self.num_actions, self.num_features)
+
+    @property
+    def z_w(self):
+        return self.traces.dense_trace(1).reshape(self.num_actions, self.num_features)
+
+    @property
+    def z_v(self):
+        return self.traces.dense_trace(2).reshape(self.num_actions, self.num_features)
+
+    def learn(self, q_old, rho_tm1, indices_t, a_t, gamma_t, rho_t, r_tp1, indices_tp1, pi_tp1, gamma_tp1):
+        q_t = self.estimate(indices_t, a_t)
+        delta_t = r_tp1 + gamma_tp1 * pi_tp1.dot(self.estimate(indices_tp1)) - q_t
+        flat_indices_t = self.action_offsets[a_t] + indices_t
+
+        # Update trace for gradient correction:
+        self.traces.decay(0, rho_t * gamma_t * self.lambda_c)
+        self.traces.add_to_trace(0, flat_indices_t, rho_t)
+
+        # Update trace for main weights:
+        z_w_dot_x = self.traces.trace(1, flat_indices_t).sum()
+        self.traces.decay(1, rho_t * gamma_t * self.lambda_c)
+        self.traces.add_to_trace(1, flat_indices_t, rho_t * self.alpha_w * (1 - rho_t * gamma_t * self.lambda_c * z_w_dot_x))
+
+        # Update trace for auxiliary weights:
+        z_v_dot_x = self.traces.trace(2, flat_indices_t).sum()
+        self.traces.decay(2, rho_tm1 * gamma_t * self.lambda_c)
+        self.traces.add_to_trace(2, flat_indices_t, self.alpha_v * (1 - rho_tm1 * gamma_t * self.lambda_c * z_v_dot_x))
+
+        # Update main weights:
+        v_dot_z = self.traces.dot(0, 1)
+        self.traces.step(0, delta_t + (q_t - q_old))
+        self.traces.add_to_weights(0, flat_indices_t, -self.alpha_w * rho_t * (q_t - q_old))
+        corrections = -pi_tp1 * self.alpha_w * gamma_tp1 * (1 - self.lambda_c) * v_dot_z
+        self.traces.add_to_weights(0, (self.action_offsets + indices_tp1).ravel(), np.repeat(corrections, len(indices_tp1)))
+
+        # Update auxiliary weights:
+        v_dot_x = self.traces.weights(1, flat_indices_t).sum()
+        self.traces.step(1, rho_t * delta_t)
+        self.traces.add_to_weights(1, flat_indices_t, -self.alpha_v * v_dot_x)
+
+    def estimate(self, indices, action=None):
+        if action is None:
+            return self.traces.weights(0, (self.action_offsets + indices).ravel()).reshape(self.num_actions, -1).sum(axis=1)
+        return self.traces.weights(0, self.action_offsets[action] + indices).sum()
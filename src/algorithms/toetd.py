@@ -1,9 +1,13 @@
 import numpy as np
+from src.algorithms.lazy_traces import LazyTraces
+from src.algorithms.sparse_trace import SparseTrace
+from src.algorithms.sparse_features import is_sparse, sparse_parts
 
 
 class LinearTOETD:
     """
     True Online Emphatic Temporal Difference learning algorithm by Ashique Rupam Mahmood.
+    Features can be dense arrays, scipy.sparse rows or (indices, values) pairs.
     """
     def __init__(self, num_features, I, alpha):
         self.ep = np.zeros(num_features)
@@ -16,8 +20,17 @@ class LinearTOETD:
         self.prevlm = 0
 
     def learn(self, phi, delta, rho, gm, lm, I, alpha):
-        self.ep = rho*(self.prevgm*self.prevlm*self.ep + self.M*(1-rho*self.prevgm*self.prevlm*np.dot(self.ep, phi))*phi)
-        Delta = delta*self.ep + np.dot(self.theta - self.prevtheta, phi)*(self.ep - rho*self.M*phi)
+        if is_sparse(phi):
+            indices, values = sparse_parts(phi)
+            ep_dot_phi = self.ep[indices].dot(values)
+            self.ep *= rho*self.prevgm*self.prevlm
+            self.ep[indices] += rho*self.M*(1-rho*self.prevgm*self.prevlm*ep_dot_phi)*values
+            del_theta_dot_phi = (self.theta[indices] - self.prevtheta[indices]).dot(values)
+            Delta = delta*self.ep + del_theta_dot_phi*self.ep
+            Delta[indices] -= del_theta_dot_phi*rho*self.M*values
+        else:
+            self.ep = rho*(self.prevgm*self.prevlm*self.ep + self.M*(1-rho*self.prevgm*self.prevlm*np.dot(self.ep, phi))*phi)
+            Delta = delta*self.ep + np.dot(self.theta - self.prevtheta, phi)*(self.ep - rho*self.M*phi)
         self.prevtheta = self.theta.copy()
         self.theta += Delta
         self.H = rho*gm*(self.H + self.prevI)
@@ -27,6 +40,9 @@ class LinearTOETD:
         self.prevI = I
 
     def estimate(self, phi):
+        if is_sparse(phi):
+            indices, values = sparse_parts(phi)
+            return self.theta[indices].dot(values)
         return self.theta.dot(phi)
 
 
@@ -61,3 +77,93 @@ class BinaryTOETD:
 
     def estimate(self, indices_t):
         return self.theta[indices_t].sum()
+
+
+class TruncatedBinaryTOETD(BinaryTOETD):
+    """
+    BinaryTOETD with a truncated sparse trace (see SparseTrace), so each step takes time proportional to the number of
+    entries in the trace instead of the number of features, and the trace's memory is bounded by max_entries.
+    Like LazyBinaryTOETD, (theta - prevtheta).phi is computed from the previous update instead of copying theta.
+    """
+
+    def __init__(self, num_features, I, alpha, threshold=1e-8, max_entries=None):
+        super().__init__(num_features, I, alpha)
+        self.ep = SparseTrace(threshold, max_entries)
+        self.prevtheta = None
+        self.k_prev = 0.
+        self.g_prev = 0.
+        self.is_prev_index = np.zeros(num_features, dtype=bool)
+        self.indices_prev = np.zeros(0, dtype=np.intp)
+
+    @property
+    def truncation_error(self):
+        return self.ep.truncation_error
+
+    def learn(self, indices_t, delta, rho, gm, lm, I, alpha):
+        ep_dot_phi = self.ep.get(indices_t).sum()
+        self.ep.scale(rho*self.prevgm*self.prevlm)
+        self.ep.add(indices_t, rho*self.M*(1-rho*self.prevgm*self.prevlm*ep_dot_phi))
+        del_theta_dot_phi = self.k_prev*ep_dot_phi - self.g_prev*np.count_nonzero(self.is_prev_index[indices_t])
+        self.ep.add_to(self.theta, delta + del_theta_dot_phi)
+        self.theta[indices_t] -= del_theta_dot_phi*rho*self.M
+        self.k_prev = delta + del_theta_dot_phi
+        self.g_prev = del_theta_dot_phi*rho*self.M
+        self.is_prev_index[self.indices_prev] = False
+        self.is_prev_index[indices_t] = True
+        self.indices_prev = indices_t
+        self.H = rho*gm*(self.H + self.prevI)
+        self.M = alpha*(I + (1-lm)*self.H)
+        self.prevgm = gm
+        self.prevlm = lm
+        self.prevI = I
+
+
+class LazyBinaryTOETD:
+    """
+    BinaryTOETD with a lazily scaled trace (see LazyTraces), so each step takes time proportional to the number of
+    active features instead of the number of features. The weights and trace are computed on access.
+    Instead of copying theta every step, (theta - prevtheta).phi is computed from the previous update: it added
+    k_prev * ep to theta and subtracted g_prev at the previous active features, and ep.phi is needed anyway.
+    """
+
+    def __init__(self, num_features, I, alpha, dtype=np.float64):
+        # One trace (ep), followed by theta:
+        self.traces = LazyTraces(num_features, 1, [0], dtype=dtype)
+        self.k_prev = 0.
+        self.g_prev = 0.
+        self.is_prev_index = np.zeros(num_features, dtype=bool)
+        self.indices_prev = np.zeros(0, dtype=np.intp)
+        self.H = 0.
+        self.M = alpha*I
+        self.prevI = I
+        self.prevgm = 0
+        self.prevlm = 0
+
+    @property
+    def theta(self):
+        return self.traces.dense_weights(0)
+
+    @property
+    def ep(self):
+        return self.traces.dense_trace(0)
+
+    def learn(self, indices_t, delta, rho, gm, lm, I, alpha):
+        ep_dot_phi = self.traces.trace(0, indices_t).sum()
+        self.traces.decay(0, rho*self.prevgm*self.prevlm)
+        self.traces.add_to_trace(0, indices_t, rho*self.M*(1-rho*self.prevgm*self.prevlm*ep_dot_phi))
+        del_theta_dot_phi = self.k_prev*ep_dot_phi - self.g_prev*np.count_nonzero(self.is_prev_index[indices_t])
+        self.traces.step(0, delta + del_theta_dot_phi)
+        self.traces.add_to_weights(0, indices_t, -del_theta_dot_phi*rho*self.M)
+        self.k_prev = delta + del_theta_dot_phi
+        self.g_prev = del_theta_dot_phi*rho*self.M
+        self.is_prev_index[self.indices_prev] = False
+        self.is_prev_index[indices_t] = True
+        self.indices_prev = indices_t
+        self.H = rho*gm*(self.H + self.prevI)
+        self.M = alpha*(I + (1-lm)*self.H)
+        self.prevgm = gm
+        self.prevlm = lm
+        self.prevI = I
+
+    def estimate(self, indices_t):
+        return self.traces.weights(0, indices_t).sum()
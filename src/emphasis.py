@@ -0,0 +1,72 @@
+import numpy as np
+
+
+def linear_scan(a, b, x_0=0.):
+    """
+    Solves the linear recurrence x_t = a_t * x_{t-1} + b_t along the last axis with a doubling (Hillis-Steele) scan:
+    each of the ceil(log2(T)) passes composes every step with the one 2**k steps before it, so the whole run is
+    computed with vectorized array operations instead of a Python loop over time steps. The result matches the
+    sequential recurrence up to rounding.
+    The composed coefficients are products of up to T of the a_t, which can overflow even when x_t doesn't (e.g. for
+    long stretches with a_t > 1 where x_t stays 0), so rows where the scan hits an inf or NaN are solved step by step.
+    :param a: The coefficients, shape (..., T).
+    :param b: The offsets, broadcastable to the shape of a.
+    :param x_0: The value before the first step (x_{-1}), a scalar or an array with the shape of a without the last axis.
+    :return: The array of x_t.
+    """
+    a, b = np.broadcast_arrays(np.asarray(a, dtype=float), np.asarray(b, dtype=float))
+    x_0 = np.broadcast_to(np.asarray(x_0, dtype=float), a.shape[:-1])
+    products, x = a.copy(), b.copy()
+    shift = 1
+    with np.errstate(over='ignore', invalid='ignore'):
+        x[..., 0] += a[..., 0] * x_0
+        while shift < x.shape[-1]:
+            # Both updates use the values from before this pass, since the right hand sides are evaluated first:
+            x[..., shift:] += products[..., shift:] * x[..., :-shift]
+            products[..., shift:] = products[..., shift:] * products[..., :-shift]
+            shift *= 2
+
+    overflowed = ~(np.isfinite(products).all(axis=-1) & np.isfinite(x).all(axis=-1))
+    if overflowed.any():
+        x[overflowed] = sequential_scan(a[overflowed], b[overflowed], x_0[overflowed])
+    return x
+
+
+def sequential_scan(a, b, x_0=0.):
+    """
+    Solves the same recurrence as linear_scan one time step at a time (vectorized over the other axes), so it only
+    overflows where x_t itself does.
+    """
+    x = np.empty(np.broadcast(a, b).shape)
+    x_tm1 = x_0
+    for t in range(x.shape[-1]):
+        x[..., t] = x_tm1 = a[..., t] * x_tm1 + b[..., t]
+    return x
+
+
+def discounts(terminal, gamma):
+    """
+    The discounts gamma_t and gamma_tp1 of a run of transitions (gamma_t is 0 at the start of the run and after
+    terminal transitions, like the replay loops use).
+    """
+    gamma_tp1 = np.where(terminal, 0., gamma)
+    gamma_t = np.zeros_like(gamma_tp1)
+    gamma_t[..., 1:] = gamma_tp1[..., :-1]
+    return gamma_t, gamma_tp1
+
+
+def followon_trace(rho_t, gamma_t, i_t):
+    """
+    The followon trace F_t = rho_tm1 * gamma_t * F_tm1 + i_t of a run (with rho_{-1} = 1 and F_{-1} = 0), which
+    doesn't depend on the learned weights when the target policy is fixed.
+    """
+    rho_tm1 = np.ones(np.shape(rho_t))
+    rho_tm1[..., 1:] = rho_t[..., :-1]
+    return linear_scan(rho_tm1 * gamma_t, i_t)
+
+
+def emphasis(F_t, i_t, lambda_):
+    """
+    The emphasis M_t = lambda * i_t + (1 - lambda) * F_t.
+    """
+    return lambda_ * i_t + (1. - lambda_) * F_t
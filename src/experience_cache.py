@@ -0,0 +1,149 @@
+import os
+import hashlib
+import numpy as np
+from pathlib import Path
+from joblib import Parallel, delayed
+from src import emphasis
+
+
+def file_digest(file_path, chunk_size=2**24):
+    """
+    Computes a digest of a file's contents, so caches derived from it are invalidated when it changes.
+    :param file_path: Path to the file to hash.
+    :param chunk_size: Number of bytes to read at a time.
+    :return: Hex digest string.
+    """
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tile_coder_digest(tc):
+    """
+    Computes a digest of the settings that determine a tile coder's output.
+    :param tc: The tile coder.
+    :return: Hex digest string.
+    """
+    digest = hashlib.sha1()
+    digest.update(type(tc).__name__.encode())
+    for setting in (tc.space, tc.num_tiles_per_dim, tc.num_tilings, tc.bias_unit, tc.total_num_tiles):
+        digest.update(np.asarray(setting, dtype=float).tobytes())
+    return digest.hexdigest()
+
+
+def tile_index_cache_path(experience_file, tc, experience_digest=None):
+    """
+    Returns the path of the tile index cache for the given experience file and tile coder.
+    The cache lives next to the experience file and its name contains a digest of both.
+    """
+    experience_file = Path(experience_file)
+    experience_digest = file_digest(experience_file) if experience_digest is None else experience_digest
+    digest = hashlib.sha1((experience_digest + tile_coder_digest(tc)).encode()).hexdigest()
+    return experience_file.with_name('{}.tiles.{}.npy'.format(experience_file.stem, digest[:16]))
+
+
+def encode_run(experience_memmap, cache_memmap, run_num, tc):
+    transitions = experience_memmap[run_num]
+    tc.encode_batch(transitions['s_t'], out=cache_memmap[run_num]['indices_t'])
+    tc.encode_batch(transitions['s_tp1'], out=cache_memmap[run_num]['indices_tp1'])
+
+
+def open_tile_index_cache(experience_file, tc, num_cpus=-1, experience_digest=None):
+    """
+    Opens the cache of tile indices for every s_t and s_tp1 in an experience file, building it first if necessary.
+    :param experience_file: Path to the experience.npy file written by generate_experience.py.
+    :param tc: The tile coder used to encode the observations.
+    :param num_cpus: The number of cpus to use when building the cache (-1 for all).
+    :param experience_digest: Digest of the experience file, if already computed (saves rereading it for each tile coder).
+    :return: Read-only memmapped structured array with fields 'indices_t' and 'indices_tp1' and shape (num_runs, num_timesteps).
+    """
+    cache_path = tile_index_cache_path(experience_file, tc, experience_digest)
+    if not os.path.isfile(cache_path):
+        experience_memmap = np.lib.format.open_memmap(str(experience_file), mode='r')
+        cache_dtype = np.dtype([
+            ('indices_t', tc.index_dtype, (tc.num_active_features,)),
+            ('indices_tp1', tc.index_dtype, (tc.num_active_features,))
+        ])
+
+        # Encode each run in parallel into a temporary file, then move it into place so readers never see a partial cache:
+        temp_path = cache_path.with_suffix('.{}.tmp'.format(os.getpid()))
+        cache_memmap = np.lib.format.open_memmap(str(temp_path), shape=experience_memmap.shape, dtype=cache_dtype, mode='w+')
+        Parallel(n_jobs=num_cpus, verbose=0)(
+            delayed(encode_run)(experience_memmap, cache_memmap, run_num, tc)
+            for run_num in range(experience_memmap.shape[0])
+        )
+        cache_memmap.flush()
+        del cache_memmap
+        os.replace(temp_path, cache_path)
+    return np.lib.format.open_memmap(str(cache_path), mode='r')
+
+
+def emphasis_cache_path(experience_file, rho, key, gamma, interest, lambda_, experience_digest=None):
+    """
+    Returns the path of the emphasis cache for the given experience file and settings.
+    The cache lives next to the experience file and its name contains a digest of both. Functions can't be hashed, so
+    rho (and a callable interest) are identified by the key and by their values on the first run of the experience,
+    which tells different target policies apart even if they're given the same key.
+    """
+    if not key:
+        raise ValueError('The emphasis cache needs a key identifying rho (and a callable interest).')
+    experience_file = Path(experience_file)
+    experience_digest = file_digest(experience_file) if experience_digest is None else experience_digest
+    digest = hashlib.sha1('{}{!r}{!r}{}'.format(experience_digest, float(gamma), float(lambda_), key).encode())
+    transitions = np.lib.format.open_memmap(str(experience_file), mode='r')[0]
+    digest.update(np.asarray(rho(transitions['s_t'], transitions['a_t']), dtype=float).tobytes())
+    if callable(interest):
+        gamma_t, _ = emphasis.discounts(transitions['terminal'], gamma)
+        digest.update(np.asarray(interest(transitions['s_t'], gamma_t), dtype=float).tobytes())
+    else:
+        digest.update(np.asarray(interest, dtype=float).tobytes())
+    digest = digest.hexdigest()
+    return experience_file.with_name('{}.emphasis.{}.npy'.format(experience_file.stem, digest[:16]))
+
+
+def emphasis_run(experience_memmap, cache_memmap, run_num, rho, gamma, interest, lambda_):
+    transitions = experience_memmap[run_num]
+    columns = cache_memmap[run_num]
+    gamma_t, _ = emphasis.discounts(transitions['terminal'], gamma)
+    i_t = interest(transitions['s_t'], gamma_t) if callable(interest) else interest
+    columns['rho_t'] = rho(transitions['s_t'], transitions['a_t'])
+    columns['gamma_t'] = gamma_t
+    columns['i_t'] = i_t
+    columns['F_t'] = emphasis.followon_trace(columns['rho_t'], gamma_t, columns['i_t'])
+    columns['M_t'] = emphasis.emphasis(columns['F_t'], columns['i_t'], lambda_)
+
+
+def open_emphasis_cache(experience_file, rho, key, gamma, interest=1., lambda_=0., num_cpus=-1, experience_digest=None):
+    """
+    Opens the cache of the importance sampling ratios, discounts, interests, followon traces and emphases of every
+    transition in an experience file for a fixed target policy, building it first if necessary. None of these depend on
+    the learned weights, so critics evaluating the target policy can read them instead of recomputing them every step.
+    :param experience_file: Path to the experience.npy file written by generate_experience.py.
+    :param rho: Function from arrays of states and actions of a run to their importance sampling ratios.
+    :param key: A non-empty string identifying rho and a callable interest, included in the cache's name (see emphasis_cache_path).
+    :param gamma: The discount rate.
+    :param interest: The interest, or a function from arrays of states and discounts of a run to their interests.
+    :param lambda_: The lambda used to compute the emphasis from the followon trace.
+    :param num_cpus: The number of cpus to use when building the cache (-1 for all).
+    :param experience_digest: Digest of the experience file, if already computed.
+    :return: Read-only memmapped structured array with fields 'rho_t', 'gamma_t', 'i_t', 'F_t' and 'M_t' and shape
+    (num_runs, num_timesteps).
+    """
+    cache_path = emphasis_cache_path(experience_file, rho, key, gamma, interest, lambda_, experience_digest)
+    if not os.path.isfile(cache_path):
+        experience_memmap = np.lib.format.open_memmap(str(experience_file), mode='r')
+        cache_dtype = np.dtype([(column, float) for column in ('rho_t', 'gamma_t', 'i_t', 'F_t', 'M_t')])
+
+        # Compute each run in parallel into a temporary file, then move it into place so readers never see a partial cache:
+        temp_path = cache_path.with_suffix('.{}.tmp'.format(os.getpid()))
+        cache_memmap = np.lib.format.open_memmap(str(temp_path), shape=experience_memmap.shape, dtype=cache_dtype, mode='w+')
+        Parallel(n_jobs=num_cpus, verbose=0)(
+            delayed(emphasis_run)(experience_memmap, cache_memmap, run_num, rho, gamma, interest, lambda_)
+            for run_num in range(experience_memmap.shape[0])
+        )
+        cache_memmap.flush()
+        del cache_memmap
+        os.replace(temp_path, cache_path)
+    return np.lib.format.open_memmap(str(cache_path), mode='r')
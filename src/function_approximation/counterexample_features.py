@@ -1,8 +1,9 @@
 import numpy as np
 from src.function_approximation.tiles3 import tiles
+from src.function_approximation.single_feature_states import SingleFeatureStates
 
 
-class CounterexampleFeatures:
+class CounterexampleFeatures(SingleFeatureStates):
 
     def __init__(self, bias_unit=False):
 
@@ -25,3 +26,7 @@ class CounterexampleFeatures:
             features[self.num_features - 1] = 1.
 
         return features
+
+    def active_features(self, observations):
+        # The single feature is the observation plus one:
+        return np.zeros(len(observations), dtype=int), observations + 1.
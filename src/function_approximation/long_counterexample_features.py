@@ -1,8 +1,9 @@
 import numpy as np
 from src.function_approximation.tiles3 import tiles
+from src.function_approximation.single_feature_states import SingleFeatureStates
 
 
-class LongCounterexampleFeatures:
+class LongCounterexampleFeatures(SingleFeatureStates):
 
     def __init__(self, middle_steps=3, bias_unit=False):
 
@@ -33,3 +34,8 @@ class LongCounterexampleFeatures:
             features[self.num_features - 1] = 1.
 
         return features
+
+    def active_features(self, observations):
+        # Like features, the terminal state shares the last non-terminal state's feature:
+        columns = np.where(observations < self.num_states - 1, observations, np.where(observations == self.num_states - 1, self.num_states - 2, -1))
+        return columns, np.ones(len(observations))
@@ -0,0 +1,35 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+class SingleFeatureStates:
+    """
+    A mixin for feature classes where each observation has at most one active feature besides the bias unit.
+    Subclasses implement active_features, which gives the column and value of that feature for a batch of observations,
+    and get a sparse_features method that builds the CSR matrix from them without forming dense feature vectors.
+    """
+
+    def active_features(self, observations):
+        """
+        :param observations: Array of N observations.
+        :return: Arrays of the column (-1 if there is none) and value of each observation's active feature.
+        """
+        raise NotImplementedError
+
+    def sparse_features(self, observations):
+        """
+        Encodes a batch of observations as a sparse feature matrix, so estimates over many states are one mat-vec.
+        :param observations: Array of N observations.
+        :return: scipy.sparse.csr_matrix with shape (N, num_features) whose row n is features(observations[n]).
+        """
+        observations = np.asarray(observations).reshape(-1)
+        columns, values = self.active_features(observations)
+        columns, values = np.asarray(columns, dtype=int)[:, np.newaxis], np.asarray(values, dtype=float)[:, np.newaxis]
+        if self.bias_unit:
+            columns = np.hstack((columns, np.full_like(columns, self.num_features - 1)))
+            values = np.hstack((values, np.ones_like(values)))
+
+        # Keep each row's entries in order, dropping missing features and zeros like csr_matrix does for dense rows:
+        nonzero = (columns >= 0) & (values != 0)
+        row_starts = np.concatenate(([0], np.cumsum(nonzero.sum(axis=1))))
+        return csr_matrix((values[nonzero], columns[nonzero], row_starts), shape=(len(observations), self.num_features))
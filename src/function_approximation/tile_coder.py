@@ -1,4 +1,5 @@
 import numpy as np
+from scipy.sparse import csr_matrix
 
 
 class TileCoder:
@@ -18,6 +19,11 @@ class TileCoder:
         # Compute the indices in the feature vector where each tiling starts:
         self.tilings_to_features = np.prod(self.num_tiles_per_dim) * np.arange(self.num_tilings)
 
+    @property
+    def index_dtype(self):
+        # The narrowest integer type that can hold every feature index (useful for storing large batches of indices):
+        return next(dtype for dtype in (np.uint16, np.int32, np.int64) if self.total_num_tiles - 1 <= np.iinfo(dtype).max)
+
     def encode(self, obs):
         # Compute the coordinates in each tiling of the tile containing the observation:
         tiling_coords = ((np.asarray(obs) - self.space[:, 0] + self.tiling_offsets) // self.tile_size).astype(int)
@@ -26,3 +32,203 @@ class TileCoder:
         # Convert the tiling indices to indices in the feature vector:
         feature_indices = self.tilings_to_features + tiling_indices
         return np.append(feature_indices, self.total_num_tiles - 1) if self.bias_unit else feature_indices
+
+    def _output_array(self, out, num_observations, dtype):
+        # Allocate or check the array to write a batch of indices into:
+        if out is None:
+            out = np.empty((num_observations, self.num_active_features), dtype=dtype)
+        if out.shape != (num_observations, self.num_active_features):
+            raise ValueError('Expected an output array with shape {} but got {}.'.format((num_observations, self.num_active_features), out.shape))
+        if self.total_num_tiles - 1 > np.iinfo(out.dtype).max:
+            raise ValueError('{} can\'t hold feature indices up to {}.'.format(out.dtype, self.total_num_tiles - 1))
+        return out
+
+    def encode_batch(self, observations, out=None, dtype=int):
+        """
+        Encodes a batch of observations in one vectorized pass.
+        :param observations: Array of observations with shape (N, num_dims).
+        :param out: Optional array with shape (N, num_active_features) to write the indices into.
+        :param dtype: Integer type of the returned indices if 'out' isn't given (e.g. self.index_dtype).
+        :return: Array of feature indices with shape (N, num_active_features); row n equals encode(observations[n]).
+        """
+        observations = np.asarray(observations).reshape(-1, len(self.space))
+        out = self._output_array(out, observations.shape[0], dtype)
+
+        # Compute the coordinates in each tiling of the tile containing each observation (shape: (N, num_tilings, num_dims)):
+        tiling_coords = ((observations[:, np.newaxis, :] - self.space[:, 0] + self.tiling_offsets) // self.tile_size).astype(int)
+        # Convert to indices in the feature vector and write them straight into the output array:
+        out[:, :self.num_tilings] = np.dot(tiling_coords, self.coords_to_indices) + self.tilings_to_features
+        if self.bias_unit:
+            out[:, self.num_tilings] = self.total_num_tiles - 1
+        return out
+
+    def sparse_features(self, observations):
+        """
+        Encodes a batch of observations as a sparse binary feature matrix, so estimates over many states are one mat-vec.
+        :param observations: Array of observations with shape (N, num_dims).
+        :return: scipy.sparse.csr_matrix with shape (N, total_num_tiles) whose row n is the feature vector of observations[n].
+        """
+        indices = self.encode_batch(observations)
+        row_starts = np.arange(0, indices.size + 1, self.num_active_features)
+        return csr_matrix((np.ones(indices.size), indices.ravel(), row_starts), shape=(indices.shape[0], self.total_num_tiles))
+
+
+class LookupTileCoder(TileCoder):
+    """
+    A tile coder for low resolution spaces that precomputes the indices for every cell of the grid at the finest offset
+    resolution (tile_size / num_tilings), so encoding is quantization plus a table lookup.
+    Computes indices like TileCoder instead if the table would need more than max_table_bytes, and for observations
+    outside the space or on a cell boundary (where rounding decides the cell).
+    """
+    def __init__(self, space, num_tiles_per_dim, num_tilings, bias_unit=False, max_table_bytes=2**27):
+        super().__init__(space, num_tiles_per_dim, num_tilings, bias_unit)
+        # Every tiling's offset is a multiple of tile_size / num_tilings in each dimension,
+        # so all observations in a cell of this size share indices:
+        self.cell_size = self.tile_size / self.num_tilings
+        self.num_cells_per_dim = (self.num_tiles_per_dim - 1) * self.num_tilings + 1
+        self.cells_to_rows = np.array([np.prod(self.num_cells_per_dim[0:dim]) for dim in range(len(self.space))])
+        self._dims = list(zip(self.space[:, 0].tolist(), self.cell_size.tolist(), self.num_cells_per_dim.tolist(), self.cells_to_rows.tolist()))
+
+        self.table = None
+        if np.prod(self.num_cells_per_dim) * self.num_active_features * np.dtype(int).itemsize <= max_table_bytes:
+            # Encode the center of every cell:
+            cells = np.array(np.unravel_index(np.arange(np.prod(self.num_cells_per_dim)), self.num_cells_per_dim, order='F')).T
+            self.table = super().encode_batch(self.space[:, 0] + (cells + .5) * self.cell_size)
+            self.table.flags.writeable = False
+
+    def _table_rows(self, observations):
+        # Quantize observations to the cells of the table, flagging those outside the space or so close to a cell boundary that
+        # rounding could put them in either cell:
+        positions = (observations - self.space[:, 0]) / self.cell_size
+        cells = positions.astype(int)
+        offsets = positions - cells
+        fallback = np.any((offsets < 1e-9) | (offsets > 1 - 1e-9) | (cells >= self.num_cells_per_dim), axis=-1)
+        return np.dot(np.minimum(cells, self.num_cells_per_dim - 1), self.cells_to_rows), fallback
+
+    def encode(self, obs):
+        if self.table is None:
+            return super().encode(obs)
+        # Quantize a single observation with python floats, which is faster than numpy for so few dimensions:
+        row = 0
+        for x, (low, cell_size, num_cells, stride) in zip(obs, self._dims):
+            position = (x - low) / cell_size
+            cell = int(position)
+            offset = position - cell
+            if offset < 1e-9 or offset > 1 - 1e-9 or cell >= num_cells:
+                return super().encode(obs)
+            row += cell * stride
+        return self.table[row]
+
+    def encode_batch(self, observations, out=None, dtype=int):
+        if self.table is None:
+            return super().encode_batch(observations, out, dtype)
+        observations = np.asarray(observations).reshape(-1, len(self.space))
+        out = self._output_array(out, observations.shape[0], dtype)
+        rows, fallback = self._table_rows(observations)
+        out[:] = self.table[np.maximum(rows, 0)]
+        # Compute the indices of flagged observations exactly like TileCoder:
+        if np.any(fallback):
+            out[fallback] = super().encode_batch(observations[fallback])
+        return out
+
+
+class MultiTileCoder:
+    """
+    Encodes observations with several tile coders over the same space (e.g. an actor's and a critic's) in one pass,
+    sharing the normalization and floor division between all their tilings and encoding identical tile coders once.
+    """
+    def __init__(self, *tile_coders):
+        self.tile_coders = tile_coders
+        self.space = tile_coders[0].space
+        if any(not np.array_equal(tc.space, self.space) for tc in tile_coders):
+            raise ValueError('All tile coders must have the same space.')
+        if any(isinstance(tc, HashingTileCoder) for tc in tile_coders):
+            raise ValueError('Hashing tile coders can\'t be combined.')
+
+        # Map each tile coder to the first one with the same settings:
+        settings = [(tuple(tc.num_tiles_per_dim), tc.num_tilings, tc.bias_unit) for tc in tile_coders]
+        self.unique_tile_coders = [settings.index(setting) for setting in settings]
+        unique = [tile_coders[tc_num] for tc_num in sorted(set(self.unique_tile_coders))]
+
+        # Stack the tilings of the distinct tile coders, with a row for each bias unit whose coordinates never contribute:
+        num_dims = len(self.space)
+        self.tiling_offsets = np.concatenate([np.pad(tc.tiling_offsets, ((0, tc.bias_unit), (0, 0))) for tc in unique])
+        self.tile_size = np.concatenate([np.pad(np.tile(tc.tile_size, (tc.num_tilings, 1)), ((0, tc.bias_unit), (0, 0)), constant_values=1) for tc in unique])
+        self.coords_to_indices = np.concatenate([np.pad(np.tile(tc.coords_to_indices, (tc.num_tilings, 1)), ((0, tc.bias_unit), (0, 0))) for tc in unique])
+        self.tilings_to_features = np.concatenate([np.append(tc.tilings_to_features, [tc.total_num_tiles - 1] * tc.bias_unit) for tc in unique])
+        # Where each tile coder's indices are in the stack:
+        starts = dict(zip(sorted(set(self.unique_tile_coders)), np.cumsum([0] + [tc.num_active_features for tc in unique])))
+        self.feature_slices = [slice(starts[tc_num], starts[tc_num] + tile_coders[tc_num].num_active_features) for tc_num in self.unique_tile_coders]
+        assert self.tiling_offsets.shape == self.tile_size.shape == self.coords_to_indices.shape == (len(self.tilings_to_features), num_dims)
+
+    def encode(self, obs):
+        """
+        :return: List with the feature indices of the observation for each tile coder (identical tile coders share an array).
+        """
+        tiling_coords = ((np.asarray(obs) - self.space[:, 0] + self.tiling_offsets) // self.tile_size).astype(int)
+        feature_indices = np.einsum('kd,kd->k', tiling_coords, self.coords_to_indices) + self.tilings_to_features
+        return [feature_indices[feature_slice] for feature_slice in self.feature_slices]
+
+    def encode_batch(self, observations, dtype=int):
+        """
+        Encodes a batch of observations with every tile coder in one vectorized pass.
+        :param observations: Array of observations with shape (N, num_dims).
+        :param dtype: Integer type of the returned indices.
+        :return: List with an array of feature indices with shape (N, num_active_features) for each tile coder.
+        """
+        observations = np.asarray(observations).reshape(-1, len(self.space))
+        # Compute the coordinates in every stacked tiling of the tile containing each observation (shape: (N, num_stacked, num_dims)):
+        tiling_coords = ((observations[:, np.newaxis, :] - self.space[:, 0] + self.tiling_offsets) // self.tile_size).astype(int)
+        feature_indices = np.einsum('nkd,kd->nk', tiling_coords, self.coords_to_indices) + self.tilings_to_features
+        indices = {}
+        for tc_num, feature_slice in zip(self.unique_tile_coders, self.feature_slices):
+            if tc_num not in indices:
+                indices[tc_num] = np.ascontiguousarray(feature_indices[:, feature_slice], dtype=dtype)
+        return [indices[tc_num] for tc_num in self.unique_tile_coders]
+
+
+class HashingTileCoder(TileCoder):
+    """
+    A tile coder that hashes tiles into a fixed number of features, so memory doesn't grow with the number of dimensions.
+    Distinct tiles can share a feature (see collision_rate), but each tiling hashes into its own slice of the features,
+    so the indices of an observation never repeat (the Binary learners and traces rely on that).
+    """
+    def __init__(self, space, num_tiles_per_dim, num_tilings, memory_size, bias_unit=False):
+        super().__init__(space, num_tiles_per_dim, num_tilings, bias_unit)
+        self.memory_size = int(memory_size)
+        if self.memory_size < self.num_tilings:
+            raise ValueError('memory_size ({}) must be at least num_tilings ({}).'.format(self.memory_size, self.num_tilings))
+        self.slice_size = self.memory_size // self.num_tilings
+        self.total_num_tiles = self.memory_size + self.bias_unit
+
+    def hash(self, tile_indices):
+        # Multiplicative (Fibonacci) hashing of indices in the full tile space into their tiling's slice of [0, memory_size):
+        tile_indices = np.asarray(tile_indices).astype(np.uint64)
+        tilings = tile_indices // np.uint64(np.prod(self.num_tiles_per_dim))
+        hashes = (tile_indices * np.uint64(0x9E3779B97F4A7C15) >> np.uint64(32)) % np.uint64(self.slice_size)
+        return tilings * np.uint64(self.slice_size) + hashes
+
+    def encode(self, obs):
+        # The bias unit (if any) is already at index memory_size, so only the tiles need hashing:
+        indices = super().encode(obs)
+        indices[:self.num_tilings] = self.hash(indices[:self.num_tilings])
+        return indices
+
+    def encode_batch(self, observations, out=None, dtype=int):
+        # Compute the unhashed indices at full width, then hash them into the output array:
+        indices = super().encode_batch(observations, dtype=np.int64)
+        out = self._output_array(out, indices.shape[0], dtype)
+        out[:, :self.num_tilings] = self.hash(indices[:, :self.num_tilings])
+        if self.bias_unit:
+            out[:, self.num_tilings] = self.memory_size
+        return out
+
+    def collision_rate(self, observations):
+        """
+        Computes the fraction of the distinct tiles touched by a batch of observations that share a feature with another of those tiles.
+        :param observations: Array of observations with shape (N, num_dims).
+        :return: Collision rate in [0, 1].
+        """
+        tile_indices = np.unique(super().encode_batch(observations, dtype=np.int64)[:, :self.num_tilings])
+        _, counts = np.unique(self.hash(tile_indices), return_counts=True)
+        return counts[counts > 1].sum() / tile_indices.size
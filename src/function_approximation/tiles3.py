@@ -0,0 +1,64 @@
+"""
+Hashing tile coding with the same interface as Rich Sutton's tiles3 module (http://incompleteideas.net/tiles/tiles3.html).
+For vectorized hashed tile coding of whole batches of observations, use HashingTileCoder in tile_coder.py instead.
+"""
+from math import floor
+
+
+class IHT:
+    """Index hash table: gives each new tile the next free index, then falls back to hashing once all indices are taken."""
+
+    def __init__(self, size):
+        self.size = size
+        self.overfull_count = 0
+        self.dictionary = {}
+
+    def count(self):
+        return len(self.dictionary)
+
+    def full(self):
+        return len(self.dictionary) >= self.size
+
+    def get_index(self, obj, read_only=False):
+        if obj in self.dictionary:
+            return self.dictionary[obj]
+        elif read_only:
+            return None
+        count = self.count()
+        if count >= self.size:
+            self.overfull_count += 1
+            return hash(obj) % self.size
+        self.dictionary[obj] = count
+        return count
+
+
+def hash_coords(coordinates, m, read_only=False):
+    if isinstance(m, IHT):
+        return m.get_index(tuple(coordinates), read_only)
+    if isinstance(m, int):
+        return hash(tuple(coordinates)) % m
+    if m is None:
+        return coordinates
+
+
+def tiles(iht_or_size, num_tilings, floats, ints=(), read_only=False):
+    """
+    Returns the index of the tile containing the given point in each tiling.
+    :param iht_or_size: An IHT, an int memory size to hash into, or None to return the raw tile coordinates.
+    :param num_tilings: The number of tilings.
+    :param floats: Continuous coordinates, already scaled so one unit is the width of a tile.
+    :param ints: Optional discrete coordinates (e.g. an action).
+    :param read_only: Whether to return None for tiles an IHT hasn't seen instead of adding them.
+    :return: List of num_tilings tile indices.
+    """
+    q_floats = [floor(f * num_tilings) for f in floats]
+    indices = []
+    for tiling in range(num_tilings):
+        coords = [tiling]
+        b = tiling
+        for q in q_floats:
+            coords.append((q + b) // num_tilings)
+            b += tiling * 2
+        coords.extend(ints)
+        indices.append(hash_coords(coords, iht_or_size, read_only))
+    return indices
@@ -1,8 +1,9 @@
 import numpy as np
 from src.function_approximation.tiles3 import tiles
+from src.function_approximation.single_feature_states import SingleFeatureStates
 
 
-class TinyCounterexampleFeatures:
+class TinyCounterexampleFeatures(SingleFeatureStates):
 
     def __init__(self, bias_unit=False):
 
@@ -32,3 +33,8 @@ class TinyCounterexampleFeatures:
             features[self.num_features - 1] = 1.
 
         return features
+
+    def active_features(self, observations):
+        # Like features, the terminal state shares the second state's feature:
+        columns = np.where(observations < 2, observations, np.where(observations == 2, 1, -1))
+        return columns, np.ones(len(observations))
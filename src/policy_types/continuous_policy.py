@@ -1,16 +1,17 @@
 import numpy as np
-import scipy.stats
 
 
 class ContinuousPolicy:
 
-    def __init__(self, u, learnable_sig=True):
-        ''' Represents a Gaussian mean and std. '''
+    def __init__(self, u, learnable_sig=True, rng=None):
+        ''' Represents a Gaussian mean and std. Actions are sampled from rng (a Generator or RandomState; defaults to
+        the global np.random). '''
         self.num_features = u.shape[0]
         self.u = u
         self.sig_act = self.softplus#np.exp
         self.sig_act_grad = self.softplus_grad#np.exp
         self.learnable_sig = learnable_sig
+        self.rng = np.random if rng is None else rng
 
     def pi(self, x_t, a_t=None):
         # print(self.u)
@@ -18,8 +19,8 @@ class ContinuousPolicy:
         mu = out[0]
         sig = self.sig_act(out[1])
         if a_t is not None:
-            return scipy.stats.norm.pdf(a_t, mu, sig)
-        return np.random.normal(mu, sig)
+            return self.pdf(a_t, mu, sig)
+        return self.rng.normal(mu, sig)
 
     def pi_params(self, x_t):
         out = self.u.dot(x_t)
@@ -45,6 +46,58 @@ class ContinuousPolicy:
         # pi_t in the IS ratio cancels with pi_t in the denominator of grad_log
         return np.vstack((grad_mu, grad_sig)) #/ scipy.stats.norm.pdf(a_t, mu, sig)
 
+    def pi_params_batch(self, X):
+        ''' The means and stds for a (B, num_features) block of feature vectors, as a (B, 2) array. '''
+        mu, sig, _ = self._forward_batch(X)
+        return np.stack((mu, sig), axis=1)
+
+    def pi_batch(self, X, A=None, rng=None):
+        ''' The densities of the actions A, or actions sampled from rng (defaults to self.rng), for each row of X. '''
+        mu, sig, _ = self._forward_batch(X)
+        if A is not None:
+            return self.pdf(A, mu, sig)
+        return (self.rng if rng is None else rng).normal(mu, sig)
+
+    def log_pi_batch(self, X, A):
+        mu, sig, _ = self._forward_batch(X)
+        return self.log_pdf(A, mu, sig)
+
+    def score_batch(self, X, A):
+        ''' The score functions (gradients of log pi(A|X) with respect to u) for each row of X and action in A, as a
+        (B, 2, num_features) array. grad_log_pi instead gives the gradients of mu and sig with respect to u, so the
+        scores are its rows scaled by d log pi / d mu = (a - mu) / sig^2 and d log pi / d sig = ((a - mu)^2 / sig^2 - 1) / sig. '''
+        mu, sig, sig_grad = self._forward_batch(X)
+        return self._score_batch(X, A, mu, sig, sig_grad)
+
+    def evaluate_batch(self, X, A=None, rng=None):
+        ''' Everything an actor update needs from one forward pass over X: the (B, 2) means and stds, the actions
+        (sampled from rng if A is None), their log-densities and their (B, 2, num_features) score functions. '''
+        mu, sig, sig_grad = self._forward_batch(X)
+        if A is None:
+            A = (self.rng if rng is None else rng).normal(mu, sig)
+        return np.stack((mu, sig), axis=1), A, self.log_pdf(A, mu, sig), self._score_batch(X, A, mu, sig, sig_grad)
+
+    def _forward_batch(self, X):
+        out = X.dot(self.u.T)
+        return out[:, 0], self.sig_act(out[:, 1]), self.sig_act_grad(out[:, 1]) if self.learnable_sig else np.zeros(len(out))
+
+    def _score_batch(self, X, A, mu, sig, sig_grad):
+        # d log pi / d mu = (a - mu) / sig^2 and d log pi / d sig = (a - mu)^2 / sig^3 - 1 / sig, times the gradients of mu and sig:
+        z = (A - mu) / sig
+        scores = np.empty((X.shape[0], 2, X.shape[1]))
+        np.multiply((z / sig)[:, np.newaxis], X, out=scores[:, 0])
+        np.multiply(((z * z - 1) / sig * sig_grad)[:, np.newaxis], X, out=scores[:, 1])
+        return scores
+
+    @staticmethod
+    def pdf(a, mu, sig):
+        # Closed-form normal density; scipy.stats.norm.pdf has a large per-call overhead:
+        return np.exp(-.5 * ((a - mu) / sig) ** 2) / (sig * np.sqrt(2 * np.pi))
+
+    @staticmethod
+    def log_pdf(a, mu, sig):
+        return -.5 * ((a - mu) / sig) ** 2 - np.log(sig) - .5 * np.log(2 * np.pi)
+
     # In case I can't use exp activation for sigma
     def softplus(self, z):
         return np.log(1.0+ np.exp(z))
@@ -15,10 +15,41 @@ class DiscretePolicy:
         probs = exp_prefs / np.sum(exp_prefs)
         return probs if a_t is None else probs[a_t]
 
-    def grad_log_pi(self, x_t, a_t):
-        psi_s_a = np.zeros((self.num_actions, self.num_features))
-        psi_s_a[a_t] = x_t
-        probs = self.pi(x_t).reshape(self.num_actions, 1) # reshape to enable broadcasting.
-        psi_s_b = np.empty((self.num_actions, self.num_features))
-        psi_s_b[:] = x_t
-        return psi_s_a - probs * psi_s_b
+    def grad_log_pi(self, x_t, a_t, out=None):
+        # Grad log pi is the outer product of (onehot(a_t) - pi) and x_t, written as -pi outer x_t plus x_t in row a_t:
+        probs = self.pi(x_t)
+        out = np.multiply(-probs[:, np.newaxis], x_t, out=out)
+        out[a_t] += x_t
+        return out
+
+    def pi_batch(self, X):
+        """
+        The action probabilities for each row of a (B, num_features) block of feature vectors (dense or scipy.sparse).
+        :return: A (B, num_actions) array.
+        """
+        prefs = X.dot(self.u.T)
+        prefs -= prefs.max(axis=1, keepdims=True)
+        probs = np.exp(prefs, out=prefs)
+        probs /= probs.sum(axis=1, keepdims=True)
+        return probs
+
+    def grad_log_pi_batch(self, X, A, out=None):
+        """
+        The score functions of a (B, num_features) block of dense feature vectors and their B actions.
+        :return: A (B, num_actions, num_features) array, written into out if given.
+        """
+        probs = self.pi_batch(X)
+        out = np.multiply(-probs[:, :, np.newaxis], X[:, np.newaxis, :], out=out)
+        out[np.arange(len(A)), A] += X
+        return out
+
+    def accumulate_grad_log_pi(self, X, A, weights, out):
+        """
+        Adds the weighted sum of the score functions of a (B, num_features) block of feature vectors (dense or
+        scipy.sparse) and their B actions into out, without forming the (B, num_actions, num_features) score functions.
+        """
+        coefficients = -self.pi_batch(X)
+        coefficients[np.arange(len(A)), A] += 1
+        coefficients *= np.reshape(weights, (-1, 1))
+        out += X.T.dot(coefficients).T
+        return out
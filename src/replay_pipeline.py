@@ -0,0 +1,237 @@
+import numpy as np
+from src.algorithms.low_var_etd import BinaryLowVarETD, LazyBinaryLowVarETD
+from src.algorithms.tdc import BinaryTDC, LazyBinaryTDC, BinaryGQ, LazyBinaryGQ
+from src.algorithms.toetd import BinaryTOETD, LazyBinaryTOETD
+from src.function_approximation.tile_coder import MultiTileCoder
+
+
+def pad_weights(weights, shape, dtype):
+    """
+    Zero pads learned weights to the shape of the saved policies (configurations can use different numbers of features).
+    """
+    padded_weights = np.zeros(shape, dtype=dtype)
+    padded_weights[0:weights.shape[0], 0:weights.shape[1]] = weights
+    return padded_weights
+
+
+class TileIndexStage:
+    """
+    The encode stage of a ReplayPipeline: gives the tile indices of the next states of chunks of transitions for one or
+    more tile coders, read from their tile index caches if every tile coder has one, or else encoded in one vectorized
+    pass per chunk (through a MultiTileCoder if there are several tile coders).
+    """
+
+    def __init__(self, tile_coders, tile_indices=None):
+        """
+        :param tile_coders: List of tile coders.
+        :param tile_indices: List with the run's rows of the tile index cache of each tile coder (see
+        experience_cache.open_tile_index_cache), or None (as can be any of the rows) to encode the states instead.
+        """
+        self.tile_coders = tile_coders
+        self.tile_indices = tile_indices if tile_indices is not None and all(cache is not None for cache in tile_indices) else None
+        self.tc = tile_coders[0] if len(tile_coders) == 1 else MultiTileCoder(*tile_coders)
+
+    def _encode_batch(self, observations):
+        # Encode observations with any leading shape, giving indices with shape (..., num_active_features):
+        indices = self.tc.encode_batch(observations.reshape(-1, observations.shape[-1]))
+        return [tc_indices.reshape(*observations.shape[:-1], -1) for tc_indices in ([indices] if len(self.tile_coders) == 1 else indices)]
+
+    def first(self, transitions):
+        # The indices of the first state of the run (or of each run) for each tile coder:
+        if self.tile_indices is None:
+            return tuple(indices[..., 0, :] for indices in self._encode_batch(transitions['s_t'][..., :1, :]))
+        return tuple(cache['indices_t'][..., 0, :] for cache in self.tile_indices)
+
+    def next(self, chunk, start, stop):
+        # The indices of the next states of transitions start to stop for each tile coder (shape (..., stop - start, num_active_features)):
+        if self.tile_indices is None:
+            return self._encode_batch(chunk['s_tp1'])
+        return [cache['indices_tp1'][..., start:stop, :] for cache in self.tile_indices]
+
+
+class BatchedFunction:
+    """
+    Calls a function of single states (e.g. a behaviour policy or an interest function) on a chunk of states at once.
+    The function is first tried on the whole arrays, which works for functions written with numpy operations or that
+    don't depend on the state. On the first chunk its result is compared with calling it on each state, and a function
+    that raises or gives different values is called on each state from then on.
+    """
+
+    def __init__(self, function):
+        self.function = function
+        self.vectorized = None  # Not known until the first chunk.
+
+    def _call_batched(self, arrays, shape):
+        try:
+            return np.broadcast_to(self.function(*arrays), shape)
+        except Exception:
+            return None
+
+    def __call__(self, *arrays):
+        """
+        :param arrays: Arrays with the function's arguments for each state along their first axis.
+        :return: Array with the function's value for each state along its first axis.
+        """
+        if self.vectorized:
+            values = self._call_batched(arrays, (len(arrays[0]),) + self.shape)
+            if values is not None:
+                return values
+        values = np.array([self.function(*arguments) for arguments in zip(*arrays)])
+        if self.vectorized is None:
+            self.shape = values.shape[1:]
+            batched_values = self._call_batched(arrays, values.shape)
+            self.vectorized = batched_values is not None and np.array_equal(batched_values, values)
+        return values
+
+class ReplayPipeline:
+    """
+    Replays a run of stored experience (or several runs in lockstep) through a learner in stages:
+    decode -> encode -> behaviour policy and interest -> learn (ratios, critic, emphasis and actor) -> checkpoint.
+    The stages that don't depend on the learned weights process chunks of transitions at once with array operations:
+    decoding the transitions and their discounts, encoding the next states (see TileIndexStage), and looking up the
+    behaviour policy and the interest (see BatchedFunction). Only the learn stage (e.g. an ACEStep), whose updates each
+    depend on the weights the last one left, and the checkpoint stage run once per timestep.
+    Consecutive transitions are assumed to be chained, so each state's indices are the previous next state's indices.
+    """
+
+    def __init__(self, encode, learn, checkpoint, checkpoint_interval, gamma, interest, behaviour_policy, next_interest=False, chunk_size=1000):
+        """
+        :param encode: A TileIndexStage.
+        :param learn: Called for each timestep as learn(indices_t, a_t, r_tp1, indices_tp1, gamma_tp1, i_t, i_tp1, mu_t),
+        where indices_t and indices_tp1 are tuples with the indices for each of encode's tile coders and mu_t is the
+        behaviour policy's action probabilities. When several runs are replayed in lockstep (e.g. by a BatchACEStep),
+        every argument has a leading axis with the values of each run.
+        :param checkpoint: Called as checkpoint(t) before the transitions at multiples of checkpoint_interval and with
+        the number of transitions after the last one.
+        :param checkpoint_interval: The number of timesteps between checkpoints.
+        :param gamma: The discount rate of non-terminal transitions.
+        :param interest: The interest function, called as interest(s, gamma).
+        :param behaviour_policy: The behaviour policy, called as behaviour_policy(s).
+        :param next_interest: Whether or not learn needs the interest of the next state (i_tp1 is None otherwise).
+        :param chunk_size: The number of timesteps each chunked stage processes at once.
+        """
+        self.encode = encode
+        self.learn = learn
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.gamma = gamma
+        self.interest = BatchedFunction(interest)
+        self.behaviour_policy = BatchedFunction(behaviour_policy)
+        self.next_interest = next_interest
+        self.chunk_size = chunk_size
+
+    def _per_state(self, function, chunk, *arrays):
+        # Calls a BatchedFunction on the chunk's arrays of states (and discounts), flattened to one state per row:
+        values = function(*(array.reshape(chunk.size, *array.shape[chunk.ndim:]) for array in arrays))
+        return values.reshape(*chunk.shape, *values.shape[1:])
+
+    def run(self, transitions):
+        """
+        :param transitions: The run's transitions (a row of the experience memmap written by generate_experience.py),
+        or the transitions of several runs to replay in lockstep (rows of the memmap, with shape (num_runs, num_timesteps)).
+        """
+        num_timesteps = transitions.shape[-1]
+        time_axis = transitions.ndim - 1
+        indices_t = self.encode.first(transitions)
+        gamma_t = np.zeros(transitions.shape[:-1])
+        for start in range(0, num_timesteps, self.chunk_size):
+            stop = min(start + self.chunk_size, num_timesteps)
+
+            # Decode the chunk of transitions:
+            chunk = transitions[..., start:stop]
+            s_t, a_t, r_tp1, s_tp1 = chunk['s_t'], chunk['a_t'], chunk['r_tp1'], chunk['s_tp1']
+            gamma_tp1 = np.where(chunk['terminal'], 0., self.gamma)  # Transition-dependent discounting.
+            gammas_t = np.concatenate((gamma_t[..., np.newaxis], gamma_tp1[..., :-1]), axis=-1)
+
+            # Encode the next states:
+            all_indices_tp1 = self.encode.next(chunk, start, stop)
+
+            # Look up the behaviour policy and the interest:
+            mu_t = self._per_state(self.behaviour_policy, chunk, s_t)
+            i_t = self._per_state(self.interest, chunk, s_t, gammas_t)
+            i_tp1 = self._per_state(self.interest, chunk, s_tp1, gamma_tp1) if self.next_interest else None
+
+            # Learn from each timestep in turn (moving the time axis first, so each timestep's values are one index away):
+            a_t, r_tp1, gamma_tp1, i_t, mu_t = (np.moveaxis(values, time_axis, 0) for values in (a_t, r_tp1, gamma_tp1, i_t, mu_t))
+            i_tp1 = [None] * (stop - start) if i_tp1 is None else np.moveaxis(i_tp1, time_axis, 0)
+            all_indices_tp1 = [np.moveaxis(indices, time_axis, 0) for indices in all_indices_tp1]
+            for k in range(stop - start):
+                if (start + k) % self.checkpoint_interval == 0:
+                    self.checkpoint(start + k)
+                indices_tp1 = tuple(indices[k] for indices in all_indices_tp1)
+                self.learn(indices_t, a_t[k], r_tp1[k], indices_tp1, gamma_tp1[k], i_t[k], i_tp1[k], mu_t[k])
+                indices_t = indices_tp1
+            gamma_t = gamma_tp1[-1]
+
+        # Checkpoint after the final timestep:
+        self.checkpoint(num_timesteps)
+
+
+class CriticFanOut:
+    """
+    A learn stage for ReplayPipeline that evaluates a fixed target policy (an actor that doesn't learn) with several
+    critics from a single replay, so they share the decoded transitions and tile indices. The target policy's
+    probabilities, the importance sampling ratio and the followon trace are computed once per transition for all of
+    them, and each critic keeps its own state and its own list of checkpointed weights.
+    Critics can be BinaryTDC, BinaryLowVarETD, BinaryTOETD or BinaryGQ (or their truncated or lazy versions).
+    TOETD critics don't store their trace decay rate and step size, so they're given as (critic, lambda_c, alpha)
+    tuples, and they need the interest of the next state (see ReplayPipeline's next_interest).
+    Given the run's row of an emphasis cache (see experience_cache.open_emphasis_cache), the ratios and followon traces
+    are read from it instead of being computed each step.
+    """
+
+    def __init__(self, actor, critics, actor_tile_coder=0, critic_tile_coder=-1, emphasis=None):
+        """
+        :param actor: The actor whose policy is evaluated (e.g. a BinaryACE).
+        :param critics: List of critics.
+        :param actor_tile_coder: Which of the pipeline's tile coders the actor's indices come from.
+        :param critic_tile_coder: Which of the pipeline's tile coders the critics' indices come from.
+        :param emphasis: The run's row of an emphasis cache computed for the actor's policy, or None.
+        """
+        self.actor = actor
+        self.critics = [critic if isinstance(critic, tuple) else (critic,) for critic in critics]
+        self.actor_tile_coder = actor_tile_coder
+        self.critic_tile_coder = critic_tile_coder
+        self.needs_pi_tp1 = any(isinstance(critic[0], (BinaryGQ, LazyBinaryGQ)) for critic in self.critics)
+        self.rho = None if emphasis is None else emphasis['rho_t']
+        self.F = None if emphasis is None else emphasis['F_t']
+        self.t = 0
+        self.gamma_t = 0.
+        self.F_t = 0.
+        self.rho_tm1 = 1.
+        self.checkpoints = [[] for _ in self.critics]
+
+    def __call__(self, indices_t, a_t, r_tp1, indices_tp1, gamma_tp1, i_t, i_tp1, mu_t):
+        # Compute (or read) the importance sampling ratio and the followon trace once for every critic:
+        if self.rho is None:
+            rho_t = self.actor.pi(indices_t[self.actor_tile_coder])[a_t] / mu_t[a_t]
+            self.F_t = self.rho_tm1 * self.gamma_t * self.F_t + i_t
+        else:
+            rho_t, self.F_t = self.rho[self.t], self.F[self.t]
+        pi_tp1 = self.actor.pi(indices_tp1[self.actor_tile_coder]) if self.needs_pi_tp1 else None
+        self.t += 1
+
+        x_t, x_tp1 = indices_t[self.critic_tile_coder], indices_tp1[self.critic_tile_coder]
+        for critic, *parameters in self.critics:
+            if isinstance(critic, (BinaryGQ, LazyBinaryGQ)):
+                critic.learn(x_t, a_t, rho_t, self.gamma_t, r_tp1, x_tp1, pi_tp1, gamma_tp1)
+                continue
+            delta_t = r_tp1 + gamma_tp1 * critic.estimate(x_tp1) - critic.estimate(x_t)
+            if isinstance(critic, (BinaryTDC, LazyBinaryTDC)):
+                critic.learn(delta_t, x_t, self.gamma_t, x_tp1, gamma_tp1, rho_t)
+            elif isinstance(critic, (BinaryLowVarETD, LazyBinaryLowVarETD)):
+                critic.learn(delta_t, x_t, self.gamma_t, i_t, x_tp1, gamma_tp1, rho_t, self.F_t)
+            elif isinstance(critic, (BinaryTOETD, LazyBinaryTOETD)):
+                lambda_c, alpha = parameters
+                critic.learn(x_t, delta_t, rho_t, gamma_tp1, lambda_c, i_tp1, alpha)
+            else:
+                raise TypeError('Unsupported critic: {}'.format(type(critic).__name__))
+
+        self.gamma_t = gamma_tp1
+        self.rho_tm1 = rho_t
+
+    def checkpoint(self, t):
+        # Save a copy of each critic's value weights (a checkpoint stage for ReplayPipeline):
+        for checkpoints, (critic, *_) in zip(self.checkpoints, self.critics):
+            weights = critic.theta if isinstance(critic, (BinaryTOETD, LazyBinaryTOETD)) else critic.w if isinstance(critic, (BinaryTDC, LazyBinaryTDC, BinaryGQ, LazyBinaryGQ)) else critic.v
+            checkpoints.append((t, np.copy(weights)))
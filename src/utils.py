@@ -39,11 +39,9 @@ def plot_learned_value_function(critic, tile_coder, num_samples_per_dimension=10
     # Sample the learned value function:
     positions = np.linspace(*position_limits, num_samples_per_dimension)
     velocities = np.linspace(*velocity_limits, num_samples_per_dimension)
-    value_estimates = np.zeros((num_samples_per_dimension, num_samples_per_dimension))
-    for p, position in enumerate(positions):
-        for v, velocity in enumerate(velocities):
-            indices = tile_coder.indices((position, velocity))
-            value_estimates[p, v] = critic.estimate(indices)
+    # Estimate the values of the whole grid of states with one sparse mat-vec:
+    grid = np.stack(np.meshgrid(positions, velocities, indexing='ij'), axis=-1).reshape(-1, 2)
+    value_estimates = (tile_coder.sparse_features(grid) @ critic.w).reshape(num_samples_per_dimension, num_samples_per_dimension)
 
     pos, vel = np.meshgrid(positions, velocities)
     ax.plot_surface(pos, vel, value_estimates, cmap='hot')
@@ -63,11 +61,11 @@ def plot_learned_policy(actor, tile_coder, num_samples_per_dimension=100):
     # Sample the learned policy:
     positions = np.linspace(*position_limits, num_samples_per_dimension)
     velocities = np.linspace(*velocity_limits, num_samples_per_dimension)
-    learned_policy = np.zeros((num_samples_per_dimension, num_samples_per_dimension, 3))
-    for p, position in enumerate(positions):
-        for v, velocity in enumerate(velocities):
-            indices = tile_coder.indices((position, velocity))
-            learned_policy[p, v] = actor.pi(indices)
+    # Compute the action preferences for the whole grid of states with one sparse mat-mul:
+    grid = np.stack(np.meshgrid(positions, velocities, indexing='ij'), axis=-1).reshape(-1, 2)
+    preferences = tile_coder.sparse_features(grid) @ actor.theta.T
+    exp_preferences = np.exp(preferences - preferences.max(axis=1, keepdims=True))
+    learned_policy = (exp_preferences / exp_preferences.sum(axis=1, keepdims=True)).reshape(num_samples_per_dimension, num_samples_per_dimension, -1)
 
     pos, vel = np.meshgrid(positions, velocities)
     ax.plot_surface(pos, vel, learned_policy[:, :, 2], cmap='hot')
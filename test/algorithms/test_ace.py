@@ -5,9 +5,9 @@ from tqdm import tqdm
 import scipy.stats as st
 import matplotlib.pyplot as plt
 from joblib import Parallel, delayed
-from src.algorithms.ace import BinaryACE
+from src.algorithms.ace import BinaryACE, BatchBinaryACE
 from src.algorithms.fhat import BinaryFHat
-from src.algorithms.tdc import BinaryTDC, BinaryGQ
+from src.algorithms.tdc import BinaryTDC, BatchBinaryTDC, BinaryGQ
 from src.function_approximation.tile_coder import TileCoder
 from evaluate_policies import evaluate_policy
 
@@ -200,6 +200,149 @@ class ACETests(unittest.TestCase):
         plt.savefig('binary_ace_off_policy.png')
         self.assertGreater(mean_rewards[-1], -200)
 
+    def test_batch_binary_ace(self):
+        env = gym.make('MountainCar-v0').unwrapped
+        env.seed(3487291046)
+        rng = env.np_random
+
+        # alpha_a, alpha_c, alpha_c2, lambda_c and eta for each configuration (the second one diverges):
+        parameters = np.array([[.0005, .1, .0005, 0., 1.], [50., 500., 5., .9, 1.], [.01, .01, .00005, .4, 0.]])
+        alpha_a, alpha_c, alpha_c2, lambda_c, eta = parameters.T
+        gamma = 1.
+        num_timesteps = 2000
+
+        tc = TileCoder(np.array([env.observation_space.low, env.observation_space.high]).T, [5, 5], 8, True)
+        batch_actor = BatchBinaryACE(env.action_space.n, tc.total_num_tiles, alpha_a / tc.num_active_features)
+        batch_critic = BatchBinaryTDC(tc.total_num_tiles, alpha_c / tc.num_active_features, alpha_c2 / tc.num_active_features, lambda_c)
+        actors = [BinaryACE(env.action_space.n, tc.total_num_tiles, alpha / tc.num_active_features) for alpha in alpha_a]
+        critics = [BinaryTDC(tc.total_num_tiles, alpha_w / tc.num_active_features, alpha_v / tc.num_active_features, lambda_c_) for alpha_w, alpha_v, lambda_c_ in zip(alpha_c, alpha_c2, lambda_c)]
+
+        mu = np.ones(env.action_space.n) / env.action_space.n  # Uniform random policy.
+        gamma_t = 0.
+        f_t = np.ones(len(parameters))
+        rho_tm1 = np.ones(len(parameters))
+        indices_t = tc.encode(env.reset())
+        with np.errstate(divide='ignore', over='ignore', invalid='ignore'):
+            for t in range(num_timesteps):
+                a_t = rng.choice(env.action_space.n, p=mu)
+                s_tp1, r_tp1, terminal, _ = env.step(a_t)
+                gamma_tp1 = 0. if terminal else gamma
+                indices_tp1 = tc.encode(s_tp1)
+
+                # Learn every configuration at once:
+                rho_t = batch_actor.pi(indices_t)[:, a_t] / mu[a_t]
+                delta_t = r_tp1 + gamma_tp1 * batch_critic.estimate(indices_tp1) - batch_critic.estimate(indices_t)
+                batch_critic.learn(delta_t, indices_t, gamma_t, indices_tp1, gamma_tp1, rho_t)
+                f_t = rho_tm1 * gamma_t * f_t + 1.
+                m_t = (1 - eta) + eta * f_t
+                batch_actor.learn(indices_t, a_t, delta_t, m_t, rho_t)
+
+                # Learn each configuration separately:
+                for c, (actor, critic) in enumerate(zip(actors, critics)):
+                    rho = actor.pi(indices_t)[a_t] / mu[a_t]
+                    delta = r_tp1 + gamma_tp1 * critic.estimate(indices_tp1) - critic.estimate(indices_t)
+                    critic.learn(delta, indices_t, gamma_t, indices_tp1, gamma_tp1, rho)
+                    actor.learn(indices_t, a_t, delta, m_t[c], rho)
+
+                gamma_t = gamma_tp1
+                indices_t = indices_tp1
+                rho_tm1 = rho_t
+                if terminal:
+                    indices_t = tc.encode(env.reset())
+
+        # The batched learners should match the separate ones exactly, and a diverging configuration shouldn't affect the others:
+        self.assertFalse(np.all(np.isfinite(batch_actor.theta[1])))
+        for c in (0, 2):
+            np.testing.assert_array_equal(batch_actor.theta[c], actors[c].theta)
+            np.testing.assert_array_equal(batch_critic.w[c], critics[c].w)
+            np.testing.assert_array_equal(batch_actor.actor(c).pi(indices_t), actors[c].pi(indices_t))
+
+    def test_multi_run_batch_binary_ace(self):
+        # Independent runs, each with its own environment, stepped in lockstep:
+        envs = [gym.make('MountainCar-v0').unwrapped for _ in range(3)]
+        for env, seed in zip(envs, (1508306135, 3011287652, 624159011)):
+            env.seed(seed)
+        num_runs, num_actions = len(envs), envs[0].action_space.n
+        alpha_a, alpha_c, alpha_c2, lambda_c, eta = .01, .01, .00005, .4, .5
+        gamma = 1.
+        num_timesteps = 2000
+
+        tc = TileCoder(np.array([envs[0].observation_space.low, envs[0].observation_space.high]).T, [5, 5], 8, True)
+        for feature_major in (False, True):
+            batch_actor = BatchBinaryACE(num_actions, tc.total_num_tiles, np.full(num_runs, alpha_a / tc.num_active_features), feature_major=feature_major)
+            batch_critic = BatchBinaryTDC(tc.total_num_tiles, np.full(num_runs, alpha_c / tc.num_active_features), alpha_c2 / tc.num_active_features, lambda_c)
+            actors = [BinaryACE(num_actions, tc.total_num_tiles, alpha_a / tc.num_active_features, feature_major=feature_major) for _ in envs]
+            critics = [BinaryTDC(tc.total_num_tiles, alpha_c / tc.num_active_features, alpha_c2 / tc.num_active_features, lambda_c) for _ in envs]
+
+            mu = np.ones(num_actions) / num_actions  # Uniform random policy.
+            gamma_t = np.zeros(num_runs)
+            f_t = np.zeros(num_runs)
+            rho_tm1 = np.ones(num_runs)
+            indices_t = np.array([tc.encode(env.reset()) for env in envs])
+            for t in range(num_timesteps):
+                a_t = np.array([env.np_random.choice(num_actions, p=mu) for env in envs])
+                steps = [env.step(a) for env, a in zip(envs, a_t)]
+                r_tp1 = np.array([r for _, r, _, _ in steps])
+                gamma_tp1 = np.array([0. if terminal else gamma for _, _, terminal, _ in steps])
+                indices_tp1 = np.array([tc.encode(env.reset() if terminal else s) for env, (s, _, terminal, _) in zip(envs, steps)])
+
+                # Learn every run at once, with indices, actions and discounts for each run:
+                pi_t = batch_actor.pi(indices_t)
+                rho_t = pi_t[np.arange(num_runs), a_t] / mu[a_t]
+                delta_t = r_tp1 + gamma_tp1 * batch_critic.estimate(indices_tp1) - batch_critic.estimate(indices_t)
+                batch_critic.learn(delta_t, indices_t, gamma_t, indices_tp1, gamma_tp1, rho_t)
+                f_t = rho_tm1 * gamma_t * f_t + 1.
+                m_t = (1 - eta) + eta * f_t
+                batch_actor.learn(indices_t, a_t, delta_t, m_t, rho_t, pi_t)
+
+                # Learn each run separately:
+                for r, (actor, critic) in enumerate(zip(actors, critics)):
+                    rho = actor.pi(indices_t[r])[a_t[r]] / mu[a_t[r]]
+                    delta = r_tp1[r] + gamma_tp1[r] * critic.estimate(indices_tp1[r]) - critic.estimate(indices_t[r])
+                    critic.learn(delta, indices_t[r], gamma_t[r], indices_tp1[r], gamma_tp1[r], rho)
+                    actor.learn(indices_t[r], a_t[r], delta, m_t[r], rho)
+
+                gamma_t = gamma_tp1
+                indices_t = indices_tp1
+                rho_tm1 = rho_t
+
+            # The batched learners should match the separate ones exactly:
+            for r in range(num_runs):
+                np.testing.assert_array_equal(batch_actor.theta[r], actors[r].theta)
+                np.testing.assert_array_equal(batch_critic.w[r], critics[r].w)
+                np.testing.assert_array_equal(batch_critic.v[r], critics[r].v)
+                np.testing.assert_array_equal(batch_actor.pi(indices_t)[r], actors[r].pi(indices_t[r]))
+
+    def test_feature_major_binary_ace(self):
+        np.random.seed(2291535731)
+        num_actions, num_features, num_active_features = 3, 201, 9
+        num_timesteps = 1000
+
+        actor = BinaryACE(num_actions, num_features, .01)
+        fm_actor = BinaryACE(num_actions, num_features, .01, feature_major=True)
+        critic = BinaryGQ(num_actions, num_features, .01, .001, .9)
+        fm_critic = BinaryGQ(num_actions, num_features, .01, .001, .9, feature_major=True)
+        self.assertTrue(fm_actor.theta.T.flags.c_contiguous)
+        self.assertTrue(fm_critic.w.T.flags.c_contiguous)
+        indices_t = np.sort(np.random.choice(num_features, num_active_features, replace=False))
+        for t in range(num_timesteps):
+            a_t = np.random.randint(num_actions)
+            r_tp1 = np.random.randn()
+            indices_tp1 = np.sort(np.random.choice(num_features, num_active_features, replace=False))
+            q_t = critic.estimate(indices_t)
+            for ace, gq in ((actor, critic), (fm_actor, fm_critic)):
+                pi_t = ace.pi(indices_t)
+                gq.learn(indices_t, a_t, 1., .9, r_tp1, indices_tp1, ace.pi(indices_tp1), .9)
+                ace.learn(indices_t, a_t, r_tp1, 1., 1., pi_t)
+                ace.all_actions_learn(indices_t, q_t, 1., pi_t)
+            indices_t = indices_tp1
+
+        # The layout only changes the order the weights are stored in, so the actors should match exactly:
+        np.testing.assert_array_equal(actor.theta, fm_actor.theta)
+        np.testing.assert_array_equal(actor.pi(indices_t), fm_actor.pi(indices_t))
+        self.assertTrue(np.allclose(critic.w, fm_critic.w))
+        self.assertTrue(np.allclose(critic.v, fm_critic.v))
+
     def test_all_actions_binary_ace_off_policy(self):
         env = gym.make('MountainCar-v0').unwrapped
         env.seed(1202470738)
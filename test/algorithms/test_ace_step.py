@@ -0,0 +1,128 @@
+import unittest
+import gym
+import numpy as np
+from src.algorithms.ace import BinaryACE, AutostepBinaryACE
+from src.algorithms.ace_step import ACEStep, GenericACEStep, AllActionsACEStep, LowVarACEStep
+from src.algorithms.fhat import BinaryFHat
+from src.algorithms.low_var_etd import BinaryLowVarETD
+from src.algorithms.tdc import BinaryTDC, BinaryGQ, AutostepBinaryTDC
+from src.function_approximation.tile_coder import TileCoder
+
+
+class ACEStepTests(unittest.TestCase):
+
+    def setUp(self):
+        # Generate some experience with a uniform random behaviour policy:
+        env = gym.make('MountainCar-v0').unwrapped
+        env.seed(1864214012)
+        rng = env.np_random
+        num_timesteps = 2000
+        self.num_actions = env.action_space.n
+        self.mu = np.ones(self.num_actions) / self.num_actions
+        self.tc_a = TileCoder(np.array([env.observation_space.low, env.observation_space.high]).T, [5, 5], 8, True)
+        self.tc_c = TileCoder(np.array([env.observation_space.low, env.observation_space.high]).T, [4, 4], 4, True)
+        self.transitions = []
+        s_t = env.reset()
+        for t in range(num_timesteps):
+            a_t = rng.choice(self.num_actions, p=self.mu)
+            s_tp1, r_tp1, terminal, _ = env.step(a_t)
+            self.transitions.append((s_t, a_t, r_tp1, s_tp1, 0. if terminal else .99))
+            s_t = env.reset() if terminal else s_tp1
+
+    def test_ace_step(self):
+        for dtype in (np.float64, np.float32):
+            tc = self.tc_a
+            actor = BinaryACE(self.num_actions, tc.total_num_tiles, .1 / tc.num_active_features, dtype)
+            critic = BinaryTDC(tc.total_num_tiles, .1 / tc.num_active_features, .001 / tc.num_active_features, .9, dtype)
+            ace = ACEStep(BinaryACE(self.num_actions, tc.total_num_tiles, .1 / tc.num_active_features, dtype), BinaryTDC(tc.total_num_tiles, .1 / tc.num_active_features, .001 / tc.num_active_features, .9, dtype), .5)
+            gamma_t = 0.
+            f_t = 0.
+            rho_tm1 = 1.
+            for s_t, a_t, r_tp1, s_tp1, gamma_tp1 in self.transitions:
+                indices_t, indices_tp1 = tc.encode(s_t), tc.encode(s_tp1)
+                pi_t = actor.pi(indices_t)
+                rho_t = pi_t[a_t] / self.mu[a_t]
+                delta_t = r_tp1 + gamma_tp1 * critic.estimate(indices_tp1) - critic.estimate(indices_t)
+                critic.learn(delta_t, indices_t, gamma_t, indices_tp1, gamma_tp1, rho_t)
+                f_t = rho_tm1 * gamma_t * f_t + 1.
+                actor.learn(indices_t, a_t, delta_t, .5 + .5 * f_t, rho_t, pi_t)
+                gamma_t = gamma_tp1
+                rho_tm1 = rho_t
+
+                ace.step(indices_t, a_t, r_tp1, indices_tp1, gamma_tp1, 1., self.mu)
+
+            np.testing.assert_array_equal(actor.theta, ace.actor.theta)
+            np.testing.assert_array_equal(critic.w, ace.critic.w)
+            np.testing.assert_array_equal(critic.v, ace.critic.v)
+            self.assertEqual(f_t, ace.f_t)
+
+    def test_generic_ace_step(self):
+        tc = self.tc_a
+        make_learners = lambda: (BinaryACE(self.num_actions, tc.total_num_tiles, .1 / tc.num_active_features), BinaryTDC(tc.total_num_tiles, .1 / tc.num_active_features, .001 / tc.num_active_features, .9))
+        ace = ACEStep(*make_learners(), .5)
+        generic_ace = GenericACEStep(*make_learners(), .5)
+        # With large initial step sizes, Autostep should keep the weights finite:
+        autostep_ace = GenericACEStep(AutostepBinaryACE(self.num_actions, tc.total_num_tiles, 1.), AutostepBinaryTDC(tc.total_num_tiles, 1., .1, .9), .5)
+        for s_t, a_t, r_tp1, s_tp1, gamma_tp1 in self.transitions:
+            indices_t, indices_tp1 = tc.encode(s_t), tc.encode(s_tp1)
+            for engine in (ace, generic_ace, autostep_ace):
+                engine.step(indices_t, a_t, r_tp1, indices_tp1, gamma_tp1, 1., self.mu)
+
+        np.testing.assert_array_equal(ace.actor.theta, generic_ace.actor.theta)
+        np.testing.assert_array_equal(ace.critic.w, generic_ace.critic.w)
+        self.assertEqual(ace.f_t, generic_ace.f_t)
+        self.assertTrue(np.all(np.isfinite(autostep_ace.actor.theta)))
+        self.assertTrue(np.all(np.isfinite(autostep_ace.critic.w)))
+        self.assertTrue(np.all(autostep_ace.actor.autostep.alpha <= 1.))
+
+    def test_all_actions_ace_step(self):
+        tc = self.tc_a
+        actor = BinaryACE(self.num_actions, tc.total_num_tiles, .1 / tc.num_active_features)
+        critic = BinaryGQ(self.num_actions, tc.total_num_tiles, .1 / tc.num_active_features, .001 / tc.num_active_features, .5)
+        ace = AllActionsACEStep(BinaryACE(self.num_actions, tc.total_num_tiles, .1 / tc.num_active_features), BinaryGQ(self.num_actions, tc.total_num_tiles, .1 / tc.num_active_features, .001 / tc.num_active_features, .5), 1.)
+        gamma_t = 0.
+        f_t = 0.
+        rho_tm1 = 1.
+        for s_t, a_t, r_tp1, s_tp1, gamma_tp1 in self.transitions:
+            indices_t, indices_tp1 = tc.encode(s_t), tc.encode(s_tp1)
+            pi_t = actor.pi(indices_t)
+            rho_t = pi_t[a_t] / self.mu[a_t]
+            critic.learn(indices_t, a_t, rho_t, gamma_t, r_tp1, indices_tp1, actor.pi(indices_tp1), gamma_tp1)
+            q_t = critic.estimate(indices_t)
+            f_t = rho_tm1 * gamma_t * f_t + 1.
+            actor.all_actions_learn(indices_t, q_t, f_t, pi_t)
+            gamma_t = gamma_tp1
+            rho_tm1 = rho_t
+
+            ace.step(indices_t, a_t, r_tp1, indices_tp1, gamma_tp1, 1., self.mu)
+
+        np.testing.assert_array_equal(actor.theta, ace.actor.theta)
+        np.testing.assert_array_equal(critic.w, ace.critic.w)
+
+    def test_low_var_ace_step(self):
+        tc_a, tc_c = self.tc_a, self.tc_c
+        fhat = BinaryFHat(tc_c.total_num_tiles, .001 / tc_c.num_active_features)
+        actor = BinaryACE(self.num_actions, tc_a.total_num_tiles, .1 / tc_a.num_active_features)
+        critic = BinaryLowVarETD(tc_c.total_num_tiles, .1 / tc_c.num_active_features, .5)
+        ace = LowVarACEStep(BinaryACE(self.num_actions, tc_a.total_num_tiles, .1 / tc_a.num_active_features), BinaryLowVarETD(tc_c.total_num_tiles, .1 / tc_c.num_active_features, .5), BinaryFHat(tc_c.total_num_tiles, .001 / tc_c.num_active_features), 1.)
+        gamma_t = 0.
+        for s_t, a_t, r_tp1, s_tp1, gamma_tp1 in self.transitions:
+            indices_t_a, indices_t_c, indices_tp1_c = tc_a.encode(s_t), tc_c.encode(s_t), tc_c.encode(s_tp1)
+            pi_t = actor.pi(indices_t_a)
+            rho_t = pi_t[a_t] / self.mu[a_t]
+            delta_t = r_tp1 + gamma_tp1 * critic.estimate(indices_tp1_c) - critic.estimate(indices_t_c)
+            f_t = fhat.estimate(indices_t_c)
+            actor.learn(indices_t_a, a_t, delta_t, f_t, rho_t, pi_t)
+            critic.learn(delta_t, indices_t_c, gamma_t, 1., indices_tp1_c, gamma_tp1, rho_t, f_t)
+            fhat.learn(indices_tp1_c, gamma_tp1, indices_t_c, rho_t, 1.)
+            gamma_t = gamma_tp1
+
+            ace.step(indices_t_a, indices_t_c, a_t, r_tp1, indices_tp1_c, gamma_tp1, 1., 1., self.mu)
+
+        np.testing.assert_array_equal(actor.theta, ace.actor.theta)
+        np.testing.assert_array_equal(critic.v, ace.critic.v)
+        np.testing.assert_array_equal(fhat.f, ace.fhat.f)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+import numpy as np
+from src.algorithms.dpg import DPG, DPGActor
+
+
+class DPGTests(unittest.TestCase):
+
+    def test_dpg_actor_learn_chunk(self):
+        np.random.seed(3194873010)
+        num_timesteps = 1000
+
+        for num_features in (1, 4):
+            x_t = np.random.randn(num_timesteps, num_features)
+            rho_t = np.random.rand(num_timesteps)
+            grad_t = np.random.randn(num_timesteps)
+            M = np.random.rand(num_timesteps) * 10 ** np.random.uniform(-3, 3, num_timesteps)
+
+            # Learn one transition at a time, in chunks, and in averaged minibatches:
+            actor, chunked_actor, minibatch_actor = (DPGActor(num_features, .01, 0.) for _ in range(3))
+            for t in range(num_timesteps):
+                actor.learn(x_t[t], 1., None, rho_t[t], grad_t[t], M=M[t])
+            for start in range(0, num_timesteps, 64):
+                chunk = slice(start, start + 64)
+                chunked_actor.learn_chunk(x_t[chunk], rho_t[chunk], grad_t[chunk], M=M[chunk])
+            minibatch_actor.learn_chunk(x_t, rho_t, grad_t, M=M, average=True)
+
+            # Chunks should match the per-step loop exactly, and a minibatch should take the mean of the updates:
+            np.testing.assert_array_equal(chunked_actor.policy.u, actor.policy.u)
+            self.assertEqual(chunked_actor.rho_tm1, actor.rho_tm1)
+            np.testing.assert_allclose(minibatch_actor.policy.u, actor.policy.u / num_timesteps)
+
+            # An empty chunk shouldn't change anything:
+            for average in (False, True):
+                chunked_actor.learn_chunk(x_t[:0], rho_t[:0], grad_t[:0], M=M[:0], average=average)
+            np.testing.assert_array_equal(chunked_actor.policy.u, actor.policy.u)
+            self.assertEqual(chunked_actor.rho_tm1, actor.rho_tm1)
+
+    def test_dpg_learn_chunk(self):
+        np.random.seed(2268419305)
+        num_timesteps, num_features = 500, 3
+        x_t = np.random.randn(num_timesteps, num_features)
+        rho_t = np.ones(num_timesteps)
+        grad_t = np.random.randn(num_timesteps)
+
+        # Without M, both paths should use the fixed emphasis of 1:
+        dpg, chunked_dpg = DPG(num_features, .1, 0., 0., 0., 0.), DPG(num_features, .1, 0., 0., 0., 0.)
+        for t in range(num_timesteps):
+            dpg.learn(x_t[t], 1., None, 0., x_t[t], 1., rho_t[t], v_t=0., v_tp1=0., grad_t=grad_t[t])
+        chunked_dpg.learn_chunk(x_t, rho_t, grad_t)
+        np.testing.assert_array_equal(chunked_dpg.actor.policy.u, dpg.actor.policy.u)
+
+
+if __name__ == '__main__':
+    unittest.main()
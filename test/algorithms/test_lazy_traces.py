@@ -0,0 +1,170 @@
+import unittest
+import numpy as np
+from tqdm import tqdm
+from src.algorithms.lazy_traces import LazyTraces
+from src.algorithms.tdc import BinaryTDC, LazyBinaryTDC, BinaryGQ, LazyBinaryGQ, BinaryTOGQ, LazyBinaryTOGQ
+from src.algorithms.gop import BinaryGOP, LazyBinaryGOP
+from src.algorithms.low_var_etd import BinaryLowVarETD, LazyBinaryLowVarETD
+from src.algorithms.toetd import BinaryTOETD, LazyBinaryTOETD
+from src.environments.collision import Collision
+
+
+class LazyTracesTests(unittest.TestCase):
+
+    def test_lazy_traces(self):
+        np.random.seed(2113806423)
+        num_features = 50
+        num_timesteps = 2000
+
+        # Two traces, the first followed by two weight vectors and the second by one:
+        traces = LazyTraces(num_features, 2, [0, 0, 1], dots=[(0, 0), (1, 1), (1, 2), (0, 2)])
+        z = np.zeros((2, num_features))
+        w = np.zeros((3, num_features))
+        for t in tqdm(range(num_timesteps)):
+            trace_num = np.random.randint(2)
+            indices = np.random.choice(num_features, 5, replace=False)
+            values = np.random.randn(5)
+            # Occasionally zero a trace, and otherwise decay it by enough to trigger renormalizations:
+            c = 0. if np.random.rand() < .02 else np.random.choice([.5, .9, 1.5])
+            follower_num = np.random.randint(3)
+            a = np.random.randn()
+
+            traces.decay(trace_num, c)
+            z[trace_num] *= c
+            traces.add_to_trace(trace_num, indices, values)
+            z[trace_num, indices] += values
+            traces.step(follower_num, a)
+            w[follower_num] += a * z[traces.follows[follower_num]]
+            traces.add_to_weights(follower_num, indices, values)
+            w[follower_num, indices] += values
+
+            for j in range(2):
+                self.assertTrue(np.allclose(traces.dense_trace(j), z[j]))
+                self.assertTrue(np.allclose(traces.trace(j, indices), z[j, indices]))
+            for k in range(3):
+                self.assertTrue(np.allclose(traces.dense_weights(k), w[k]))
+                self.assertTrue(np.allclose(traces.weights(k, indices), w[k, indices]))
+            for j, k in traces.cross:
+                self.assertAlmostEqual(traces.dot(j, k), z[j].dot(w[k]))
+
+    def test_lazy_traces_pruning(self):
+        np.random.seed(3469187520)
+        num_features = 1000
+        num_timesteps = 1000
+
+        # A continuing task (traces are never zeroed) that keeps moving on to new features:
+        traces = LazyTraces(num_features, 2, [0, 1], dots=[(0, 0), (1, 1)])
+        z = np.zeros((2, num_features))
+        w = np.zeros((2, num_features))
+        for t in range(num_timesteps):
+            indices = (5 * t + np.arange(5)) % num_features
+            values = np.random.randn(5)
+            for j in range(2):
+                traces.decay(j, .5)
+                z[j] *= .5
+                traces.add_to_trace(j, indices, values)
+                z[j, indices] += values
+                a = np.random.randn()
+                traces.step(j, a)
+                w[j] += a * z[j]
+
+        # Only the recently active features should stay active, and pruning should only drop negligible trace entries:
+        self.assertGreater(traces.num_active, 0)
+        self.assertLess(traces.num_active, 500)
+        self.assertEqual(traces.is_active.sum(), traces.num_active)
+        for j in range(2):
+            np.testing.assert_allclose(traces.dense_trace(j), z[j], rtol=1e-9, atol=1e-11)
+            np.testing.assert_allclose(traces.dense_weights(j), w[j], rtol=1e-9, atol=1e-9)
+            self.assertAlmostEqual(traces.dot(j, j), z[j].dot(w[j]))
+
+    def test_lazy_learners(self):
+        env = Collision
+        np.random.seed(1730740995)
+        num_timesteps = 5000
+
+        btdc, lbtdc = BinaryTDC(env.num_features, .01, .001, .9), LazyBinaryTDC(env.num_features, .01, .001, .9)
+        betd, lbetd = BinaryLowVarETD(env.num_features, .01, .9), LazyBinaryLowVarETD(env.num_features, .01, .9)
+        btoetd, lbtoetd = BinaryTOETD(env.num_features, 1., .001), LazyBinaryTOETD(env.num_features, 1., .001)
+        indices = env.indices()
+        s_t = env.init()
+        a_t = np.random.choice(env.actions, p=env.mu[s_t])
+        gamma_t = 0.
+        F_t = 1.
+        rho_tm1 = 1.
+        for t in tqdm(range(num_timesteps)):
+            r_tp1, s_tp1 = env.sample(s_t, a_t)
+            if s_tp1 is None:
+                gamma_tp1 = 0.
+                s_tp1 = env.init()
+            else:
+                gamma_tp1 = env.gamma
+            a_tp1 = np.random.choice(env.actions, p=env.mu[s_tp1])
+            indices_t = indices[s_t]
+            indices_tp1 = indices[s_tp1]
+            rho_t = env.rho[s_t, a_t]
+            F_t = rho_tm1 * gamma_t * F_t + 1
+            for tdc in (btdc, lbtdc):
+                tdc.learn(r_tp1 + gamma_tp1 * tdc.estimate(indices_tp1) - tdc.estimate(indices_t), indices_t, gamma_t, indices_tp1, gamma_tp1, rho_t)
+            for etd in (betd, lbetd):
+                etd.learn(r_tp1 + gamma_tp1 * etd.estimate(indices_tp1) - etd.estimate(indices_t), indices_t, gamma_t, 1., indices_tp1, gamma_tp1, rho_t, F_t)
+            for toetd in (btoetd, lbtoetd):
+                toetd.learn(indices_t, r_tp1 + gamma_tp1 * toetd.estimate(indices_tp1) - toetd.estimate(indices_t), rho_t, gamma_tp1, .9, 1., .001)
+            s_t, a_t, gamma_t, rho_tm1 = s_tp1, a_tp1, gamma_tp1, rho_t
+
+        self.assertTrue(np.allclose(btdc.w, lbtdc.w))
+        self.assertTrue(np.allclose(btdc.v, lbtdc.v))
+        self.assertTrue(np.allclose(btdc.z, lbtdc.z))
+        self.assertTrue(np.allclose(betd.v, lbetd.v))
+        self.assertTrue(np.allclose(betd.e, lbetd.e))
+        self.assertTrue(np.allclose(btoetd.theta, lbtoetd.theta))
+        self.assertTrue(np.allclose(btoetd.ep, lbtoetd.ep))
+
+    def test_lazy_action_value_learners(self):
+        env = Collision
+        np.random.seed(1730740995)
+        num_timesteps = 5000
+
+        bgq, lbgq = BinaryGQ(env.num_actions, env.num_features, .01, .01, .9), LazyBinaryGQ(env.num_actions, env.num_features, .01, .01, .9)
+        btogq, lbtogq = BinaryTOGQ(env.num_actions, env.num_features, .01, .01, .9), LazyBinaryTOGQ(env.num_actions, env.num_features, .01, .01, .9)
+        bgop, lbgop = BinaryGOP(env.num_actions, env.num_features, .01, .01, .9), LazyBinaryGOP(env.num_actions, env.num_features, .01, .01, .9)
+        indices = env.indices()
+        s_t = env.init()
+        a_t = np.random.choice(env.actions, p=env.mu[s_t])
+        gamma_t = 0.
+        rho_tm1 = 1.
+        q_old, lazy_q_old = 0., 0.
+        for t in tqdm(range(num_timesteps)):
+            r_tp1, s_tp1 = env.sample(s_t, a_t)
+            if s_tp1 is None:
+                gamma_tp1 = 0.
+                s_tp1 = env.init()
+            else:
+                gamma_tp1 = env.gamma
+            a_tp1 = np.random.choice(env.actions, p=env.mu[s_tp1])
+            indices_t = indices[s_t]
+            indices_tp1 = indices[s_tp1]
+            rho_t = env.rho[s_t, a_t]
+            for gq in (bgq, lbgq):
+                gq.learn(indices_t, a_t, rho_t, gamma_t, r_tp1, indices_tp1, env.pi, gamma_tp1)
+            q_tp1, lazy_q_tp1 = btogq.estimate(indices_tp1, a_tp1), lbtogq.estimate(indices_tp1, a_tp1)
+            btogq.learn(q_old, rho_tm1, indices_t, a_t, gamma_t, rho_t, r_tp1, indices_tp1, env.pi, gamma_tp1)
+            lbtogq.learn(lazy_q_old, rho_tm1, indices_t, a_t, gamma_t, rho_t, r_tp1, indices_tp1, env.pi, gamma_tp1)
+            for gop in (bgop, lbgop):
+                gop.learn(indices_t, a_t, gamma_t, rho_t, r_tp1, indices_tp1, gamma_tp1, env.pi)
+            s_t, a_t, gamma_t, rho_tm1 = s_tp1, a_tp1, gamma_tp1, rho_t
+            q_old, lazy_q_old = q_tp1, lazy_q_tp1
+
+        self.assertTrue(np.allclose(bgq.w, lbgq.w))
+        self.assertTrue(np.allclose(bgq.v, lbgq.v))
+        self.assertTrue(np.allclose(bgq.z, lbgq.z))
+        self.assertTrue(np.allclose(btogq.w, lbtogq.w))
+        self.assertTrue(np.allclose(btogq.v, lbtogq.v))
+        self.assertTrue(np.allclose(btogq.z_w, lbtogq.z_w))
+        self.assertTrue(np.allclose(btogq.z_v, lbtogq.z_v))
+        self.assertTrue(np.allclose(bgop.w, lbgop.w))
+        self.assertTrue(np.allclose(bgop.v, lbgop.v))
+        self.assertTrue(np.allclose(bgop.e, lbgop.e))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import hashlib
+import sys
+import types
+import unittest
+import numpy as np
+try:
+    from blackhc import mdp
+except ImportError:
+    # The tests give the MDP's matrices directly, so blackhc.mdp (only used to extract them from an env) can be stubbed:
+    blackhc = types.ModuleType('blackhc')
+    blackhc.mdp = types.ModuleType('blackhc.mdp')
+    sys.modules['blackhc'], sys.modules['blackhc.mdp'] = blackhc, blackhc.mdp
+from src.algorithms.oracle_critic import OracleCritic
+from src.policy_types.discrete_policy import DiscretePolicy
+
+
+class MatrixOracleCritic(OracleCritic):
+    # An OracleCritic for an MDP given as transition, reward and discount matrices (env) with one-hot state features:
+
+    def _extract_info(self, env):
+        return env
+
+    class OneHotTileCoder:
+        def __init__(self, num_states):
+            self.num_states = num_states
+
+        def features(self, s):
+            return np.eye(self.num_states)[s]
+
+
+class OracleCriticTests(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(408631275)
+        self.num_states, self.num_actions = 6, 3
+        self.p = np.random.rand(self.num_states, self.num_actions, self.num_states)
+        self.p /= self.p.sum(axis=2, keepdims=True)
+        self.r = np.random.randn(self.num_states, self.num_actions, self.num_states)
+        # Action 0 never terminates, and the others terminate on some transitions:
+        self.gamma = np.where(np.random.rand(self.num_states, self.num_actions, self.num_states) < .3, 0., 1.)
+        self.gamma[:, 0] = 1.
+        self.d_mu = np.random.rand(self.num_states)
+        self.d_mu /= self.d_mu.sum()
+
+    def make_oracle(self, policy=None, cache_size=256):
+        return MatrixOracleCritic((self.p, self.r, self.gamma), MatrixOracleCritic.OneHotTileCoder(self.num_states), policy, cache_size)
+
+    def pinv_estimate(self, oracle, pi):
+        # The pinv formulas OracleCritic used before batching:
+        r_pi = np.sum(pi*oracle.p_r, axis=1)
+        p_pi_gamma = np.sum(pi[...,None]*oracle.p_gamma, axis=1)
+        return np.linalg.pinv(np.eye(p_pi_gamma.shape[0]) - p_pi_gamma).dot(r_pi)
+
+    def pinv_true_Mt(self, oracle, d_mu, pi):
+        p_pi_gamma = np.sum(pi[...,None]*oracle.p_gamma, axis=1)
+        return np.linalg.pinv(np.eye(p_pi_gamma.shape[0]) - p_pi_gamma).T.dot(d_mu) / d_mu
+
+    def random_policies(self, num_policies):
+        pi = np.random.rand(num_policies, self.num_states, self.num_actions)
+        return pi / pi.sum(axis=2, keepdims=True)
+
+    def test_single_and_stacked_policies(self):
+        policy = DiscretePolicy(np.random.randn(self.num_actions, self.num_states))
+        oracle = self.make_oracle(policy)
+        pi = self.random_policies(10)
+
+        # A stack of policies should give the same values as the pinv formulas for each one:
+        np.testing.assert_allclose(oracle.estimate(pi), [self.pinv_estimate(oracle, policy_pi) for policy_pi in pi])
+        np.testing.assert_allclose(oracle.true_Mt(self.d_mu, pi), [self.pinv_true_Mt(oracle, self.d_mu, policy_pi) for policy_pi in pi])
+        np.testing.assert_allclose(oracle.estimate(pi[3]), self.pinv_estimate(oracle, pi[3]))
+        np.testing.assert_allclose(oracle.true_Mt(self.d_mu, pi[3]), self.pinv_true_Mt(oracle, self.d_mu, pi[3]))
+
+        # Without pi, the current policy's probabilities should be used:
+        policy_pi = np.array([policy.pi(np.eye(self.num_states)[s]) for s in range(self.num_states)])
+        np.testing.assert_allclose(oracle.estimate(), self.pinv_estimate(oracle, policy_pi))
+        np.testing.assert_allclose(oracle.true_Mt(self.d_mu), self.pinv_true_Mt(oracle, self.d_mu, policy_pi))
+
+    def test_singular_policy(self):
+        oracle = self.make_oracle()
+        # A policy that always takes action 0 never terminates, so I - P_pi_gamma is singular and pinv is used:
+        never_terminating = np.zeros((self.num_states, self.num_actions))
+        never_terminating[:, 0] = 1.
+        pi = np.stack([never_terminating, self.random_policies(1)[0]])
+        np.testing.assert_allclose(oracle.estimate(pi), [self.pinv_estimate(oracle, policy_pi) for policy_pi in pi], atol=1e-8)
+        np.testing.assert_allclose(oracle.true_Mt(self.d_mu, pi), [self.pinv_true_Mt(oracle, self.d_mu, policy_pi) for policy_pi in pi], atol=1e-8)
+        np.testing.assert_allclose(oracle.estimate(never_terminating), self.pinv_estimate(oracle, never_terminating), atol=1e-8)
+
+    def test_cache_eviction(self):
+        oracle = self.make_oracle(cache_size=2)
+        pi = self.random_policies(3)
+        oracle.estimate(pi[0])
+        oracle.estimate(pi[1])
+        oracle.estimate(pi[0])  # pi[0] is now the most recently used.
+        oracle.estimate(pi[2])
+
+        # The least recently used policy should have been evicted, and cached inverses should be reused:
+        digests = [hashlib.sha1(policy_pi.tobytes()).digest() for policy_pi in pi]
+        self.assertEqual(list(oracle.inverses), [digests[0], digests[2]])
+        cached_inverse = oracle.inverses[digests[2]]
+        np.testing.assert_allclose(oracle.true_Mt(self.d_mu, pi[2]), self.pinv_true_Mt(oracle, self.d_mu, pi[2]))
+        self.assertIs(oracle.inverses[digests[2]], cached_inverse)
+        np.testing.assert_allclose(oracle.estimate(pi), [self.pinv_estimate(oracle, policy_pi) for policy_pi in pi])
+        self.assertEqual(len(oracle.inverses), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import numpy as np
+from scipy.sparse import csr_matrix
+from src.algorithms.ace import LinearACE
+from src.algorithms.fhat import LinearFHat
+from src.algorithms.low_var_etd import LinearLowVarETD
+from src.algorithms.sparse_features import is_sparse, sparse_parts
+from src.algorithms.tdc import LinearTDC
+from src.algorithms.toetd import LinearTOETD
+
+
+class SparseFeaturesTests(unittest.TestCase):
+
+    def test_sparse_parts(self):
+        x = np.array([0., .5, 0., -2., 0.])
+        for sparse_x in (csr_matrix(x), (np.array([1, 3]), np.array([.5, -2.]))):
+            self.assertTrue(is_sparse(sparse_x))
+            indices, values = sparse_parts(sparse_x)
+            np.testing.assert_array_equal(indices, [1, 3])
+            np.testing.assert_array_equal(values, [.5, -2.])
+        self.assertFalse(is_sparse(x))
+        np.testing.assert_array_equal(sparse_parts(x)[0], [1, 3])
+
+    def test_sparse_linear_learners(self):
+        np.random.seed(2094857311)
+        num_actions, num_features, num_active_features = 3, 50, 6
+        num_timesteps = 1000
+
+        def make_learners():
+            return LinearACE(num_actions, num_features, .01), LinearTDC(num_features, .01, .001, .9), LinearLowVarETD(num_features, .01, .9), LinearFHat(num_features, .01), LinearTOETD(num_features, 1., .01)
+
+        # Non-binary sparse features (e.g. normalized tile codes), given densely, as scipy.sparse rows and as (indices, values) pairs:
+        def features():
+            x = np.zeros(num_features)
+            indices = np.random.choice(num_features, num_active_features, replace=False)
+            x[indices] = np.random.rand(num_active_features) / num_active_features
+            return x
+        to_inputs = (lambda x: x, csr_matrix, lambda x: (np.flatnonzero(x), x[np.flatnonzero(x)]))
+        learners = [make_learners() for _ in to_inputs]
+        x_t = features()
+        gamma_t = 0.
+        F_t = 0.
+        rho_tm1 = 1.
+        for t in range(num_timesteps):
+            a_t = np.random.randint(num_actions)
+            r_tp1 = np.random.randn()
+            x_tp1 = features()
+            gamma_tp1 = 0. if np.random.rand() < .05 else .9
+            F_t = rho_tm1 * gamma_t * F_t + 1.
+            for to_input, (ace, tdc, etd, fhat, toetd) in zip(to_inputs, learners):
+                input_t, input_tp1 = to_input(x_t), to_input(x_tp1)
+                rho_t = ace.pi(input_t)[a_t] * num_actions
+                delta_t = r_tp1 + gamma_tp1 * tdc.estimate(input_tp1) - tdc.estimate(input_t)
+                tdc.learn(delta_t, input_t, gamma_t, input_tp1, gamma_tp1, rho_t)
+                ace.learn(input_t, a_t, delta_t, F_t, rho_t)
+                etd.learn(r_tp1 + gamma_tp1 * etd.estimate(input_tp1) - etd.estimate(input_t), input_t, gamma_t, 1., input_tp1, gamma_tp1, rho_t, F_t)
+                fhat.learn(input_tp1, gamma_tp1, input_t, rho_t, 1.)
+                toetd.learn(input_t, r_tp1 + gamma_tp1 * toetd.estimate(input_tp1) - toetd.estimate(input_t), rho_t, gamma_tp1, .9, 1., .01)
+            rho_tm1 = rho_t
+            gamma_t = gamma_tp1
+            x_t = x_tp1
+
+        # The sparse kernels should match the dense ones up to rounding:
+        (ace, tdc, etd, fhat, toetd), *sparse_learners = learners
+        for sparse_ace, sparse_tdc, sparse_etd, sparse_fhat, sparse_toetd in sparse_learners:
+            np.testing.assert_allclose(sparse_ace.theta, ace.theta, atol=1e-10)
+            np.testing.assert_allclose(sparse_tdc.w, tdc.w, atol=1e-10)
+            np.testing.assert_allclose(sparse_tdc.v, tdc.v, atol=1e-10)
+            np.testing.assert_allclose(sparse_etd.v, etd.v, atol=1e-10)
+            np.testing.assert_allclose(sparse_fhat.f, fhat.f, atol=1e-10)
+            np.testing.assert_allclose(sparse_toetd.theta, toetd.theta, atol=1e-10)
+        self.assertGreater(np.abs(ace.theta).max(), 0.)
+
+
+if __name__ == '__main__':
+    unittest.main()
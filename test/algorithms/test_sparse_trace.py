@@ -0,0 +1,101 @@
+import unittest
+import numpy as np
+from tqdm import tqdm
+from src.algorithms.sparse_trace import SparseTrace
+from src.algorithms.tdc import BinaryTDC, TruncatedBinaryTDC, BinaryGQ, TruncatedBinaryGQ
+from src.algorithms.low_var_etd import BinaryLowVarETD, TruncatedBinaryLowVarETD
+from src.algorithms.toetd import BinaryTOETD, TruncatedBinaryTOETD
+from src.environments.collision import Collision
+
+
+class SparseTraceTests(unittest.TestCase):
+
+    def test_sparse_trace(self):
+        np.random.seed(3329071856)
+        num_features = 100
+        num_timesteps = 1000
+
+        exact_trace = SparseTrace(threshold=0.)
+        truncated_trace = SparseTrace(threshold=1e-3, max_entries=10)
+        z = np.zeros(num_features)
+        w = np.zeros(num_features)
+        for t in tqdm(range(num_timesteps)):
+            indices = np.random.choice(num_features, 5, replace=False)
+            values = np.random.randn(5)
+            c = 0. if np.random.rand() < .01 else .9
+
+            for trace in (exact_trace, truncated_trace):
+                trace.scale(c)
+                trace.add(indices, values)
+            z *= c
+            z[indices] += values
+            exact_trace.add_to(w, .1)
+
+            self.assertTrue(np.allclose(exact_trace.dense(num_features), z))
+            self.assertTrue(np.allclose(exact_trace.get(indices), z[indices]))
+            self.assertAlmostEqual(exact_trace.dot(w), z.dot(w))
+            self.assertTrue(np.all(np.diff(exact_trace.indices) > 0))
+            self.assertLessEqual(len(truncated_trace), 10)
+            self.assertTrue(np.all(np.abs(truncated_trace.values) > 1e-3))
+
+        self.assertEqual(exact_trace.truncation_error, 0.)
+        self.assertGreater(truncated_trace.truncation_error, 0.)
+
+    def test_truncated_learners(self):
+        env = Collision
+        np.random.seed(1730740995)
+        num_timesteps = 5000
+
+        # With a threshold of 0 the truncated learners only drop exact zeros, so they should match the dense ones:
+        btdc, tbtdc = BinaryTDC(env.num_features, .01, .001, .9), TruncatedBinaryTDC(env.num_features, .01, .001, .9, threshold=0.)
+        betd, tbetd = BinaryLowVarETD(env.num_features, .01, .9), TruncatedBinaryLowVarETD(env.num_features, .01, .9, threshold=0.)
+        btoetd, tbtoetd = BinaryTOETD(env.num_features, 1., .001), TruncatedBinaryTOETD(env.num_features, 1., .001, threshold=0.)
+        bgq, tbgq = BinaryGQ(env.num_actions, env.num_features, .01, .01, .9), TruncatedBinaryGQ(env.num_actions, env.num_features, .01, .01, .9, threshold=0.)
+        # With a threshold and a memory bound, the approximation error should be reported and the values should still be close:
+        mbtdc = TruncatedBinaryTDC(env.num_features, .01, .001, .9, threshold=.01, max_entries=5)
+        indices = env.indices()
+        s_t = env.init()
+        a_t = np.random.choice(env.actions, p=env.mu[s_t])
+        gamma_t = 0.
+        F_t = 1.
+        rho_tm1 = 1.
+        for t in tqdm(range(num_timesteps)):
+            r_tp1, s_tp1 = env.sample(s_t, a_t)
+            if s_tp1 is None:
+                gamma_tp1 = 0.
+                s_tp1 = env.init()
+            else:
+                gamma_tp1 = env.gamma
+            a_tp1 = np.random.choice(env.actions, p=env.mu[s_tp1])
+            indices_t = indices[s_t]
+            indices_tp1 = indices[s_tp1]
+            rho_t = env.rho[s_t, a_t]
+            F_t = rho_tm1 * gamma_t * F_t + 1
+            for tdc in (btdc, tbtdc, mbtdc):
+                tdc.learn(r_tp1 + gamma_tp1 * tdc.estimate(indices_tp1) - tdc.estimate(indices_t), indices_t, gamma_t, indices_tp1, gamma_tp1, rho_t)
+            for etd in (betd, tbetd):
+                etd.learn(r_tp1 + gamma_tp1 * etd.estimate(indices_tp1) - etd.estimate(indices_t), indices_t, gamma_t, 1., indices_tp1, gamma_tp1, rho_t, F_t)
+            for toetd in (btoetd, tbtoetd):
+                toetd.learn(indices_t, r_tp1 + gamma_tp1 * toetd.estimate(indices_tp1) - toetd.estimate(indices_t), rho_t, gamma_tp1, .9, 1., .001)
+            for gq in (bgq, tbgq):
+                gq.learn(indices_t, a_t, rho_t, gamma_t, r_tp1, indices_tp1, env.pi, gamma_tp1)
+            s_t, a_t, gamma_t, rho_tm1 = s_tp1, a_tp1, gamma_tp1, rho_t
+
+        self.assertTrue(np.allclose(btdc.w, tbtdc.w))
+        self.assertTrue(np.allclose(btdc.v, tbtdc.v))
+        self.assertTrue(np.allclose(btdc.z, tbtdc.z.dense(env.num_features)))
+        self.assertTrue(np.allclose(betd.v, tbetd.v))
+        self.assertTrue(np.allclose(betd.e, tbetd.e.dense(env.num_features)))
+        self.assertTrue(np.allclose(btoetd.theta, tbtoetd.theta))
+        self.assertTrue(np.allclose(btoetd.ep, tbtoetd.ep.dense(env.num_features)))
+        self.assertTrue(np.allclose(bgq.w, tbgq.w))
+        self.assertTrue(np.allclose(bgq.v, tbgq.v))
+        self.assertTrue(np.allclose(np.ravel(bgq.z), tbgq.z.dense(env.num_actions * env.num_features)))
+        for learner in (tbtdc, tbetd, tbtoetd, tbgq):
+            self.assertEqual(learner.truncation_error, 0.)
+        self.assertGreater(mbtdc.truncation_error, 0.)
+        self.assertTrue(np.allclose(btdc.w, mbtdc.w, atol=.05))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,7 @@ import unittest
 import matplotlib.pyplot as plt
 import numpy as np
 from tqdm import tqdm
-from src.algorithms.tdc import LinearTDC, BinaryTDC, BinaryGQ, BinaryTOGQ
+from src.algorithms.tdc import LinearTDC, BinaryTDC, BinaryGQ, BinaryTOGQ, AutostepBinaryTDC
 from src.environments.bairds_counterexample import BairdsCounterexample
 from src.environments.collision import Collision
 
@@ -111,6 +111,86 @@ class TDCTests(unittest.TestCase):
         plt.savefig('tdc_collision.png')
         np.testing.assert_almost_equal(btdc_msve, ltdc_msve, .009)
 
+    def test_binary_tdc_float32(self):
+        env = Collision
+        np.random.seed(2471930846)
+        num_timesteps = 5000
+
+        # Learn in single and double precision from the same experience:
+        btdc32 = BinaryTDC(env.num_features, .01, .001, 0.9, np.float32)
+        btdc64 = BinaryTDC(env.num_features, .01, .001, 0.9)
+        bgq32 = BinaryGQ(env.num_actions, env.num_features, .01, .01, 0.9, np.float32)
+        bgq64 = BinaryGQ(env.num_actions, env.num_features, .01, .01, 0.9)
+        indices = env.indices()
+        s_t = env.init()
+        a_t = np.random.choice(env.actions, p=env.mu[s_t])
+        gamma_t = 0.
+        for t in range(num_timesteps):
+            r_tp1, s_tp1 = env.sample(s_t, a_t)
+            if s_tp1 is None:
+                gamma_tp1 = 0.
+                s_tp1 = env.init()
+            else:
+                gamma_tp1 = env.gamma
+            a_tp1 = np.random.choice(env.actions, p=env.mu[s_tp1])
+            rho_t = env.rho[s_t, a_t]
+            for btdc in (btdc32, btdc64):
+                btdc.learn(r_tp1 + gamma_tp1 * btdc.estimate(indices[s_tp1]) - btdc.estimate(indices[s_t]), indices[s_t], gamma_t, indices[s_tp1], gamma_tp1, rho_t)
+            for bgq in (bgq32, bgq64):
+                bgq.learn(indices[s_t], a_t, rho_t, gamma_t, r_tp1, indices[s_tp1], env.pi, gamma_tp1)
+            s_t = s_tp1
+            a_t = a_tp1
+            gamma_t = gamma_tp1
+
+        # The weights should stay single precision and agree with the double precision weights up to rounding:
+        for weights32, weights64 in ((btdc32.w, btdc64.w), (btdc32.z, btdc64.z), (bgq32.w, bgq64.w), (bgq32.v, bgq64.v)):
+            self.assertEqual(weights32.dtype, np.float32)
+            np.testing.assert_allclose(weights32, weights64, atol=1e-4)
+
+
+    def test_autostep_binary_tdc(self):
+        env = Collision
+        np.random.seed(3802764521)
+        num_timesteps = 5000
+
+        # With the same large initial step sizes, TDC should diverge but Autostep's stability guard should prevent it:
+        btdc = BinaryTDC(env.num_features, .3, .03, 0.9)
+        abtdc = AutostepBinaryTDC(env.num_features, .3, .03, 0.9)
+        tuned_btdc = BinaryTDC(env.num_features, .01, .001, 0.9)
+        indices = env.indices()
+        s_t = env.init()
+        a_t = np.random.choice(env.actions, p=env.mu[s_t])
+        gamma_t = 0.
+        with np.errstate(over='ignore', invalid='ignore'):
+            for t in range(num_timesteps):
+                r_tp1, s_tp1 = env.sample(s_t, a_t)
+                if s_tp1 is None:
+                    gamma_tp1 = 0.
+                    s_tp1 = env.init()
+                else:
+                    gamma_tp1 = env.gamma
+                a_tp1 = np.random.choice(env.actions, p=env.mu[s_tp1])
+                rho_t = env.rho[s_t, a_t]
+                for tdc in (btdc, abtdc, tuned_btdc):
+                    tdc.learn(r_tp1 + gamma_tp1 * tdc.estimate(indices[s_tp1]) - tdc.estimate(indices[s_t]), indices[s_t], gamma_t, indices[s_tp1], gamma_tp1, rho_t)
+                s_t = s_tp1
+                a_t = a_tp1
+                gamma_t = gamma_tp1
+
+        self.assertFalse(np.all(np.isfinite(btdc.w)))
+        # And its error should be close to that of TDC with a well tuned step size:
+        msve = [np.mean(np.square([tdc.estimate(indices[state]) for state in range(env.num_states)] - env.true_state_values)) for tdc in (abtdc, tuned_btdc)]
+        self.assertLess(msve[0], msve[1] + .1)
+        # The step sizes should have been adapted, and the guard keeps the effective step size on any state at most 1:
+        self.assertFalse(np.all(abtdc.autostep_w.alpha == .3))
+        self.assertTrue(np.all([abtdc.autostep_w.alpha[indices[state]].sum() <= 1 + 1e-12 for state in range(env.num_states)]))
+
+        # The step sizes and traces should use the weights' precision:
+        float32_tdc = AutostepBinaryTDC(env.num_features, .3, .03, .9, dtype=np.float32)
+        float32_tdc.learn(np.float32(1.), indices[0], 0., indices[1], env.gamma, 1.)
+        for array in (float32_tdc.w, float32_tdc.v, float32_tdc.autostep_w.alpha, float32_tdc.autostep_w.h, float32_tdc.autostep_v.v):
+            self.assertEqual(array.dtype, np.float32)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,31 @@
+import unittest
+import numpy as np
+from src.function_approximation.counterexample_features import CounterexampleFeatures
+from src.function_approximation.long_counterexample_features import LongCounterexampleFeatures
+from src.function_approximation.new_counterexample_features import NewCounterexampleFeatures
+from src.function_approximation.tiny_counterexample_features import TinyCounterexampleFeatures
+
+
+class CounterexampleFeaturesTests(unittest.TestCase):
+
+    def test_sparse_features(self):
+        np.random.seed(1739402281)
+        # Only LongCounterexampleFeatures' dense features support a bias unit:
+        cases = [
+            (CounterexampleFeatures(), np.random.randint(-1, 4, size=50)),
+            (LongCounterexampleFeatures(4), np.random.randint(0, 10, size=50)),
+            (LongCounterexampleFeatures(4, bias_unit=True), np.random.randint(0, 10, size=50)),
+            (NewCounterexampleFeatures(), np.random.randint(0, 5, size=50)),
+            (TinyCounterexampleFeatures(), np.random.randint(0, 4, size=50))
+        ]
+        for features, observations in cases:
+            # Each row should be the observation's dense feature vector, with only its nonzero entries stored:
+            sparse_features = features.sparse_features(observations)
+            dense_features = np.array([features.features(observation) for observation in observations]).reshape(len(observations), -1)
+            self.assertEqual(sparse_features.shape, (len(observations), features.num_features))
+            np.testing.assert_array_equal(sparse_features.toarray(), dense_features)
+            self.assertEqual(sparse_features.nnz, np.count_nonzero(dense_features))
+
+
+if __name__ == '__main__':
+    unittest.main()
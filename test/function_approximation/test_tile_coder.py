@@ -2,7 +2,7 @@ import unittest
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
-from src.function_approximation.tile_coder import TileCoder
+from src.function_approximation.tile_coder import TileCoder, LookupTileCoder, MultiTileCoder, HashingTileCoder
 
 
 class TileCoderTests(unittest.TestCase):
@@ -61,6 +61,106 @@ class TileCoderTests(unittest.TestCase):
         tolerance = .01
         self.assertLess(np.mean(y - y_hat), tolerance)
 
+    def test_encode_batch(self):
+        np.random.seed(1836104412)
+        tc = TileCoder(space=[[-1.2, .6], [-.07, .07]], num_tiles_per_dim=[5, 5], num_tilings=8, bias_unit=True)
+        observations = np.random.random_sample((1000, 2)) * (tc.space[:, 1] - tc.space[:, 0]) + tc.space[:, 0]
+
+        # The batch encoder should agree with encoding one observation at a time:
+        expected = np.array([tc.encode(obs) for obs in observations])
+        np.testing.assert_array_equal(tc.encode_batch(observations), expected)
+
+        # Narrow index types and caller-supplied output buffers:
+        self.assertEqual(tc.index_dtype, np.uint16)
+        out = np.zeros((1000, tc.num_active_features), dtype=tc.index_dtype)
+        self.assertIs(tc.encode_batch(observations, out=out), out)
+        np.testing.assert_array_equal(out, expected)
+        with self.assertRaises(ValueError):
+            tc.encode_batch(observations, out=np.zeros((999, tc.num_active_features), dtype=int))
+        big_tc = TileCoder(space=[[0, 1]] * 3, num_tiles_per_dim=[50] * 3, num_tilings=8)
+        with self.assertRaises(ValueError):
+            big_tc.encode_batch(observations[:, [0, 0, 0]], dtype=np.uint16)
+
+    def test_sparse_features(self):
+        np.random.seed(4125365112)
+        tc = TileCoder(space=[[-1.2, .6], [-.07, .07]], num_tiles_per_dim=[5, 5], num_tilings=8, bias_unit=True)
+        observations = np.random.random_sample((500, 2)) * (tc.space[:, 1] - tc.space[:, 0]) + tc.space[:, 0]
+        weights = np.random.randn(tc.total_num_tiles)
+
+        features = tc.sparse_features(observations)
+        self.assertEqual(features.shape, (500, tc.total_num_tiles))
+        np.testing.assert_array_equal(features.sum(axis=1), tc.num_active_features)
+        # One sparse mat-vec should give the same estimates as summing the active weights of each observation:
+        np.testing.assert_allclose(features @ weights, [weights[tc.encode(obs)].sum() for obs in observations])
+
+    def test_multi_tile_coder(self):
+        np.random.seed(917263001)
+        space = [[-1.2, .6], [-.07, .07]]
+        tc_a = TileCoder(space, num_tiles_per_dim=[5, 5], num_tilings=8, bias_unit=True)
+        tc_c = TileCoder(space, num_tiles_per_dim=[9, 9], num_tilings=4, bias_unit=False)
+        tc = MultiTileCoder(tc_a, tc_c, TileCoder(space, [5, 5], 8, True))
+        observations = np.random.random_sample((1000, 2)) * (tc.space[:, 1] - tc.space[:, 0]) + tc.space[:, 0]
+
+        # Each tile coder's indices should match encoding with it alone, and identical tile coders should only be encoded once:
+        indices_a, indices_c, indices_a2 = tc.encode_batch(observations)
+        np.testing.assert_array_equal(indices_a, tc_a.encode_batch(observations))
+        np.testing.assert_array_equal(indices_c, tc_c.encode_batch(observations))
+        self.assertIs(indices_a, indices_a2)
+        for obs in observations[:100]:
+            obs_indices_a, obs_indices_c, _ = tc.encode(obs)
+            np.testing.assert_array_equal(obs_indices_a, tc_a.encode(obs))
+            np.testing.assert_array_equal(obs_indices_c, tc_c.encode(obs))
+
+        with self.assertRaises(ValueError):
+            MultiTileCoder(tc_a, TileCoder([[0, 1], [0, 1]], [5, 5], 8))
+
+    def test_hashing_tile_coder(self):
+        np.random.seed(3056329751)
+
+        # A 6-dimensional space (like Acrobot's) would need 10**7 features without hashing:
+        space = np.array([[-1., 1.]] * 4 + [[-12.57, 12.57], [-28.27, 28.27]])
+        tc = HashingTileCoder(space, num_tiles_per_dim=[10] * 6, num_tilings=10, memory_size=2**16, bias_unit=True)
+        self.assertEqual(tc.total_num_tiles, 2**16 + 1)
+        self.assertEqual(tc.num_active_features, 11)
+        self.assertEqual(tc.index_dtype, np.int32)
+
+        observations = np.random.random_sample((1000, 6)) * (space[:, 1] - space[:, 0]) + space[:, 0]
+        indices = tc.encode_batch(observations)
+        np.testing.assert_array_equal(indices, np.array([tc.encode(obs) for obs in observations]))
+        self.assertTrue(np.all(indices[:, :-1] < tc.memory_size))
+        self.assertTrue(np.all(indices[:, -1] == tc.memory_size))
+
+        # Each tiling hashes into its own slice, so the indices of an observation never repeat, even in a small memory:
+        for memory_size in (2**12, 64):
+            small_indices = HashingTileCoder(space, [10] * 6, 10, memory_size=memory_size, bias_unit=True).encode_batch(observations)
+            self.assertTrue(all(len(np.unique(row)) == len(row) for row in small_indices))
+        with self.assertRaises(ValueError):
+            HashingTileCoder(space, [10] * 6, 10, memory_size=8)
+
+        # Collisions should be rare while there are far fewer tiles in use than features, and common when there are far more:
+        self.assertLess(tc.collision_rate(observations[:100]), .05)
+        self.assertGreater(HashingTileCoder(space, [10] * 6, 10, memory_size=1000).collision_rate(observations), .5)
+
+    def test_lookup_tile_coder(self):
+        np.random.seed(2208391651)
+        space = [[-1.2, .6], [-.07, .07]]
+        tc = TileCoder(space, num_tiles_per_dim=[5, 5], num_tilings=8, bias_unit=True)
+        lookup_tc = LookupTileCoder(space, num_tiles_per_dim=[5, 5], num_tilings=8, bias_unit=True)
+        self.assertEqual(lookup_tc.table.shape, (33 * 33, tc.num_active_features))
+
+        # Random observations, observations on cell boundaries (like a velocity of 0) and observations outside the space:
+        observations = np.random.random_sample((1000, 2)) * (tc.space[:, 1] - tc.space[:, 0]) + tc.space[:, 0]
+        boundaries = tc.space[:, 0] + np.random.randint(0, 33, (1000, 2)) * lookup_tc.cell_size
+        observations = np.concatenate([observations, boundaries, observations * 1.5, [[-.5, 0.]]])
+        expected = np.array([tc.encode(obs) for obs in observations])
+        np.testing.assert_array_equal(np.array([lookup_tc.encode(obs) for obs in observations]), expected)
+        np.testing.assert_array_equal(lookup_tc.encode_batch(observations), expected)
+
+        # Tables over the memory limit fall back to computing indices:
+        big_tc = LookupTileCoder([[0, 1]] * 6, num_tiles_per_dim=[10] * 6, num_tilings=10)
+        self.assertIsNone(big_tc.table)
+        np.testing.assert_array_equal(big_tc.encode([.5] * 6), TileCoder([[0, 1]] * 6, [10] * 6, 10).encode([.5] * 6))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+import numpy as np
+import scipy.stats
+from src.policy_types.continuous_policy import ContinuousPolicy
+
+
+class ContinuousPolicyTests(unittest.TestCase):
+
+    def test_batched_gaussian_policy(self):
+        np.random.seed(621843907)
+        num_features, batch_size = 3, 100
+        X = np.random.randn(batch_size, num_features)
+        A = np.random.randn(batch_size)
+        for learnable_sig in (True, False):
+            policy = ContinuousPolicy(np.random.randn(2, num_features), learnable_sig=learnable_sig, rng=np.random.default_rng(5))
+
+            # The batched kernels should match the per-state methods and scipy's density:
+            params = policy.pi_params_batch(X)
+            np.testing.assert_allclose(params, [policy.pi_params(x_t) for x_t in X])
+            np.testing.assert_allclose(policy.pi_batch(X, A), scipy.stats.norm.pdf(A, params[:, 0], params[:, 1]))
+            np.testing.assert_allclose(policy.pi_batch(X, A), [policy.pi(x_t, a_t) for x_t, a_t in zip(X, A)])
+            np.testing.assert_allclose(policy.log_pi_batch(X, A), scipy.stats.norm.logpdf(A, params[:, 0], params[:, 1]))
+
+            # The score functions should be the gradients of the log-densities with respect to the learned weights in u:
+            scores = policy.score_batch(X, A)
+            u = policy.u.copy()
+            numerical_scores = np.zeros_like(scores)
+            for index in np.ndindex(u.shape):
+                for sign in (1, -1):
+                    policy.u = u.copy()
+                    policy.u[index] += sign * 1e-6
+                    numerical_scores[:, index[0], index[1]] += sign * policy.log_pi_batch(X, A) / 2e-6
+            policy.u = u
+            np.testing.assert_allclose(scores[:, :1 + learnable_sig], numerical_scores[:, :1 + learnable_sig], rtol=1e-5, atol=1e-6)
+            if not learnable_sig:
+                np.testing.assert_array_equal(scores[:, 1], 0.)
+            # and grad_log_pi's gradients of mu and sig scaled by the derivatives of log pi with respect to mu and sig:
+            for x_t, a_t, (mu, sig), score in zip(X, A, params, scores):
+                np.testing.assert_allclose(score, policy.grad_log_pi(x_t, a_t) * np.array([[(a_t - mu) / sig**2], [((a_t - mu)**2 / sig**2 - 1) / sig]]))
+
+            # One forward pass should give the same values, with actions sampled from the injected generator:
+            all_params, actions, log_pi, grads = policy.evaluate_batch(X, rng=np.random.default_rng(8))
+            np.testing.assert_array_equal(actions, np.random.default_rng(8).normal(params[:, 0], params[:, 1]))
+            np.testing.assert_allclose(all_params, params)
+            np.testing.assert_allclose(log_pi, policy.log_pi_batch(X, actions))
+            np.testing.assert_allclose(grads, policy.score_batch(X, actions))
+
+        # Sampling shouldn't touch the global random state:
+        state = np.random.get_state()[1].copy()
+        policy.pi(X[0])
+        policy.pi_batch(X)
+        np.testing.assert_array_equal(np.random.get_state()[1], state)
+
+
+if __name__ == '__main__':
+    unittest.main()
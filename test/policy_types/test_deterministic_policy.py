@@ -0,0 +1,21 @@
+import unittest
+import numpy as np
+from src.policy_types.deterministic_policy import DeterministicPolicy
+
+
+class DeterministicPolicyTests(unittest.TestCase):
+
+    def test_batched_deterministic_policy(self):
+        np.random.seed(1849026377)
+        X = np.random.randn(50, 3)
+        policy = DeterministicPolicy(np.random.randn(3))
+        actions = policy.pi_batch(X)
+        np.testing.assert_allclose(actions, [policy.pi(x_t) for x_t in X])
+        np.testing.assert_allclose(policy.pi_params_batch(X), [policy.pi_params(x_t) for x_t in X])
+        np.testing.assert_array_equal(policy.pi_batch(X, actions), 1.)
+        np.testing.assert_array_equal(policy.pi_batch(X, actions + 1), 0.)
+        np.testing.assert_array_equal(policy.grad_pi_batch(X), [policy.grad_pi(x_t) for x_t in X])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+import numpy as np
+from scipy.sparse import csr_matrix
+from src.algorithms.ace import LinearACE
+from src.policy_types.discrete_policy import DiscretePolicy
+
+
+class DiscretePolicyTests(unittest.TestCase):
+
+    def test_batched_grad_log_pi(self):
+        np.random.seed(1496217390)
+        num_actions, num_features, batch_size = 4, 30, 200
+        policy = DiscretePolicy(np.random.randn(num_actions, num_features))
+        X = np.random.randn(batch_size, num_features) * (np.random.rand(batch_size, num_features) < .2)
+        A = np.random.randint(num_actions, size=batch_size)
+        weights = np.random.rand(batch_size)
+
+        # The per-sample score function should match the psi matrices it used to be computed with:
+        for x_t, a_t in zip(X, A):
+            psi_s_a = np.zeros((num_actions, num_features))
+            psi_s_a[a_t] = x_t
+            np.testing.assert_array_equal(policy.grad_log_pi(x_t, a_t), psi_s_a - policy.pi(x_t)[:, np.newaxis] * x_t)
+
+        # The batched versions should match the per-sample ones:
+        np.testing.assert_allclose(policy.pi_batch(X), [policy.pi(x_t) for x_t in X])
+        grads = np.stack([policy.grad_log_pi(x_t, a_t) for x_t, a_t in zip(X, A)])
+        out = np.empty((batch_size, num_actions, num_features))
+        self.assertIs(policy.grad_log_pi_batch(X, A, out=out), out)
+        np.testing.assert_allclose(out, grads)
+        for features in (X, csr_matrix(X)):
+            total = np.ones((num_actions, num_features))
+            policy.accumulate_grad_log_pi(features, A, weights, total)
+            np.testing.assert_allclose(total, 1 + np.tensordot(weights, grads, axes=1))
+
+        # LinearACE should give the same scores for its weights:
+        ace = LinearACE(num_actions, num_features, .1)
+        ace.theta = policy.u
+        np.testing.assert_array_equal(ace.grad_log_pi(X[0], A[0]), grads[0])
+        np.testing.assert_allclose(ace.grad_log_pi_batch(X, A), grads)
+        np.testing.assert_allclose(ace.accumulate_grad_log_pi(X, A, weights, np.zeros((num_actions, num_features))), np.tensordot(weights, grads, axes=1))
+
+
+if __name__ == '__main__':
+    unittest.main()
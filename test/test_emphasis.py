@@ -0,0 +1,84 @@
+import unittest
+import numpy as np
+from src import emphasis
+from src.algorithms.low_var_etd import BinaryLowVarETD
+from src.environments.collision import Collision
+
+
+class EmphasisTests(unittest.TestCase):
+
+    def test_linear_scan(self):
+        np.random.seed(1290475832)
+        for num_timesteps in (1, 2, 5, 1000):
+            a = np.random.rand(3, num_timesteps) * 1.5 * (np.random.rand(3, num_timesteps) > .1)
+            b = np.random.rand(3, num_timesteps)
+            x = np.zeros((3, num_timesteps))
+            x_tm1 = np.full(3, 2.)
+            for t in range(num_timesteps):
+                x[:, t] = x_tm1 = a[:, t] * x_tm1 + b[:, t]
+            np.testing.assert_allclose(emphasis.linear_scan(a, b, x_0=2.), x, rtol=1e-12)
+
+    def test_followon_trace_overflow(self):
+        # Long stretches of zero interest with rho * gamma > 1 overflow the scan's products of coefficients, though the
+        # followon trace stays finite, so it should still match the recurrence computed each step:
+        num_timesteps = 5000
+        rho_t, gamma_t, i_t = np.full((2, num_timesteps), 2.), np.full((2, num_timesteps), .99), np.zeros((2, num_timesteps))
+        i_t[:, -5:] = 1.
+        gamma_t[1, ::100] = 0.  # Terminations keep the second row's products finite, so it's still scanned.
+        F_t = emphasis.followon_trace(rho_t, gamma_t, i_t)
+        F, rho_tm1 = np.zeros(2), np.ones(2)
+        for t in range(num_timesteps):
+            F = rho_tm1 * gamma_t[:, t] * F + i_t[:, t]
+            np.testing.assert_allclose(F_t[:, t], F, rtol=1e-12)
+            rho_tm1 = rho_t[:, t]
+        self.assertAlmostEqual(F_t[0, -1], 30.03232816)
+
+    def test_precomputed_emphasis(self):
+        env = Collision
+        np.random.seed(3012647718)
+        num_timesteps = 5000
+        lambda_ = .3
+
+        # Generate a run of experience on the Collision problem:
+        s = np.zeros(num_timesteps, dtype=int)
+        a = np.zeros(num_timesteps, dtype=int)
+        s_tp1 = np.zeros(num_timesteps, dtype=int)
+        terminal = np.zeros(num_timesteps, dtype=bool)
+        s_t = env.init()
+        for t in range(num_timesteps):
+            a_t = np.random.choice(env.actions, p=env.mu[s_t])
+            _, next_state = env.sample(s_t, a_t)
+            terminal[t] = next_state is None
+            s[t], a[t], s_tp1[t] = s_t, a_t, env.init() if next_state is None else next_state
+            s_t = s_tp1[t]
+
+        # The precomputed columns should match the recurrences computed each step:
+        rho_t = env.rho[s, a]
+        gamma_t, gamma_tp1 = emphasis.discounts(terminal, env.gamma)
+        F_t = emphasis.followon_trace(rho_t, gamma_t, 1.)
+        M_t = emphasis.emphasis(F_t, 1., lambda_)
+        F, rho_tm1, gamma = 0., 1., 0.
+        for t in range(num_timesteps):
+            F = rho_tm1 * gamma * F + 1.
+            self.assertEqual(gamma_t[t], gamma)
+            self.assertAlmostEqual(F_t[t], F, delta=1e-12 * F)
+            self.assertAlmostEqual(M_t[t], lambda_ + (1 - lambda_) * F, delta=1e-12 * F)
+            rho_tm1, gamma = rho_t[t], gamma_tp1[t]
+
+        # A critic reading the precomputed followon trace should learn the same weights as one computing it each step:
+        indices = env.indices()
+        agent, precomputed_agent = BinaryLowVarETD(env.num_features, .01, 0.), BinaryLowVarETD(env.num_features, .01, 0.)
+        F, rho_tm1 = 0., 1.
+        for t in range(num_timesteps):
+            x_t, x_tp1 = indices[s[t]], indices[s_tp1[t]]
+            F = rho_tm1 * gamma_t[t] * F + 1.
+            r_tp1 = float(terminal[t] and a[t] == env.Action.right)
+            agent.learn(r_tp1 + gamma_tp1[t] * agent.estimate(x_tp1) - agent.estimate(x_t), x_t, gamma_t[t], 1., x_tp1, gamma_tp1[t], rho_t[t], F)
+            precomputed_agent.learn(r_tp1 + gamma_tp1[t] * precomputed_agent.estimate(x_tp1) - precomputed_agent.estimate(x_t), x_t, gamma_t[t], 1., x_tp1, gamma_tp1[t], rho_t[t], F_t[t])
+            rho_tm1 = rho_t[t]
+        np.testing.assert_allclose(precomputed_agent.v, agent.v, rtol=1e-9)
+        self.assertGreater(np.abs(agent.v).max(), 0.)
+
+
+if __name__ == '__main__':
+    unittest.main()
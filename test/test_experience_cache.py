@@ -0,0 +1,97 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from pathlib import Path
+from src import emphasis, experience_cache
+from src.function_approximation.tile_coder import TileCoder
+
+
+class ExperienceCacheTests(unittest.TestCase):
+
+    def test_tile_index_cache(self):
+        np.random.seed(2468013579)
+        tc = TileCoder(space=[[-1.2, .6], [-.07, .07]], num_tiles_per_dim=[5, 5], num_tilings=8, bias_unit=True)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # Write some fake experience in the format used by generate_experience.py:
+            experience_file = Path(temp_dir) / 'experience.npy'
+            transition_dtype = np.dtype([('s_t', float, (2,)), ('a_t', int), ('r_tp1', float), ('s_tp1', float, (2,)), ('a_tp1', int), ('terminal', bool)])
+            experience = np.lib.format.open_memmap(str(experience_file), shape=(3, 500), dtype=transition_dtype, mode='w+')
+            experience['s_t'] = np.random.random_sample((3, 500, 2)) * (tc.space[:, 1] - tc.space[:, 0]) + tc.space[:, 0]
+            experience['s_tp1'] = np.random.random_sample((3, 500, 2)) * (tc.space[:, 1] - tc.space[:, 0]) + tc.space[:, 0]
+            experience.flush()
+
+            # The cache should contain the same indices as encoding each observation:
+            cache = experience_cache.open_tile_index_cache(experience_file, tc, num_cpus=1)
+            for run_num in range(3):
+                np.testing.assert_array_equal(cache[run_num]['indices_t'], tc.encode_batch(experience[run_num]['s_t']))
+                np.testing.assert_array_equal(cache[run_num]['indices_tp1'], tc.encode_batch(experience[run_num]['s_tp1']))
+
+            # The cache is stored next to the experience file and reused:
+            cache_path = experience_cache.tile_index_cache_path(experience_file, tc)
+            self.assertEqual(cache_path.parent, experience_file.parent)
+            modified_time = os.stat(cache_path).st_mtime_ns
+            experience_cache.open_tile_index_cache(experience_file, tc, num_cpus=1)
+            self.assertEqual(os.stat(cache_path).st_mtime_ns, modified_time)
+
+            # Different tile coder settings or experience get a different cache:
+            self.assertNotEqual(experience_cache.tile_index_cache_path(experience_file, TileCoder(tc.space, [5, 5], 4, True)), cache_path)
+            experience[0, 0]['r_tp1'] = 1.
+            experience.flush()
+            self.assertNotEqual(experience_cache.tile_index_cache_path(experience_file, tc), cache_path)
+
+
+    def test_emphasis_cache(self):
+        np.random.seed(3577920164)
+        rho = lambda s, a: np.where(a == 0, 2., .5)
+        interest = lambda s, gamma: np.where(gamma == 0., 1., .5)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # Write some fake experience in the format used by generate_experience.py:
+            experience_file = Path(temp_dir) / 'experience.npy'
+            transition_dtype = np.dtype([('s_t', float, (2,)), ('a_t', int), ('r_tp1', float), ('s_tp1', float, (2,)), ('a_tp1', int), ('terminal', bool)])
+            experience = np.lib.format.open_memmap(str(experience_file), shape=(3, 500), dtype=transition_dtype, mode='w+')
+            experience['a_t'] = np.random.randint(3, size=(3, 500))
+            experience['terminal'] = np.random.rand(3, 500) < .02
+            experience.flush()
+
+            # The cache should contain the columns of each run:
+            cache = experience_cache.open_emphasis_cache(experience_file, rho, 'test', .9, interest, .2, num_cpus=1)
+            for run_num in range(3):
+                gamma_t, _ = emphasis.discounts(experience[run_num]['terminal'], .9)
+                rho_t = rho(None, experience[run_num]['a_t'])
+                i_t = interest(None, gamma_t)
+                F_t = emphasis.followon_trace(rho_t, gamma_t, i_t)
+                np.testing.assert_array_equal(cache[run_num]['rho_t'], rho_t)
+                np.testing.assert_array_equal(cache[run_num]['gamma_t'], gamma_t)
+                np.testing.assert_array_equal(cache[run_num]['i_t'], i_t)
+                np.testing.assert_array_equal(cache[run_num]['F_t'], F_t)
+                np.testing.assert_array_equal(cache[run_num]['M_t'], emphasis.emphasis(F_t, i_t, .2))
+
+            # The cache is stored next to the experience file and reused, and other settings get a different cache:
+            cache_path = experience_cache.emphasis_cache_path(experience_file, rho, 'test', .9, interest, .2)
+            self.assertEqual(cache_path.parent, experience_file.parent)
+            modified_time = os.stat(cache_path).st_mtime_ns
+            experience_cache.open_emphasis_cache(experience_file, rho, 'test', .9, interest, .2, num_cpus=1)
+            self.assertEqual(os.stat(cache_path).st_mtime_ns, modified_time)
+            for settings in (('test', .99, interest, .2), ('test', .9, interest, 0.), ('other', .9, interest, .2), ('test', .9, lambda s, gamma: np.where(gamma == 0., 1., .25), .2)):
+                self.assertNotEqual(experience_cache.emphasis_cache_path(experience_file, rho, *settings), cache_path)
+
+            # Constant interests are part of the digest, so a different one gets its own cache:
+            self.assertNotEqual(experience_cache.emphasis_cache_path(experience_file, rho, 'test', .9, 1., .2), experience_cache.emphasis_cache_path(experience_file, rho, 'test', .9, .5, .2))
+            constant_cache = experience_cache.open_emphasis_cache(experience_file, rho, 'test', .9, .5, .2, num_cpus=1)
+            np.testing.assert_array_equal(constant_cache[0]['i_t'], .5)
+            np.testing.assert_array_equal(experience_cache.open_emphasis_cache(experience_file, rho, 'test', .9, 1., .2, num_cpus=1)[0]['i_t'], 1.)
+
+            # A different target policy gets its own cache even with the same key, and the key can't be left empty:
+            other_rho = lambda s, a: np.where(a == 1, 2., .5)
+            self.assertNotEqual(experience_cache.emphasis_cache_path(experience_file, other_rho, 'test', .9, interest, .2), cache_path)
+            other_cache = experience_cache.open_emphasis_cache(experience_file, other_rho, 'test', .9, interest, .2, num_cpus=1)
+            np.testing.assert_array_equal(other_cache[1]['rho_t'], other_rho(None, experience[1]['a_t']))
+            with self.assertRaises(ValueError):
+                experience_cache.open_emphasis_cache(experience_file, rho, '', .9, interest, .2, num_cpus=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+import tempfile
+import unittest
+import gym
+import numpy as np
+from pathlib import Path
+from src import experience_cache
+from src.algorithms.ace import BinaryACE
+from src.algorithms.ace_step import ACEStep
+from src.algorithms.low_var_etd import BinaryLowVarETD
+from src.algorithms.tdc import BinaryTDC, BinaryGQ, LazyBinaryGQ
+from src.algorithms.toetd import BinaryTOETD
+from src.function_approximation.tile_coder import TileCoder
+from src.replay_pipeline import ReplayPipeline, TileIndexStage, BatchedFunction, CriticFanOut
+
+
+class ReplayPipelineTests(unittest.TestCase):
+
+    def setUp(self):
+        # Generate some experience in the format used by generate_experience.py:
+        env = gym.make('MountainCar-v0').unwrapped
+        env.seed(2750925183)
+        rng = env.np_random
+        num_timesteps = 2500
+        self.num_actions = env.action_space.n
+        self.space = np.array([env.observation_space.low, env.observation_space.high]).T
+        transition_dtype = np.dtype([('s_t', float, (2,)), ('a_t', int), ('r_tp1', float), ('s_tp1', float, (2,)), ('a_tp1', int), ('terminal', bool)])
+        self.experience = np.zeros((1, num_timesteps), dtype=transition_dtype)
+        s_t = env.reset()
+        a_t = rng.choice(self.num_actions)
+        for t in range(num_timesteps):
+            s_tp1, r_tp1, terminal, _ = env.step(a_t)
+            if terminal or t % 300 == 299:  # Also end episodes early so some transitions are terminal.
+                terminal = True
+                s_tp1 = env.reset()
+            a_tp1 = rng.choice(self.num_actions)
+            self.experience[0, t] = (s_t, a_t, r_tp1, s_tp1, a_tp1, terminal)
+            s_t, a_t = s_tp1, a_tp1
+
+    def test_replay_pipeline(self):
+        tc = TileCoder(self.space, [5, 5], 8, True)
+        interest = lambda s, g=1: 1. if g == 0. else .5
+        mu = lambda s: np.ones(self.num_actions) / self.num_actions
+        gamma = .99
+        checkpoint_interval = 1000
+
+        # Replay the run with the loop the run scripts used before the pipeline:
+        ace = ACEStep(BinaryACE(self.num_actions, tc.total_num_tiles, .1 / tc.num_active_features), BinaryTDC(tc.total_num_tiles, .1 / tc.num_active_features, .001 / tc.num_active_features, .5), 1.)
+        checkpoints = []
+        transitions = self.experience[0]
+        indices_t = tc.encode(transitions[0][0])
+        for t, transition in enumerate(transitions):
+            if t % checkpoint_interval == 0:
+                checkpoints.append((t, np.copy(ace.actor.theta)))
+            s_t, a_t, r_tp1, s_tp1, a_tp1, terminal = transition
+            gamma_tp1 = gamma if not terminal else 0
+            indices_tp1 = tc.encode(s_tp1)
+            ace.step(indices_t, a_t, r_tp1, indices_tp1, gamma_tp1, interest(s_t, ace.gamma_t), mu(s_t))
+            indices_t = indices_tp1
+        checkpoints.append((t+1, np.copy(ace.actor.theta)))
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            experience_file = Path(temp_dir) / 'experience.npy'
+            np.save(experience_file, self.experience)
+            cache = experience_cache.open_tile_index_cache(experience_file, tc, num_cpus=1)
+
+            # The pipeline should give exactly the same weights, with or without the tile index cache and for any chunk size:
+            for tile_indices, chunk_size in (([None], 1000), ([cache[0]], 1000), ([None], 7), ([cache[0]], 2500)):
+                pipeline_ace = ACEStep(BinaryACE(self.num_actions, tc.total_num_tiles, .1 / tc.num_active_features), BinaryTDC(tc.total_num_tiles, .1 / tc.num_active_features, .001 / tc.num_active_features, .5), 1.)
+                pipeline_checkpoints = []
+                def learn(indices_t, a_t, r_tp1, indices_tp1, gamma_tp1, i_t, i_tp1, mu_t):
+                    pipeline_ace.step(indices_t[0], a_t, r_tp1, indices_tp1[0], gamma_tp1, i_t, mu_t)
+                def checkpoint(t):
+                    pipeline_checkpoints.append((t, np.copy(pipeline_ace.actor.theta)))
+                pipeline = ReplayPipeline(TileIndexStage([tc], tile_indices), learn, checkpoint, checkpoint_interval, gamma, interest, mu, chunk_size=chunk_size)
+                pipeline.run(self.experience[0])
+
+                self.assertEqual([t for t, _ in pipeline_checkpoints], [t for t, _ in checkpoints])
+                for (_, theta), (_, pipeline_theta) in zip(checkpoints, pipeline_checkpoints):
+                    np.testing.assert_array_equal(theta, pipeline_theta)
+                np.testing.assert_array_equal(ace.critic.w, pipeline_ace.critic.w)
+                self.assertEqual(ace.f_t, pipeline_ace.f_t)
+
+    def test_tile_index_stage(self):
+        tc_a, tc_c = TileCoder(self.space, [5, 5], 8, True), TileCoder(self.space, [4, 4], 4, False)
+        interest = lambda s, g=1: 1. if g == 0. else .5
+        transitions = self.experience[0]
+        steps = []
+        pipeline = ReplayPipeline(TileIndexStage([tc_a, tc_c]), lambda *step: steps.append(step), lambda t: None, 1000, .9, interest, lambda s: None, next_interest=True, chunk_size=300)
+        pipeline.run(transitions)
+
+        # Each tile coder should get the indices of the chained states, and the interest should use the discounts:
+        for t, (indices_t, a_t, r_tp1, indices_tp1, gamma_tp1, i_t, i_tp1, mu_t) in enumerate(steps):
+            s_t = transitions[t - 1]['s_tp1'] if t > 0 else transitions[0]['s_t']
+            for tc, indices, next_indices in zip((tc_a, tc_c), indices_t, indices_tp1):
+                np.testing.assert_array_equal(indices, tc.encode(s_t))
+                np.testing.assert_array_equal(next_indices, tc.encode(transitions[t]['s_tp1']))
+            self.assertEqual(gamma_tp1, 0 if transitions[t]['terminal'] else .9)
+            self.assertEqual(i_t, 1. if t == 0 or transitions[t - 1]['terminal'] else .5)
+            self.assertEqual(i_tp1, 1. if transitions[t]['terminal'] else .5)
+
+    def test_lockstep_runs(self):
+        tc = TileCoder(self.space, [5, 5], 8, True)
+        interest = lambda s, g=1: 1. if g == 0. else .5
+        mu = lambda s: np.array([.5, .25, .25]) if s[1] < 0 else np.array([.25, .25, .5])
+        experience = np.concatenate((self.experience, self.experience[:, ::-1]))
+
+        # Replaying the runs in lockstep should give each run's values from replaying it alone, along a leading run axis:
+        def replay(transitions, chunk_size):
+            steps = []
+            pipeline = ReplayPipeline(TileIndexStage([tc]), lambda *step: steps.append(step), lambda t: None, 1000, .9, interest, mu, next_interest=True, chunk_size=chunk_size)
+            pipeline.run(transitions)
+            return steps
+        lockstep_steps = replay(experience, 300)
+        for run_num in range(len(experience)):
+            for step, lockstep_step in zip(replay(experience[run_num], 1000), lockstep_steps):
+                for value, lockstep_value in zip(step, lockstep_step):
+                    if isinstance(value, tuple):
+                        value, lockstep_value = value[0], lockstep_value[0]
+                    np.testing.assert_array_equal(lockstep_value[run_num], value)
+
+    def test_batched_function(self):
+        np.random.seed(2209183541)
+        states = np.random.rand(100, 2) - .5
+        gammas = np.where(np.random.rand(100) < .1, 0., .9)
+
+        # Functions written with numpy operations (or constant ones) should be called on the whole arrays after the first check:
+        for function in (lambda s, g=1: 1., lambda s, g=1: np.where(g == 0., 1., s[..., 0])):
+            batched_function = BatchedFunction(function)
+            expected = [function(s, g) for s, g in zip(states, gammas)]
+            np.testing.assert_array_equal(batched_function(states, gammas), expected)
+            self.assertTrue(batched_function.vectorized)
+            np.testing.assert_array_equal(batched_function(states[:10], gammas[:10]), expected[:10])
+
+        # Functions of single states should be called on each state:
+        for function in (lambda s, g=1: 1. if g == 0. else .5, lambda s, g=1: np.array([s[1], 1 - s[1]])):
+            batched_function = BatchedFunction(function)
+            np.testing.assert_array_equal(batched_function(states, gammas), [function(s, g) for s, g in zip(states, gammas)])
+            self.assertFalse(batched_function.vectorized)
+
+    def test_critic_fan_out(self):
+        np.random.seed(1173265803)
+        tc_a, tc_c = TileCoder(self.space, [5, 5], 8, True), TileCoder(self.space, [4, 4], 4, True)
+        actor = BinaryACE(self.num_actions, tc_a.total_num_tiles, 0.)
+        actor.theta = np.random.randn(self.num_actions, tc_a.total_num_tiles)  # A fixed target policy.
+        interest = lambda s, g=1: 1. if g == 0. else .5
+        mu = lambda s: np.ones(self.num_actions) / self.num_actions
+        gamma = .99
+        F = tc_c.total_num_tiles
+        alpha = .1 / tc_c.num_active_features
+        make_critics = lambda: [BinaryTDC(F, alpha, alpha / 10, .5), BinaryLowVarETD(F, alpha, .5), (BinaryTOETD(F, 1., alpha), .5, alpha), BinaryGQ(self.num_actions, F, alpha, alpha / 10, .5), LazyBinaryGQ(self.num_actions, F, alpha, alpha / 10, .5)]
+
+        # Replay the run once for all the critics:
+        fan_out = CriticFanOut(actor, make_critics())
+        pipeline = ReplayPipeline(TileIndexStage([tc_a, tc_c]), fan_out, fan_out.checkpoint, 1000, gamma, interest, mu, next_interest=True)
+        pipeline.run(self.experience[0])
+
+        # Replay the run separately for each critic:
+        transitions = self.experience[0]
+        for c, critic in enumerate(make_critics()):
+            critic, *parameters = critic if isinstance(critic, tuple) else (critic,)
+            gamma_t, F_t, rho_tm1 = 0., 0., 1.
+            for t, (s_t, a_t, r_tp1, s_tp1, a_tp1, terminal) in enumerate(transitions):
+                gamma_tp1 = gamma if not terminal else 0
+                indices_t_a, indices_t_c, indices_tp1_a, indices_tp1_c = tc_a.encode(s_t), tc_c.encode(s_t), tc_a.encode(s_tp1), tc_c.encode(s_tp1)
+                rho_t = actor.pi(indices_t_a)[a_t] / mu(s_t)[a_t]
+                F_t = rho_tm1 * gamma_t * F_t + interest(s_t, gamma_t)
+                if isinstance(critic, (BinaryGQ, LazyBinaryGQ)):
+                    critic.learn(indices_t_c, a_t, rho_t, gamma_t, r_tp1, indices_tp1_c, actor.pi(indices_tp1_a), gamma_tp1)
+                else:
+                    delta_t = r_tp1 + gamma_tp1 * critic.estimate(indices_tp1_c) - critic.estimate(indices_t_c)
+                    if isinstance(critic, BinaryTDC):
+                        critic.learn(delta_t, indices_t_c, gamma_t, indices_tp1_c, gamma_tp1, rho_t)
+                    elif isinstance(critic, BinaryLowVarETD):
+                        critic.learn(delta_t, indices_t_c, gamma_t, interest(s_t, gamma_t), indices_tp1_c, gamma_tp1, rho_t, F_t)
+                    else:
+                        lambda_c, alpha_c = parameters
+                        critic.learn(indices_t_c, delta_t, rho_t, gamma_tp1, lambda_c, interest(s_tp1, gamma_tp1), alpha_c)
+                gamma_t, rho_tm1 = gamma_tp1, rho_t
+
+            # Each critic should end up exactly where it would have with its own replay:
+            t, weights = fan_out.checkpoints[c][-1]
+            self.assertEqual(t, len(transitions))
+            self.assertEqual(len(fan_out.checkpoints[c]), 4)
+            np.testing.assert_array_equal(weights, critic.theta if isinstance(critic, BinaryTOETD) else critic.v if isinstance(critic, BinaryLowVarETD) else critic.w)
+
+        # Reading the ratios and followon traces from an emphasis cache should give the same weights up to rounding:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            experience_file = Path(temp_dir) / 'experience.npy'
+            np.save(experience_file, self.experience)
+            rho = lambda s, a: np.array([actor.pi(tc_a.encode(s_t))[a_t] / mu(s_t)[a_t] for s_t, a_t in zip(s, a)])
+            emphasis = experience_cache.open_emphasis_cache(experience_file, rho, 'fixed actor', gamma, lambda s, g: np.where(g == 0., 1., .5), num_cpus=1)
+            cached_fan_out = CriticFanOut(actor, make_critics(), emphasis=emphasis[0])
+            pipeline = ReplayPipeline(TileIndexStage([tc_a, tc_c]), cached_fan_out, cached_fan_out.checkpoint, 1000, gamma, interest, mu, next_interest=True)
+            pipeline.run(self.experience[0])
+        for checkpoints, cached_checkpoints in zip(fan_out.checkpoints, cached_fan_out.checkpoints):
+            np.testing.assert_allclose(cached_checkpoints[-1][1], checkpoints[-1][1], rtol=1e-9, atol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
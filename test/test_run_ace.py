@@ -0,0 +1,61 @@
+import argparse
+import unittest
+import gym
+import numpy as np
+import run_ace
+from src.function_approximation.tile_coder import TileCoder
+
+
+class RunACETests(unittest.TestCase):
+
+    def test_run_ace_batch_divergence(self):
+        # Generate two runs of experience in the format used by generate_experience.py:
+        env = gym.make('MountainCar-v0').unwrapped
+        env.seed(1862240315)
+        rng = env.np_random
+        num_runs, num_timesteps = 2, 1500
+        transition_dtype = np.dtype([('s_t', float, (2,)), ('a_t', int), ('r_tp1', float), ('s_tp1', float, (2,)), ('a_tp1', int), ('terminal', bool)])
+        experience = np.zeros((num_runs, num_timesteps), dtype=transition_dtype)
+        for run_num in range(num_runs):
+            s_t = env.reset()
+            a_t = rng.choice(env.action_space.n)
+            for t in range(num_timesteps):
+                s_tp1, r_tp1, terminal, _ = env.step(a_t)
+                if terminal:
+                    s_tp1 = env.reset()
+                a_tp1 = rng.choice(env.action_space.n)
+                experience[run_num, t] = (s_t, a_t, r_tp1, s_tp1, a_tp1, terminal)
+                s_t, a_t = s_tp1, a_tp1
+
+        # Set up the script's globals like its main block does:
+        run_ace.args = argparse.Namespace(gamma=.99, num_tiles_per_dim=[5, 5], num_tilings=8, bias_unit=1, environment='MountainCar-v0', interest_function='lambda s, g=1: 1.', behaviour_policy='lambda s: np.ones(env.action_space.n)/env.action_space.n', checkpoint_interval=500, num_evaluation_runs=1, max_timesteps=50, precision='float64', feature_major=0, adaptive_step_sizes=0, meta_step_size=.01)
+        run_ace.tc = TileCoder(np.array([env.observation_space.low, env.observation_space.high]).T, [5, 5], 8, True)
+        run_ace.num_policies = num_timesteps // run_ace.args.checkpoint_interval + 1
+        run_ace.policy_dtype = np.dtype([('timesteps', int), ('weights', float, (env.action_space.n, run_ace.tc.total_num_tiles))])
+        parameters_dtype = np.dtype([('alpha_a', float), ('alpha_w', float), ('alpha_v', float), ('lambda', float), ('eta', float), ('gamma', float), ('num_tiles_per_dim', int, (2,)), ('num_tilings', int), ('bias_unit', bool)])
+        policies_dtype = np.dtype([('parameters', parameters_dtype), ('policies', run_ace.policy_dtype, (num_runs, run_ace.num_policies))])
+        performance_dtype = np.dtype([('parameters', parameters_dtype), ('results', float, (num_runs, run_ace.num_policies, 1))])
+
+        # A stable configuration and one that diverges:
+        parameters = [(.1, .1, .01, .5, 1.), (50., 500., 5., .9, 1.)]
+        random_seeds = [2711082096, 1003298170]
+        policies, performance = np.zeros(len(parameters), dtype=policies_dtype), np.zeros(len(parameters), dtype=performance_dtype)
+        batch_policies, batch_performance = np.zeros(len(parameters), dtype=policies_dtype), np.zeros(len(parameters), dtype=performance_dtype)
+        old_settings = np.seterr()
+        try:
+            for config_num, config_parameters in enumerate(parameters):
+                for run_num, random_seed in enumerate(random_seeds):
+                    run_ace.run_ace(experience, policies, performance, run_num, config_num, config_parameters, random_seed)
+        finally:
+            np.seterr(**old_settings)
+        run_ace.run_ace_batch(experience, batch_policies, batch_performance, range(num_runs), range(len(parameters)), parameters, random_seeds)
+
+        # Both should mark the same runs as diverged and give the same results for the others:
+        self.assertTrue(np.all(np.isnan(policies[1]['policies']['weights'])))
+        self.assertTrue(np.all(np.isfinite(policies[0]['policies']['weights'])))
+        np.testing.assert_array_equal(batch_policies['policies']['weights'], policies['policies']['weights'])
+        np.testing.assert_array_equal(batch_performance['results'], performance['results'])
+
+
+if __name__ == '__main__':
+    unittest.main()